@@ -2,6 +2,11 @@ from flask import Flask
 from dotenv import load_dotenv
 from datetime import timedelta
 from app.database import init_db
+from app.services.instrument_index import start_background_index_build
+from app.services.token_manager import start_token_refresher
+from app.services.retention_service import start_retention_job
+from app.services.option_chain_service import start_chain_refresher
+from app.services.smartapi_service import load_sessions
 from app.utils.helpers import setup_logging
 from app.routes.auth import auth_bp
 from app.routes.views import views_bp
@@ -16,7 +21,22 @@ def create_app():
     
     # Initialize database
     init_db()
+
+    # Restore persisted broker sessions (stored under DATA_DIR)
+    load_sessions()
     
+    # Load the scrip master and build the instrument index off the request path
+    start_background_index_build()
+
+    # Renew broker tokens ahead of expiry so the opening minutes never wait on a re-login
+    start_token_refresher()
+
+    # Roll up and compact old api_data outside market hours
+    start_retention_job()
+
+    # Keep option chains that are being read fresh during market hours
+    start_chain_refresher()
+
     app = Flask(__name__, 
                 template_folder='../templates',
                 static_folder='../static')
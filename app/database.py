@@ -1,11 +1,144 @@
+import atexit
+import hashlib
+import queue
 import sqlite3
 import json
 import logging
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timezone
 
 DB_FILE = 'trading_data.db'
 
+# Write-behind settings for api_data: rows are committed in batches off the request path
+WRITE_BATCH_SIZE = 500  # Max rows per commit
+WRITE_FLUSH_INTERVAL = 0.5  # Max seconds a row waits before its batch is committed
+WRITE_QUEUE_MAXSIZE = 10000  # Callers block (backpressure) once this many rows are pending
+WRITE_ENQUEUE_TIMEOUT = 2.0  # Seconds a caller may block before the row is dropped
+
+# Connection tuning: WAL lets history reads run while the writer commits
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),  # WAL + NORMAL is durable across app crashes; fsync only at checkpoint
+    ('mmap_size', 256 * 1024 * 1024),
+    ('cache_size', -32000),  # ~32 MB page cache per connection
+    ('temp_store', 'MEMORY'),
+    ('busy_timeout', 5000),
+)
+
+# Schema migrations applied in order; PRAGMA user_version records the last one applied
+MIGRATIONS = [
+    (1, 'indexes for per-client history lookups', (
+        'CREATE INDEX IF NOT EXISTS idx_api_data_client_endpoint_ts ON api_data (clientcode, endpoint, timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_api_data_type_ts ON api_data (data_type, timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_documents_client_date ON documents (clientcode, upload_date)',
+        'CREATE INDEX IF NOT EXISTS idx_daily_pnl_client_date ON daily_pnl (clientcode, date)',
+        'CREATE INDEX IF NOT EXISTS idx_trade_plans_client_date ON trade_plans (clientcode, date)',
+    )),
+    (2, 'content-addressed, compressed response blobs', (
+        '''CREATE TABLE IF NOT EXISTS api_blobs (
+            hash TEXT PRIMARY KEY,
+            codec TEXT,
+            data BLOB,
+            size INTEGER
+        )''',
+        'ALTER TABLE api_data ADD COLUMN blob_hash TEXT',
+        'CREATE INDEX IF NOT EXISTS idx_api_data_blob_hash ON api_data (blob_hash)',
+    )),
+    (3, 'per-minute OHLC rollup of old marketdata snapshots', (
+        '''CREATE TABLE IF NOT EXISTS marketdata_ohlc (
+            exchange TEXT,
+            symbol_token TEXT,
+            minute TEXT,
+            open REAL,
+            high REAL,
+            low REAL,
+            close REAL,
+            volume INTEGER,
+            samples INTEGER,
+            PRIMARY KEY (exchange, symbol_token, minute)
+        )''',
+    )),
+    (4, 'incremental open interest history', (
+        '''CREATE TABLE IF NOT EXISTS oi_history (
+            exchange TEXT,
+            symbol_token TEXT,
+            interval TEXT,
+            ts INTEGER,
+            oi INTEGER,
+            PRIMARY KEY (exchange, symbol_token, interval, ts)
+        ) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS oi_coverage (
+            exchange TEXT,
+            symbol_token TEXT,
+            interval TEXT,
+            from_ts INTEGER,
+            to_ts INTEGER,
+            PRIMARY KEY (exchange, symbol_token, interval)
+        )''',
+    )),
+    (5, 'near-ATM implied volatility snapshots', (
+        '''CREATE TABLE IF NOT EXISTS iv_history (
+            underlying TEXT,
+            ts INTEGER,
+            expiry TEXT,
+            atm_strike REAL,
+            spot REAL,
+            iv REAL,
+            PRIMARY KEY (underlying, ts)
+        ) WITHOUT ROWID''',
+    )),
+]
+
+# Response blobs are stored once per distinct content and compressed above this size
+BLOB_COMPRESS_MIN_BYTES = 256
+BLOB_COMPRESS_LEVEL = 6
+RECENT_BLOB_CACHE = 4096  # Hashes the writer knows are stored, so repeat snapshots skip compression
+
+_WRITER = None
+_WRITER_LOCK = threading.Lock()
+_LOCAL = threading.local()
+
+def _apply_pragmas(conn):
+    for name, value in PRAGMAS:
+        conn.execute(f'PRAGMA {name} = {value}')
+    return conn
+
+def _connect(db_file=DB_FILE):
+    return _apply_pragmas(sqlite3.connect(db_file, timeout=30))
+
+def get_connection():
+    """Tuned connection reused by the calling thread"""
+    conn = getattr(_LOCAL, 'conn', None)
+    if conn is None:
+        conn = _LOCAL.conn = _connect()
+    return conn
+
+def _migrate(conn):
+    current = conn.execute('PRAGMA user_version').fetchone()[0]
+    for version, description, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        conn.execute('BEGIN')
+        try:
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {version}')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        logging.info(f"[DB] Applied migration {version}: {description}")
+
 def init_db():
-    conn = sqlite3.connect(DB_FILE)
+    conn = sqlite3.connect(DB_FILE, timeout=30)
+    conn.isolation_level = None  # Explicit transactions for migrations
+    # Must precede the WAL switch and first table, so it only takes effect on a fresh file;
+    # the retention job converts older files with a one-off VACUUM outside market hours
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    _apply_pragmas(conn)
     c = conn.cursor()
     c.execute('''
         CREATE TABLE IF NOT EXISTS api_data (
@@ -49,20 +182,246 @@ def init_db():
             created_at DATETIME DEFAULT CURRENT_TIMESTAMP
         )
     ''')
-    conn.commit()
+    _migrate(conn)
     conn.close()
     logging.info("Database initialized")
 
+def canonical_response(response):
+    """Canonical JSON bytes and their content hash; equal responses always hash the same"""
+    raw = json.dumps(response, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return raw, hashlib.sha256(raw).hexdigest()
+
+def encode_response(raw):
+    """Serialized response -> (codec, data)"""
+    if len(raw) < BLOB_COMPRESS_MIN_BYTES:
+        return 'raw', raw
+    return 'zlib', zlib.compress(raw, BLOB_COMPRESS_LEVEL)
+
+def decode_response(codec, data):
+    if codec == 'zlib':
+        data = zlib.decompress(data)
+    elif codec != 'raw':
+        raise ValueError(f"Unknown blob codec: {codec}")
+    return json.loads(data)
+
+class _Flush:
+    """Queue marker: set once every row enqueued before it has been committed"""
+    __slots__ = ('event',)
+
+    def __init__(self):
+        self.event = threading.Event()
+
+_STOP = object()
+
+class WriteBehindWriter:
+    """Single background thread that drains queued api_data rows and commits them with executemany"""
+
+    def __init__(self, db_file=DB_FILE):
+        self.db_file = db_file
+        self.queue = queue.Queue(maxsize=WRITE_QUEUE_MAXSIZE)
+        self.enqueued = 0
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+        self.dropped = 0
+        self.blocked = 0  # enqueues that had to wait for room in the queue
+        self.max_depth = 0
+        self.last_commit_ms = 0.0
+        self.bytes_in = 0
+        self.bytes_stored = 0
+        self.dedup_hits = 0
+        self.recent_blobs = OrderedDict()  # hash -> None, LRU of blobs known to be in api_blobs
+        self.thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+        self.thread.start()
+
+    def enqueue(self, row):
+        try:
+            self.queue.put_nowait(row)
+        except queue.Full:
+            self.blocked += 1
+            try:
+                self.queue.put(row, timeout=WRITE_ENQUEUE_TIMEOUT)
+            except queue.Full:
+                self.dropped += 1
+                logging.error(f"[DB] Write queue full, dropped {row[3]} row for {row[1]}")
+                return False
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+        return True
+
+    def flush(self, timeout=10.0):
+        """Block until everything queued so far is committed"""
+        marker = _Flush()
+        self.queue.put(marker)
+        return marker.event.wait(timeout)
+
+    def stop(self, timeout=10.0):
+        self.queue.put(_STOP)
+        self.thread.join(timeout)
+
+    def _run(self):
+        conn = _connect(self.db_file)
+        running = True
+        while running:
+            rows = []
+            markers = []
+            item = self.queue.get()
+            deadline = time.monotonic() + WRITE_FLUSH_INTERVAL
+            while True:
+                if item is _STOP:
+                    running = False
+                    break
+                if isinstance(item, _Flush):
+                    markers.append(item)
+                    break
+                rows.append(item)
+                if len(rows) >= WRITE_BATCH_SIZE:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if rows:
+                self._commit(conn, rows)
+            for marker in markers:
+                marker.event.set()
+        conn.close()
+
+    def _commit(self, conn, rows):
+        start = time.perf_counter()
+        data_rows = []
+        blobs = {}
+        bytes_in = bytes_stored = dedup_hits = 0
+        try:
+            encoded = [(row, *canonical_response(row[4])) for row in rows]
+            remembered = list({digest for _, _, digest in encoded if digest in self.recent_blobs})
+            with conn:
+                # The write lock is taken before checking, so retention's blob GC can't delete a blob
+                # between the check and the rows that reference it
+                conn.execute('BEGIN IMMEDIATE')
+                # Remembered hashes only skip compression once the blob is confirmed still stored
+                stored = set()
+                for i in range(0, len(remembered), 500):
+                    chunk = remembered[i:i + 500]
+                    stored.update(digest for (digest,) in conn.execute(
+                        f'SELECT hash FROM api_blobs WHERE hash IN ({",".join("?" * len(chunk))})', chunk
+                    ))
+                for (ts, clientcode, endpoint, data_type, _), raw, digest in encoded:
+                    bytes_in += len(raw)
+                    if digest in stored or digest in blobs:
+                        dedup_hits += 1
+                    else:
+                        codec, data = encode_response(raw)
+                        blobs[digest] = (digest, codec, data, len(raw))
+                        bytes_stored += len(data)
+                    data_rows.append((ts, clientcode, endpoint, data_type, digest))
+                conn.executemany(
+                    'INSERT OR IGNORE INTO api_blobs (hash, codec, data, size) VALUES (?, ?, ?, ?)',
+                    blobs.values()
+                )
+                conn.executemany(
+                    'INSERT INTO api_data (timestamp, clientcode, endpoint, data_type, blob_hash) VALUES (?, ?, ?, ?, ?)',
+                    data_rows
+                )
+            for digest in blobs:
+                self.recent_blobs[digest] = None
+            for digest in stored:
+                self.recent_blobs.move_to_end(digest)
+            while len(self.recent_blobs) > RECENT_BLOB_CACHE:
+                self.recent_blobs.popitem(last=False)
+            self.written += len(rows)
+            self.batches += 1
+            self.bytes_in += bytes_in
+            self.bytes_stored += bytes_stored
+            self.dedup_hits += dedup_hits
+        except Exception as e:
+            self.failed += len(rows)
+            logging.error(f"[DB] Failed to write batch of {len(rows)} rows: {e}")
+        self.last_commit_ms = (time.perf_counter() - start) * 1000
+
+    def stats(self):
+        return {
+            'queued': self.queue.qsize(),
+            'enqueued': self.enqueued,
+            'written': self.written,
+            'batches': self.batches,
+            'avg_batch': self.written / self.batches if self.batches else 0.0,
+            'failed': self.failed,
+            'dropped': self.dropped,
+            'blocked': self.blocked,
+            'max_depth': self.max_depth,
+            'last_commit_ms': self.last_commit_ms,
+            'bytes_in': self.bytes_in,
+            'bytes_stored': self.bytes_stored,
+            'dedup_hits': self.dedup_hits,
+        }
+
+def _get_writer():
+    global _WRITER
+    if _WRITER is None:
+        with _WRITER_LOCK:
+            if _WRITER is None:
+                _WRITER = WriteBehindWriter()
+    return _WRITER
+
 def store_data(clientcode, endpoint, data_type, response):
+    """
+    Queue an API response for storage; returns without touching the disk
+    The response is serialized on the writer thread, so callers must not mutate it afterwards
+    """
     try:
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute(
-            'INSERT INTO api_data (clientcode, endpoint, data_type, response) VALUES (?, ?, ?, ?)',
-            (clientcode, endpoint, data_type, json.dumps(response))
-        )
-        conn.commit()
-        conn.close()
-        logging.info(f"Stored {data_type} data for {clientcode}")
+        # Captured now so rows keep their request time however long they sit in the queue
+        timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        if _get_writer().enqueue((timestamp, clientcode, endpoint, data_type, response)):
+            logging.debug(f"Queued {data_type} data for {clientcode}")
     except Exception as e:
         logging.error(f"Failed to store data: {e}")
+
+def flush_writes(timeout=10.0):
+    """Wait for all queued api_data rows to be committed (used before reads that must see them)"""
+    if _WRITER is None:
+        return True
+    return _WRITER.flush(timeout)
+
+def get_api_history(clientcode, endpoint=None, data_type=None, since=None, limit=100):
+    """Most recent stored responses for a client, newest first (timestamps are UTC)"""
+    query = (
+        'SELECT a.timestamp, a.endpoint, a.data_type, a.response, b.codec, b.data '
+        'FROM api_data a LEFT JOIN api_blobs b ON b.hash = a.blob_hash WHERE a.clientcode = ?'
+    )
+    params = [clientcode]
+    if endpoint:
+        query += ' AND a.endpoint = ?'
+        params.append(endpoint)
+    if data_type:
+        query += ' AND a.data_type = ?'
+        params.append(data_type)
+    if since:
+        query += ' AND a.timestamp >= ?'
+        params.append(since)
+    query += ' ORDER BY a.timestamp DESC, a.id DESC LIMIT ?'
+    params.append(limit)
+    rows = get_connection().execute(query, params).fetchall()
+    return [
+        {'timestamp': ts, 'endpoint': ep, 'data_type': dt, 'response': _row_response(response, codec, data)}
+        for ts, ep, dt, response, codec, data in rows
+    ]
+
+def _row_response(response, codec, data):
+    # Rows written before blob storage keep their JSON inline in `response`
+    if codec is not None:
+        return decode_response(codec, data)
+    return json.loads(response) if response is not None else None
+
+def get_writer_stats():
+    return _WRITER.stats() if _WRITER is not None else {}
+
+@atexit.register
+def _shutdown_writer():
+    if _WRITER is not None:
+        _WRITER.stop()
+        stats = _WRITER.stats()
+        logging.info(f"[DB] Writer stopped: {stats['written']} rows written, {stats['queued']} left in queue")
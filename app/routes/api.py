@@ -1,10 +1,15 @@
 from flask import Blueprint, jsonify, request, session
-import requests
 import logging
-import os
 from datetime import datetime, timedelta
 from app.services.smartapi_service import get_session
 from app.database import store_data
+from app.services.broker_client import get_broker_client
+from app.services.market_service import get_market_quotes_batch
+from app.services.rate_limiter import PRIORITY_UI
+from app.services.historical_service import OI_FIELDS, get_oi_history, format_oi_rows
+from app.services.option_chain_service import get_chain_snapshot
+from app.services.scrip_master_service import search_instruments
+from app.utils.helpers import get_ist_now
 
 api_bp = Blueprint('api', __name__)
 
@@ -21,32 +26,17 @@ def marketdata():
         logging.warning("Marketdata access without valid session")
         return jsonify({'status': False, 'message': 'Not logged in'}), 401
     
-    smartApi = user_session['api']
-    jwt_token = user_session['tokens'].get('jwtToken', '')
-    if jwt_token.startswith('Bearer '):
-        jwt_token = jwt_token[7:]
-        
-    url = "https://apiconnect.angelone.in/rest/secure/angelbroking/market/v1/quote/"
-    headers = {
-        'Authorization': f'Bearer {jwt_token}',
-        'Content-Type': 'application/json',
-        'Accept': 'application/json',
-        'X-UserType': 'USER',
-        'X-SourceID': 'WEB',
-        'X-ClientLocalIP': 'CLIENT_LOCAL_IP',
-        'X-ClientPublicIP': 'CLIENT_PUBLIC_IP',
-        'X-MACAddress': 'MAC_ADDRESS',
-        'X-PrivateKey': os.getenv('SMARTAPI_API_KEY')
-    }
     payload = {
         "mode": "FULL",
         "exchangeTokens": {"NSE": ["99926000"]}
     }
     try:
-        r = requests.post(url, json=payload, headers=headers, timeout=10)
-        data = r.json()
-        # Store in database
         clientcode = user_session['clientcode']
+        quotes = get_market_quotes_batch(clientcode, payload['exchangeTokens'], payload['mode'], PRIORITY_UI)
+        if quotes is None:
+            return jsonify({'status': False, 'message': 'Quote fetch failed'}), 500
+        data = {'status': True, 'message': 'SUCCESS', 'data': quotes}
+        # Store in database
         store_data(clientcode, '/api/marketdata', 'marketdata', data)
     except Exception as e:
         logging.error(f"Marketdata error: {e}")
@@ -92,31 +82,13 @@ def marketdata_custom():
         logging.warning("Custom marketdata access without valid session")
         return jsonify({'status': False, 'message': 'Not logged in'}), 401
     
-    jwt_token = user_session['tokens'].get('jwtToken', '')
-    if jwt_token.startswith('Bearer '):
-        jwt_token = jwt_token[7:]
-    
-    url = "https://apiconnect.angelone.in/rest/secure/angelbroking/market/v1/quote/"
-    headers = {
-        'Authorization': f'Bearer {jwt_token}',
-        'Content-Type': 'application/json',
-        'Accept': 'application/json',
-        'X-UserType': 'USER',
-        'X-SourceID': 'WEB',
-        'X-ClientLocalIP': 'CLIENT_LOCAL_IP',
-        'X-ClientPublicIP': 'CLIENT_PUBLIC_IP',
-        'X-MACAddress': 'MAC_ADDRESS',
-        'X-PrivateKey': os.getenv('SMARTAPI_API_KEY')
-    }
-    
     payload = request.get_json()
     if not payload:
         return jsonify({'status': False, 'message': 'Invalid request body'}), 400
     
     try:
         logging.info(f"Custom market data request: {payload}")
-        r = requests.post(url, json=payload, headers=headers, timeout=10)
-        data = r.json()
+        data = get_broker_client(user_session).request('quote', payload)
         logging.info(f"Custom market data response: success={data.get('status')}")
     except Exception as e:
         logging.error(f"Custom marketdata error: {e}")
@@ -138,63 +110,19 @@ def scrip_search():
     cache_range = body.get('cache_range', True)
     
     try:
-        response = requests.get(
-            'https://margincalculator.angelbroking.com/OpenAPI_File/files/OpenAPIScripMaster.json',
-            timeout=30
-        )
-        response.raise_for_status()
-        scrips = response.json()
-        
-        options = [
-            s for s in scrips
-            if s.get('exch_seg') == 'NFO'
-            and s.get('name') == symbol
-            and s.get('instrumenttype') == 'OPTIDX'
-            and s.get('symbol', '').endswith(option_type)
-        ]
+        options = search_instruments(symbol, instrumenttype='OPTIDX', option_type=option_type)
         
         if not options:
             return jsonify({
                 'status': False,
                 'message': f'No {option_type} options found for {symbol} in scrip master'
             })
-            
-        for opt in options:
-            symbol_str = opt.get('symbol', '')
-            expiry_str = opt.get('expiry', '')
-            
-            try:
-                expiry_date = datetime.strptime(expiry_str, '%d%b%Y')
-                date_part = expiry_date.strftime('%d%b%y').upper()
-                
-                remaining = symbol_str.replace(symbol, '', 1)
-                
-                if remaining.endswith('CE'):
-                    remaining = remaining[:-2]
-                elif remaining.endswith('PE'):
-                    remaining = remaining[:-2]
-                
-                if remaining.startswith(date_part):
-                    strike_str = remaining[len(date_part):]
-                    opt['parsed_strike'] = float(strike_str) if strike_str.isdigit() else 0.0
-                else:
-                    opt['parsed_strike'] = 0.0
-            except:
-                opt['parsed_strike'] = float(opt.get('strike', 0))
         
-        today = datetime.now()
+        today = get_ist_now().date()
         
         for opt in options:
-            try:
-                expiry_str = opt.get('expiry', '')
-                opt['expiry_date'] = datetime.strptime(expiry_str, '%d%b%Y')
-                opt['days_to_expiry'] = (opt['expiry_date'] - today).days
-            except:
-                opt['expiry_date'] = None
-                opt['days_to_expiry'] = 9999
-        
-        options = [o for o in options if o['days_to_expiry'] >= 0]
-        options.sort(key=lambda x: (x['days_to_expiry'], x['parsed_strike']))
+            opt['parsed_strike'] = opt['strike']
+            opt['days_to_expiry'] = (datetime.strptime(opt['expiry_date'], '%Y-%m-%d').date() - today).days
         
         cached_options = []
         if strike:
@@ -273,11 +201,7 @@ def optionchain():
     if not user_session:
         return jsonify({'status': False, 'message': 'Not logged in'}), 401
     
-    smartApi = user_session['api']
     clientcode = user_session['clientcode']
-    jwt_token = user_session['tokens'].get('jwtToken', '')
-    if jwt_token.startswith('Bearer '):
-        jwt_token = jwt_token[7:]
     
     body = request.get_json() or {}
     exchange = body.get('exchange', 'NFO')
@@ -289,45 +213,46 @@ def optionchain():
     if not symboltoken:
         return jsonify({'status': False, 'message': 'symboltoken is required'}), 400
     
+    fields = body.get('fields') or ['time', 'oi']
+    unknown = [field for field in fields if field not in OI_FIELDS]
+    if unknown:
+        return jsonify({'status': False, 'message': f"Unknown fields: {', '.join(unknown)}"}), 400
+    
     if not fromdate or not todate:
         todate = datetime.now().strftime('%Y-%m-%d %H:%M')
         fromdate = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d %H:%M')
     
     try:
-        headers = {
-            'Authorization': f'Bearer {jwt_token}',
-            'Content-Type': 'application/json',
-            'Accept': 'application/json',
-            'X-UserType': 'USER',
-            'X-SourceID': 'WEB',
-            'X-ClientLocalIP': '',
-            'X-ClientPublicIP': '',
-            'X-MACAddress': '',
-            'X-PrivateKey': smartApi.api_key
-        }
-        
-        payload = {
-            "exchange": exchange,
-            "symboltoken": symboltoken,
-            "interval": interval,
-            "fromdate": fromdate,
-            "todate": todate
-        }
-        
-        response = requests.post(
-            'https://apiconnect.angelone.in/rest/secure/angelbroking/historical/v1/getOIData',
-            headers=headers,
-            json=payload,
-            timeout=10
-        )
-        
-        response.raise_for_status()
-        result = response.json()
-        store_data(clientcode, '/api/optionchain', 'optionchain', result)
-        return jsonify(result)
+        # Served from the local OI history; only the points after the last stored one are fetched
+        rows, fetched = get_oi_history(user_session, exchange, symboltoken, interval, fromdate, todate)
+        return jsonify({
+            'status': True,
+            'message': 'SUCCESS',
+            'data': format_oi_rows(rows, fields),
+            'fetched': fetched
+        })
         
     except Exception as e:
-        logging.error(f"Option chain error: {e}")
+        logging.error(f"Option chain error for {clientcode}: {e}")
+        return jsonify({'status': False, 'message': str(e)}), 500
+
+@api_bp.route('/optionchain/snapshot')
+def optionchain_snapshot():
+    user_session = get_valid_session()
+    if not user_session:
+        return jsonify({'status': False, 'message': 'Not logged in'}), 401
+    
+    name = request.args.get('name', 'NIFTY').upper()
+    expiry = request.args.get('expiry')
+    strikes = request.args.get('strikes', type=int)
+    
+    try:
+        snapshot = get_chain_snapshot(name, expiry, user_session['clientcode'], strikes=strikes)
+        if snapshot is None:
+            return jsonify({'status': False, 'message': f'No option chain available for {name}'}), 404
+        return jsonify({'status': True, 'message': 'SUCCESS', 'data': snapshot.to_dict(strikes)})
+    except Exception as e:
+        logging.error(f"Option chain snapshot error: {e}")
         return jsonify({'status': False, 'message': str(e)}), 500
 
 @api_bp.route('/profile')
@@ -336,25 +261,8 @@ def profile():
     if not user_session:
         return jsonify({'status': False, 'message': 'Not logged in'}), 401
     
-    jwt_token = user_session['tokens'].get('jwtToken', '')
-    if jwt_token.startswith('Bearer '):
-        jwt_token = jwt_token[7:]
-    
-    url = "https://apiconnect.angelone.in/rest/secure/angelbroking/user/v1/getProfile"
-    headers = {
-        'Authorization': f'Bearer {jwt_token}',
-        'Content-Type': 'application/json',
-        'Accept': 'application/json',
-        'X-UserType': 'USER',
-        'X-SourceID': 'WEB',
-        'X-ClientLocalIP': 'CLIENT_LOCAL_IP',
-        'X-ClientPublicIP': 'CLIENT_PUBLIC_IP',
-        'X-MACAddress': 'MAC_ADDRESS',
-        'X-PrivateKey': os.getenv('SMARTAPI_API_KEY')
-    }
     try:
-        r = requests.get(url, headers=headers, timeout=10)
-        data = r.json()
+        data = get_broker_client(user_session).request('profile')
         clientcode = user_session['clientcode']
         store_data(clientcode, '/api/profile', 'profile', data)
         return jsonify(data)
@@ -368,25 +276,8 @@ def rms():
     if not user_session:
         return jsonify({'status': False, 'message': 'Not logged in'}), 401
     
-    jwt_token = user_session['tokens'].get('jwtToken', '')
-    if jwt_token.startswith('Bearer '):
-        jwt_token = jwt_token[7:]
-    
-    url = "https://apiconnect.angelone.in/rest/secure/angelbroking/user/v1/getRMS"
-    headers = {
-        'Authorization': f'Bearer {jwt_token}',
-        'Content-Type': 'application/json',
-        'Accept': 'application/json',
-        'X-UserType': 'USER',
-        'X-SourceID': 'WEB',
-        'X-ClientLocalIP': 'CLIENT_LOCAL_IP',
-        'X-ClientPublicIP': 'CLIENT_PUBLIC_IP',
-        'X-MACAddress': 'MAC_ADDRESS',
-        'X-PrivateKey': os.getenv('SMARTAPI_API_KEY')
-    }
     try:
-        r = requests.get(url, headers=headers, timeout=10)
-        data = r.json()
+        data = get_broker_client(user_session).request('rms')
         clientcode = user_session['clientcode']
         store_data(clientcode, '/api/rms', 'rms', data)
         return jsonify(data)
@@ -400,25 +291,8 @@ def order_book():
     if not user_session:
         return jsonify({'status': False, 'message': 'Not logged in'}), 401
     
-    jwt_token = user_session['tokens'].get('jwtToken', '')
-    if jwt_token.startswith('Bearer '):
-        jwt_token = jwt_token[7:]
-    
-    url = 'https://apiconnect.angelone.in/rest/secure/angelbroking/order/v1/getOrderBook'
-    headers = {
-        'Authorization': f'Bearer {jwt_token}',
-        'Content-Type': 'application/json',
-        'Accept': 'application/json',
-        'X-UserType': 'USER',
-        'X-SourceID': 'WEB',
-        'X-ClientLocalIP': 'CLIENT_LOCAL_IP',
-        'X-ClientPublicIP': 'CLIENT_PUBLIC_IP',
-        'X-MACAddress': 'MAC_ADDRESS',
-        'X-PrivateKey': os.getenv('SMARTAPI_API_KEY')
-    }
     try:
-        r = requests.get(url, headers=headers)
-        data = r.json()
+        data = get_broker_client(user_session).request('order_book')
         clientcode = user_session['clientcode']
         store_data(clientcode, '/api/orders/book', 'orders', data)
         return jsonify(data)
@@ -432,25 +306,8 @@ def trade_book():
     if not user_session:
         return jsonify({'status': False, 'message': 'Not logged in'}), 401
     
-    jwt_token = user_session['tokens'].get('jwtToken', '')
-    if jwt_token.startswith('Bearer '):
-        jwt_token = jwt_token[7:]
-    
-    url = 'https://apiconnect.angelone.in/rest/secure/angelbroking/order/v1/getTradeBook'
-    headers = {
-        'Authorization': f'Bearer {jwt_token}',
-        'Content-Type': 'application/json',
-        'Accept': 'application/json',
-        'X-UserType': 'USER',
-        'X-SourceID': 'WEB',
-        'X-ClientLocalIP': 'CLIENT_LOCAL_IP',
-        'X-ClientPublicIP': 'CLIENT_PUBLIC_IP',
-        'X-MACAddress': 'MAC_ADDRESS',
-        'X-PrivateKey': os.getenv('SMARTAPI_API_KEY')
-    }
     try:
-        r = requests.get(url, headers=headers)
-        data = r.json()
+        data = get_broker_client(user_session).request('trade_book')
         clientcode = user_session['clientcode']
         store_data(clientcode, '/api/orders/trades', 'trades', data)
         return jsonify(data)
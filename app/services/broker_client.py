@@ -0,0 +1,179 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from app.services import rate_limiter
+from app.services.rate_limiter import PRIORITY_UI, SingleFlight
+
+BROKER_BASE_URL = 'https://apiconnect.angelone.in'
+
+# endpoint name -> (method, path)
+ENDPOINTS = {
+    'quote': ('POST', '/rest/secure/angelbroking/market/v1/quote/'),
+    'profile': ('GET', '/rest/secure/angelbroking/user/v1/getProfile'),
+    'rms': ('GET', '/rest/secure/angelbroking/user/v1/getRMS'),
+    'order_book': ('GET', '/rest/secure/angelbroking/order/v1/getOrderBook'),
+    'trade_book': ('GET', '/rest/secure/angelbroking/order/v1/getTradeBook'),
+    'oi_data': ('POST', '/rest/secure/angelbroking/historical/v1/getOIData'),
+    'candle_data': ('POST', '/rest/secure/angelbroking/historical/v1/getCandleData'),
+}
+
+DEFAULT_TIMEOUT = (3.05, 10)  # (connect, read) seconds
+POOL_MAXSIZE = 8
+LATENCY_SAMPLES = 200
+
+HEADER_TEMPLATE = {
+    'Content-Type': 'application/json',
+    'Accept': 'application/json',
+    'X-UserType': 'USER',
+    'X-SourceID': 'WEB',
+    'X-ClientLocalIP': 'CLIENT_LOCAL_IP',
+    'X-ClientPublicIP': 'CLIENT_PUBLIC_IP',
+    'X-MACAddress': 'MAC_ADDRESS',
+}
+
+_BROKER_CLIENTS = {}  # {clientcode: BrokerClient}
+_CLIENTS_LOCK = threading.Lock()
+
+# Identical in-flight requests (same client, endpoint and payload) share one response
+_SINGLE_FLIGHT = SingleFlight()
+
+LATENCY_STATS = {}  # {endpoint: {count, errors, total_ms, max_ms, samples}}
+_STATS_LOCK = threading.Lock()
+
+def _strip_bearer(jwt_token):
+    jwt_token = jwt_token or ''
+    return jwt_token[7:] if jwt_token.startswith('Bearer ') else jwt_token
+
+def _record_latency(endpoint, elapsed_ms, error=False):
+    with _STATS_LOCK:
+        stats = LATENCY_STATS.get(endpoint)
+        if stats is None:
+            stats = LATENCY_STATS[endpoint] = {
+                'count': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                'samples': deque(maxlen=LATENCY_SAMPLES)
+            }
+        stats['count'] += 1
+        stats['total_ms'] += elapsed_ms
+        stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+        stats['samples'].append(elapsed_ms)
+        if error:
+            stats['errors'] += 1
+
+def get_latency_stats():
+    """Per-endpoint latency summary (avg/p50/p95 over recent samples)"""
+    with _STATS_LOCK:
+        summary = {}
+        for endpoint, stats in LATENCY_STATS.items():
+            samples = sorted(stats['samples'])
+            summary[endpoint] = {
+                'count': stats['count'],
+                'errors': stats['errors'],
+                'avg_ms': stats['total_ms'] / stats['count'] if stats['count'] else 0.0,
+                'p50_ms': samples[len(samples) // 2] if samples else 0.0,
+                'p95_ms': samples[int(len(samples) * 0.95)] if samples else 0.0,
+                'max_ms': stats['max_ms'],
+            }
+        return summary
+
+def _build_http_session():
+    retry = Retry(
+        total=2,
+        connect=2,
+        read=1,
+        backoff_factor=0.2,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({'GET', 'POST'}),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+    http = requests.Session()
+    http.mount('https://', adapter)
+    http.mount('http://', adapter)
+    return http
+
+class BrokerClient:
+    """Keep-alive HTTP client for one logged-in Angel One account"""
+
+    def __init__(self, clientcode, jwt_token, api_key=None):
+        self.clientcode = clientcode
+        self.api_key = api_key or os.getenv('SMARTAPI_API_KEY')
+        self.http = _build_http_session()
+        self._headers = None
+        self._jwt_token = None
+        self.set_token(jwt_token)
+
+    def set_token(self, jwt_token):
+        """Swap in a new JWT; the header dict is replaced in one assignment"""
+        jwt_token = _strip_bearer(jwt_token)
+        if jwt_token == self._jwt_token:
+            return
+        headers = dict(HEADER_TEMPLATE)
+        headers['Authorization'] = f'Bearer {jwt_token}'
+        headers['X-PrivateKey'] = self.api_key
+        self._headers = headers
+        self._jwt_token = jwt_token
+
+    def request(self, endpoint, payload=None, timeout=None, raise_for_status=False, priority=PRIORITY_UI,
+                acquired=False):
+        """
+        Call a named broker endpoint and return the decoded JSON body
+        Calls are rate limited per (clientcode, endpoint class) and identical concurrent
+        calls at the same priority are coalesced into one upstream request (an exit never
+        waits behind a UI call's place in the rate-limit queue)
+        acquired=True: the caller already holds this call's rate-limit slot (the quote batcher)
+        """
+        key = (self.clientcode, endpoint, priority, json.dumps(payload, sort_keys=True))
+        return _SINGLE_FLIGHT.do(
+            key, lambda: self._request(endpoint, payload, timeout, raise_for_status, priority, acquired)
+        )
+
+    def _request(self, endpoint, payload, timeout, raise_for_status, priority, acquired):
+        method, path = ENDPOINTS[endpoint]
+        if not acquired:
+            rate_limiter.acquire(self.clientcode, endpoint, priority)
+        start = time.perf_counter()
+        error = True
+        try:
+            response = self.http.request(
+                method,
+                BROKER_BASE_URL + path,
+                json=payload if method == 'POST' else None,
+                headers=self._headers,
+                timeout=timeout or DEFAULT_TIMEOUT,
+            )
+            if raise_for_status:
+                response.raise_for_status()
+            data = response.json()
+            error = False
+            return data
+        finally:
+            _record_latency(endpoint, (time.perf_counter() - start) * 1000, error)
+
+    def close(self):
+        self.http.close()
+
+def get_broker_client(user_session):
+    """Pooled client for a session dict, created on first use and kept in sync with its JWT"""
+    clientcode = user_session['clientcode']
+    jwt_token = user_session['tokens'].get('jwtToken', '')
+    with _CLIENTS_LOCK:
+        client = _BROKER_CLIENTS.get(clientcode)
+        if client is None:
+            api = user_session.get('api')
+            client = BrokerClient(clientcode, jwt_token, os.getenv('SMARTAPI_API_KEY') or getattr(api, 'api_key', None))
+            _BROKER_CLIENTS[clientcode] = client
+    client.set_token(jwt_token)
+    return client
+
+def close_broker_client(clientcode):
+    with _CLIENTS_LOCK:
+        client = _BROKER_CLIENTS.pop(clientcode, None)
+    if client:
+        client.close()
+        logging.info(f"[BROKER] Closed HTTP pool for {clientcode}")
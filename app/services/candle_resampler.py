@@ -0,0 +1,183 @@
+import logging
+import threading
+import time
+from collections import deque
+
+TIMEFRAMES = (1, 3, 5, 15, 60)  # Minutes
+MAX_BARS = 500  # Closed bars kept per token and timeframe
+
+IST_OFFSET_SECONDS = 19800
+SESSION_OPEN = 9 * 3600 + 15 * 60  # Seconds after IST midnight; every timeframe is aligned to 09:15
+SESSION_CLOSE = 15 * 3600 + 30 * 60
+
+_RESAMPLERS = {}  # {symboltoken: TokenResampler}
+_RESAMPLERS_LOCK = threading.Lock()
+_CLOSE_LISTENERS = []  # fn(symboltoken, minutes, bar) called for every closed bar
+
+def bucket_start(ts, minutes):
+    """Epoch start of the session-aligned bucket containing ts, or None outside market hours"""
+    local = int(ts) + IST_OFFSET_SECONDS
+    day_start = local - local % 86400
+    offset = local - day_start
+    if offset < SESSION_OPEN or offset >= SESSION_CLOSE:
+        return None
+    size = minutes * 60
+    return day_start + SESSION_OPEN + (offset - SESSION_OPEN) // size * size - IST_OFFSET_SECONDS
+
+class _Bar:
+    __slots__ = ('start', 'open', 'high', 'low', 'close', 'volume')
+
+    def __init__(self, start, open_, high, low, close, volume):
+        self.start = start
+        self.open = open_
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+
+    def as_list(self):
+        return [self.start, self.open, self.high, self.low, self.close, self.volume]
+
+class TokenResampler:
+    """Forming bar plus a ring buffer of closed bars for each timeframe of one token"""
+
+    def __init__(self, symboltoken, timeframes=TIMEFRAMES, max_bars=MAX_BARS):
+        self.symboltoken = symboltoken
+        self.timeframes = timeframes
+        self.forming = {minutes: None for minutes in timeframes}
+        self.closed = {minutes: deque(maxlen=max_bars) for minutes in timeframes}
+        self.last_cumulative = None
+        self.lock = threading.Lock()
+
+    def _close(self, minutes, notify=True):
+        bar = self.forming[minutes]
+        self.forming[minutes] = None
+        self.closed[minutes].append(bar.as_list())
+        if not notify:
+            return
+        for listener in _CLOSE_LISTENERS:
+            try:
+                listener(self.symboltoken, minutes, bar.as_list())
+            except Exception as e:
+                logging.error(f"[RESAMPLER] Close listener failed for {self.symboltoken}: {e}")
+
+    def _apply(self, ts, open_, high, low, close, volume, notify=True):
+        for minutes in self.timeframes:
+            start = bucket_start(ts, minutes)
+            if start is None:
+                return
+            bar = self.forming[minutes]
+            if bar is not None and start > bar.start:
+                self._close(minutes, notify)
+                bar = None
+            if bar is None:
+                self.forming[minutes] = _Bar(start, open_, high, low, close, volume)
+            elif start == bar.start:
+                bar.high = max(bar.high, high)
+                bar.low = min(bar.low, low)
+                bar.close = close
+                bar.volume += volume
+            # Data older than the forming bar (late ticks) is ignored
+
+    def add_tick(self, price, ts=None, cumulative_volume=None, volume=0):
+        """Fold a trade/quote into every timeframe; cumulative day volume is turned into deltas"""
+        ts = time.time() if ts is None else ts
+        with self.lock:
+            if cumulative_volume is not None:
+                if self.last_cumulative is not None and cumulative_volume >= self.last_cumulative:
+                    volume = cumulative_volume - self.last_cumulative
+                self.last_cumulative = cumulative_volume
+            self._apply(ts, price, price, price, price, volume)
+
+    def add_candle(self, ts, open_, high, low, close, volume, notify=True):
+        """Fold a closed 1-minute candle (ts = its open time)"""
+        with self.lock:
+            self._apply(ts, open_, high, low, close, volume, notify)
+
+    def flush(self, now=None, notify=True):
+        """Close bars whose bucket has ended even if no later tick arrived"""
+        now = time.time() if now is None else now
+        with self.lock:
+            for minutes in self.timeframes:
+                bar = self.forming[minutes]
+                if bar is not None and now >= bar.start + minutes * 60:
+                    self._close(minutes, notify)
+
+    def last_bar_start(self):
+        """Open time of the newest 1-minute bar (forming or closed), or None"""
+        with self.lock:
+            minutes = self.timeframes[0]
+            if self.forming[minutes] is not None:
+                return self.forming[minutes].start
+            return self.closed[minutes][-1][0] if self.closed[minutes] else None
+
+    def bars(self, minutes, n=None, include_forming=False):
+        """[[ts, o, h, l, c, v], ...] oldest first"""
+        with self.lock:
+            result = list(self.closed[minutes])
+            if include_forming and self.forming[minutes] is not None:
+                result.append(self.forming[minutes].as_list())
+        return result[-n:] if n else result
+
+def get_resampler(symboltoken, create=True):
+    symboltoken = str(symboltoken)
+    resampler = _RESAMPLERS.get(symboltoken)
+    if resampler is None and create:
+        with _RESAMPLERS_LOCK:
+            resampler = _RESAMPLERS.setdefault(symboltoken, TokenResampler(symboltoken))
+    return resampler
+
+def is_tracked(symboltoken):
+    return str(symboltoken) in _RESAMPLERS
+
+def seed_from_candles(symboltoken, candles):
+    """
+    Build every timeframe from historical 1-minute candles (broker lists or candle_store array)
+    Listeners aren't told about these bars; consumers seed their own state from the same history
+    """
+    resampler = get_resampler(symboltoken)
+    for ts, open_, high, low, close, volume in _iter_candles(candles):
+        resampler.add_candle(ts, open_, high, low, close, volume, notify=False)
+    resampler.flush(notify=False)
+    return resampler
+
+def catch_up(symboltoken, candles):
+    """
+    Fold 1-minute candles newer than the token's last bar (a gap no quotes covered)
+    Backfilled bars close silently, like seeding: listeners only hear about live closes
+    """
+    resampler = get_resampler(symboltoken)
+    last = resampler.last_bar_start()
+    added = 0
+    for ts, open_, high, low, close, volume in _iter_candles(candles):
+        if last is None or ts > last:
+            resampler.add_candle(ts, open_, high, low, close, volume, notify=False)
+            added += 1
+    return added
+
+def _iter_candles(candles):
+    from app.services.candle_store import parse_candle_time
+    if hasattr(candles, 'dtype') and candles.dtype.names:
+        for row in candles:
+            yield int(row['ts']), float(row['open']), float(row['high']), float(row['low']), \
+                float(row['close']), float(row['volume'])
+    else:
+        for ts, open_, high, low, close, volume in candles:
+            yield parse_candle_time(ts), float(open_), float(high), float(low), float(close), float(volume or 0)
+
+def on_quote(item, ts=None):
+    """Feed a FULL/OHLC quote item into its token's resampler if that token is being tracked"""
+    resampler = get_resampler(item.get('symbolToken'), create=False)
+    if resampler is None or item.get('ltp') is None:
+        return
+    resampler.add_tick(float(item['ltp']), ts, item.get('tradeVolume'))
+
+def get_bars(symboltoken, minutes, n=None, include_forming=False):
+    resampler = get_resampler(symboltoken, create=False)
+    if resampler is None:
+        return []
+    resampler.flush()
+    return resampler.bars(minutes, n, include_forming)
+
+def add_close_listener(callback):
+    _CLOSE_LISTENERS.append(callback)
@@ -0,0 +1,195 @@
+import logging
+import os
+import threading
+from datetime import datetime, date, timedelta
+import numpy as np
+from app.utils.helpers import IST
+
+CANDLE_STORE_DIR = os.getenv('CANDLE_STORE_DIR', 'candle_store')
+
+# One row per candle; ts is epoch seconds of the candle open
+CANDLE_DTYPE = np.dtype([
+    ('ts', '<i8'),
+    ('open', '<f8'),
+    ('high', '<f8'),
+    ('low', '<f8'),
+    ('close', '<f8'),
+    ('volume', '<i8'),
+])
+
+IST_OFFSET_SECONDS = 19800  # IST has no DST, so day boundaries are a fixed offset from UTC
+EPOCH = date(1970, 1, 1)
+
+COMPLETE_SUFFIX = '.npy'
+PARTIAL_SUFFIX = '.partial.npy'  # Day still trading (or fetched mid-session); may be rewritten
+
+_DAY_INDEX = {}  # {(exchange, token, interval): {date: complete(bool)}}, loaded from disk on first use
+_INDEX_LOCK = threading.Lock()
+
+def _series_dir(exchange, token, interval):
+    return os.path.join(CANDLE_STORE_DIR, exchange, str(token), interval)
+
+def _day_path(exchange, token, interval, day, complete):
+    suffix = COMPLETE_SUFFIX if complete else PARTIAL_SUFFIX
+    return os.path.join(_series_dir(exchange, token, interval), day.isoformat() + suffix)
+
+def _load_index(key):
+    days = {}
+    directory = _series_dir(*key)
+    if os.path.isdir(directory):
+        for filename in os.listdir(directory):
+            if filename.endswith(PARTIAL_SUFFIX):
+                days.setdefault(date.fromisoformat(filename[:-len(PARTIAL_SUFFIX)]), False)
+            elif filename.endswith(COMPLETE_SUFFIX):
+                days[date.fromisoformat(filename[:-len(COMPLETE_SUFFIX)])] = True
+    return days
+
+def _series_index(exchange, token, interval):
+    key = (exchange, str(token), interval)
+    with _INDEX_LOCK:
+        days = _DAY_INDEX.get(key)
+        if days is None:
+            days = _DAY_INDEX[key] = _load_index(key)
+        return days
+
+def parse_candle_time(value):
+    """Broker candle timestamp ('2024-01-05T09:15:00+05:30') -> epoch seconds"""
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, datetime):
+        moment = value if value.tzinfo else IST.localize(value)
+    else:
+        moment = datetime.fromisoformat(str(value))
+        if moment.tzinfo is None:
+            moment = IST.localize(moment)
+    return int(moment.timestamp())
+
+def candles_to_array(candles):
+    """[[ts, o, h, l, c, v], ...] -> CANDLE_DTYPE array sorted by ts with duplicate timestamps removed"""
+    array = np.empty(len(candles), dtype=CANDLE_DTYPE)
+    for i, (ts, o, h, l, c, v) in enumerate(candles):
+        array[i] = (parse_candle_time(ts), o, h, l, c, v)
+    if len(array) > 1:
+        array.sort(order='ts', kind='stable')
+        # Keep the last occurrence of a timestamp (a refetch supersedes the earlier bar)
+        keep = np.append(array['ts'][1:] != array['ts'][:-1], True)
+        array = array[keep]
+    return array
+
+def array_to_candles(array):
+    """CANDLE_DTYPE array -> broker-style [[iso_ts, o, h, l, c, v], ...] for existing list-based code"""
+    return [
+        [datetime.fromtimestamp(int(row['ts']), IST).isoformat(), float(row['open']), float(row['high']),
+         float(row['low']), float(row['close']), int(row['volume'])]
+        for row in array
+    ]
+
+def trading_day(ts):
+    return EPOCH + timedelta(days=(int(ts) + IST_OFFSET_SECONDS) // 86400)
+
+def _day_bounds(day):
+    start = IST.localize(datetime(day.year, day.month, day.day))
+    return int(start.timestamp()), int((start + timedelta(days=1)).timestamp())
+
+def write_day(exchange, token, interval, day, candles, complete=True):
+    """Store one IST trading day of candles; the write is atomic and a complete day replaces any partial one"""
+    if not complete and day_status(exchange, token, interval, day) == 'complete':
+        return 0
+    array = candles if isinstance(candles, np.ndarray) else candles_to_array(candles)
+    array = np.ascontiguousarray(array, dtype=CANDLE_DTYPE)
+    start, end = _day_bounds(day)
+    array = array[(array['ts'] >= start) & (array['ts'] < end)]
+
+    directory = _series_dir(exchange, token, interval)
+    os.makedirs(directory, exist_ok=True)
+    path = _day_path(exchange, token, interval, day, complete)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+    if complete:
+        partial = _day_path(exchange, token, interval, day, False)
+        if os.path.exists(partial):
+            os.remove(partial)
+
+    days = _series_index(exchange, token, interval)
+    with _INDEX_LOCK:
+        days[day] = complete
+    return len(array)
+
+def write_candles(exchange, token, interval, candles, complete_before=None):
+    """
+    Split candles by IST day and store each day
+    Days before `complete_before` (default: today IST) are stored as complete, later ones as partial
+    """
+    array = candles if isinstance(candles, np.ndarray) else candles_to_array(candles)
+    if not len(array):
+        return 0
+    complete_before = complete_before or datetime.now(IST).date()
+    day_numbers = (array['ts'] + IST_OFFSET_SECONDS) // 86400
+    written = 0
+    for day_number in np.unique(day_numbers):
+        day = EPOCH + timedelta(days=int(day_number))
+        written += write_day(exchange, token, interval, day, array[day_numbers == day_number], day < complete_before)
+    return written
+
+def day_status(exchange, token, interval, day):
+    """'complete', 'partial' or None if the day isn't stored"""
+    complete = _series_index(exchange, token, interval).get(day)
+    if complete is None:
+        return None
+    return 'complete' if complete else 'partial'
+
+def list_days(exchange, token, interval, complete_only=False):
+    days = _series_index(exchange, token, interval)
+    with _INDEX_LOCK:
+        return sorted(day for day, complete in days.items() if complete or not complete_only)
+
+def read_day(exchange, token, interval, day, mmap=True):
+    """Memory-mapped (read-only) candles for a stored day, or None"""
+    complete = _series_index(exchange, token, interval).get(day)
+    if complete is None:
+        return None
+    path = _day_path(exchange, token, interval, day, complete)
+    try:
+        return np.load(path, mmap_mode='r' if mmap else None)
+    except FileNotFoundError:
+        # Another writer promoted or replaced the file; forget the stale entry and let the caller refetch
+        with _INDEX_LOCK:
+            _DAY_INDEX.pop((exchange, str(token), interval), None)
+        return None
+    except ValueError:
+        # np.load refuses to memory-map an empty array
+        return np.load(path)
+
+def iter_range(exchange, token, interval, start, end):
+    """Yield (day, view) for stored days overlapping [start, end); views are zero-copy slices of the mapped files"""
+    start_ts, end_ts = parse_candle_time(start), parse_candle_time(end)
+    for day in list_days(exchange, token, interval):
+        day_start, day_end = _day_bounds(day)
+        if day_end <= start_ts or day_start >= end_ts:
+            continue
+        array = read_day(exchange, token, interval, day)
+        if array is None or not len(array):
+            continue
+        lo, hi = np.searchsorted(array['ts'], [start_ts, end_ts])
+        if hi > lo:
+            yield day, array[lo:hi]
+
+def read_range(exchange, token, interval, start, end):
+    """All stored candles in [start, end) as one array (a copy when it spans several days)"""
+    views = [view for _, view in iter_range(exchange, token, interval, start, end)]
+    if not views:
+        return np.empty(0, dtype=CANDLE_DTYPE)
+    if len(views) == 1:
+        return views[0]
+    return np.concatenate(views)
+
+def delete_series(exchange, token, interval):
+    directory = _series_dir(exchange, token, interval)
+    with _INDEX_LOCK:
+        _DAY_INDEX.pop((exchange, str(token), interval), None)
+    if os.path.isdir(directory):
+        for filename in os.listdir(directory):
+            os.remove(os.path.join(directory, filename))
+        logging.info(f"[CANDLES] Deleted stored series {exchange}:{token} {interval}")
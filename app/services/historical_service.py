@@ -0,0 +1,243 @@
+import logging
+from datetime import datetime, date, timedelta
+from app.database import get_connection
+from app.services import candle_store
+from app.services.smartapi_service import get_primary_session, get_session_for_client
+from app.services.broker_client import get_broker_client
+from app.services.rate_limiter import PRIORITY_MONITOR, PRIORITY_UI
+from app.utils.helpers import IST, get_ist_now
+
+# getCandleData caps the span of a single request per interval (days)
+INTERVAL_MAX_DAYS = {
+    'ONE_MINUTE': 30,
+    'THREE_MINUTE': 60,
+    'FIVE_MINUTE': 100,
+    'TEN_MINUTE': 100,
+    'FIFTEEN_MINUTE': 200,
+    'THIRTY_MINUTE': 200,
+    'ONE_HOUR': 400,
+    'ONE_DAY': 2000,
+}
+
+SESSION_OPEN = (9, 15)
+SESSION_CLOSE = (15, 30)
+SETTLE_MINUTES = 5  # Today's candles are only final this long after the close
+LOOKAHEAD_DAYS = 4  # Extra calendar days requested past a segment so a later session proves its empty days
+
+CACHE_STATS = {'days_hit': 0, 'days_fetched': 0, 'broker_calls': 0, 'errors': 0}
+
+OI_FIELDS = ('time', 'oi', 'oi_change')
+
+def _resolve_session(clientcode):
+    return (get_session_for_client(clientcode) if clientcode else None) or get_primary_session()
+
+def _to_ist(value):
+    if isinstance(value, datetime):
+        return value if value.tzinfo else IST.localize(value)
+    if isinstance(value, date):
+        return IST.localize(datetime(value.year, value.month, value.day))
+    return datetime.fromtimestamp(candle_store.parse_candle_time(value), IST)
+
+def _session_final(day, now):
+    """True once a day's candles can no longer change"""
+    if day < now.date():
+        return True
+    settled = now.replace(hour=SESSION_CLOSE[0], minute=SESSION_CLOSE[1], second=0, microsecond=0)
+    return day == now.date() and now >= settled + timedelta(minutes=SETTLE_MINUTES)
+
+def _missing_segments(wanted, missing, max_days):
+    """Group missing days into runs of consecutive trading days no longer than one request allows"""
+    segments = []
+    previous_missing = False
+    for day in wanted:
+        if day not in missing:
+            previous_missing = False
+            continue
+        if previous_missing and (day - segments[-1][0]).days < max_days:
+            segments[-1].append(day)
+        else:
+            segments.append([day])
+        previous_missing = True
+    return segments
+
+def _fetch_segment(client, exchange, token, interval, first_day, last_day, priority):
+    payload = {
+        'exchange': exchange,
+        'symboltoken': str(token),
+        'interval': interval,
+        'fromdate': f"{first_day.isoformat()} {SESSION_OPEN[0]:02d}:{SESSION_OPEN[1]:02d}",
+        'todate': f"{last_day.isoformat()} {SESSION_CLOSE[0]:02d}:{SESSION_CLOSE[1]:02d}",
+    }
+    CACHE_STATS['broker_calls'] += 1
+    data = client.request('candle_data', payload, priority=priority)
+    if not data or not data.get('status'):
+        message = data.get('message') if isinstance(data, dict) else 'Empty response'
+        raise RuntimeError(f"getCandleData failed for {exchange}:{token} {interval}: {message}")
+    return data.get('data') or []
+
+def get_candles(clientcode, exchange, token, interval, from_dt, to_dt, priority=PRIORITY_MONITOR, as_array=False):
+    """
+    Candles for [from_dt, to_dt] served from the candle store, fetching only the days it lacks
+    Finished sessions are stored permanently; today's session is refetched until it settles, and
+    an empty day is only final once the broker has returned candles from a later session
+    Returns broker-style [[ts, o, h, l, c, v], ...] or a CANDLE_DTYPE array with as_array=True
+    """
+    start = _to_ist(from_dt)
+    end = _to_ist(to_dt)
+    now = get_ist_now()
+    token = str(token)
+
+    wanted = []
+    day = start.date()
+    while day <= min(end.date(), now.date()):
+        if day.weekday() < 5:
+            wanted.append(day)
+        day += timedelta(days=1)
+
+    missing = {day for day in wanted if candle_store.day_status(exchange, token, interval, day) != 'complete'}
+    CACHE_STATS['days_hit'] += len(wanted) - len(missing)
+
+    if missing:
+        user_session = _resolve_session(clientcode)
+        if not user_session:
+            logging.warning(f"[CANDLES] No live session to fetch {exchange}:{token} {interval}")
+        else:
+            client = get_broker_client(user_session)
+            max_days = INTERVAL_MAX_DAYS.get(interval, 30)
+            for segment in _missing_segments(wanted, missing, max_days):
+                last_day = min(segment[-1] + timedelta(days=LOOKAHEAD_DAYS),
+                               segment[0] + timedelta(days=max_days - 1), now.date())
+                try:
+                    candles = _fetch_segment(client, exchange, token, interval, segment[0], last_day, priority)
+                except Exception as e:
+                    CACHE_STATS['errors'] += 1
+                    logging.error(f"[CANDLES] {e}")
+                    continue
+                array = candle_store.candles_to_array(candles)
+                day_numbers = (array['ts'] + candle_store.IST_OFFSET_SECONDS) // 86400
+                last_traded = int(day_numbers.max()) if len(day_numbers) else None
+                for day in segment:
+                    day_number = (day - candle_store.EPOCH).days
+                    day_candles = array[day_numbers == day_number]
+                    final = _session_final(day, now)
+                    if final and not len(day_candles) and (last_traded is None or last_traded < day_number):
+                        # Nothing after it either: could be a holiday or a truncated/empty response,
+                        # so store it as partial and ask again next time
+                        final = False
+                    candle_store.write_day(exchange, token, interval, day, day_candles, complete=final)
+                array = array[day_numbers <= (segment[-1] - candle_store.EPOCH).days]
+                CACHE_STATS['days_fetched'] += len(segment)
+                logging.info(f"[CANDLES] Fetched {len(array)} {interval} candles for {exchange}:{token} "
+                             f"{segment[0]}..{segment[-1]}")
+
+    # to_dt is inclusive, matching getCandleData's todate
+    array = candle_store.read_range(exchange, token, interval, start, int(end.timestamp()) + 1)
+    return array if as_array else candle_store.array_to_candles(array)
+
+def _broker_time(ts):
+    return datetime.fromtimestamp(ts, IST).strftime('%Y-%m-%d %H:%M')
+
+def _fetch_oi(client, exchange, token, interval, from_ts, to_ts, priority):
+    payload = {
+        'exchange': exchange,
+        'symboltoken': token,
+        'interval': interval,
+        'fromdate': _broker_time(from_ts),
+        'todate': _broker_time(to_ts),
+    }
+    CACHE_STATS['broker_calls'] += 1
+    data = client.request('oi_data', payload, raise_for_status=True, priority=priority)
+    if not data or not data.get('status'):
+        message = data.get('message') if isinstance(data, dict) else 'Empty response'
+        raise RuntimeError(f"getOIData failed for {exchange}:{token} {interval}: {message}")
+    return [(candle_store.parse_candle_time(item['time']), item.get('oi')) for item in data.get('data') or []]
+
+def get_oi_history(user_session, exchange, token, interval, from_dt, to_dt, priority=PRIORITY_UI):
+    """
+    OI points for [from_dt, to_dt] from the oi_history table
+    Only the span before the stored range and the span after its last point are requested upstream
+    Returns ([(ts, oi), ...], number of points fetched)
+    """
+    token = str(token)
+    start_ts = int(_to_ist(from_dt).timestamp())
+    end_ts = min(int(_to_ist(to_dt).timestamp()), int(get_ist_now().timestamp()))
+    key = (exchange, token, interval)
+    conn = get_connection()
+
+    coverage = conn.execute(
+        'SELECT from_ts, to_ts FROM oi_coverage WHERE exchange = ? AND symbol_token = ? AND interval = ?', key
+    ).fetchone()
+    spans = []
+    # Coverage is one contiguous range; a window that doesn't touch it starts a new range
+    # rather than fetching (and claiming) the whole gap in between
+    disjoint = coverage is not None and (start_ts > coverage[1] or end_ts < coverage[0])
+    if coverage is None or disjoint:
+        spans.append((start_ts, end_ts))
+    else:
+        covered_from, covered_to = coverage
+        if start_ts < covered_from:
+            spans.append((start_ts, covered_from))
+        if end_ts > covered_to:
+            # Restart from the last stored point so a still-forming bar gets its final value
+            last_ts = conn.execute(
+                'SELECT MAX(ts) FROM oi_history WHERE exchange = ? AND symbol_token = ? AND interval = ?', key
+            ).fetchone()[0]
+            spans.append((max(min(last_ts or covered_to, covered_to), start_ts), end_ts))
+
+    fetched = 0
+    if spans:
+        client = get_broker_client(user_session)
+        for span_from, span_to in spans:
+            try:
+                points = _fetch_oi(client, exchange, token, interval, span_from, span_to, priority)
+            except Exception as e:
+                CACHE_STATS['errors'] += 1
+                if coverage is None or disjoint:
+                    raise
+                logging.error(f"[OI] {e}; serving stored history")
+                continue
+            with conn:
+                conn.executemany(
+                    'INSERT OR REPLACE INTO oi_history (exchange, symbol_token, interval, ts, oi) VALUES (?, ?, ?, ?, ?)',
+                    [(exchange, token, interval, ts, oi) for ts, oi in points]
+                )
+                if disjoint:
+                    conn.execute(
+                        'UPDATE oi_coverage SET from_ts = ?, to_ts = ? WHERE exchange = ? AND symbol_token = ? AND interval = ?',
+                        (span_from, span_to, *key)
+                    )
+                else:
+                    conn.execute(
+                        '''INSERT INTO oi_coverage (exchange, symbol_token, interval, from_ts, to_ts) VALUES (?, ?, ?, ?, ?)
+                           ON CONFLICT (exchange, symbol_token, interval) DO UPDATE SET
+                               from_ts = MIN(from_ts, excluded.from_ts),
+                               to_ts = MAX(to_ts, excluded.to_ts)''',
+                        (*key, span_from, span_to)
+                    )
+            fetched += len(points)
+
+    rows = conn.execute(
+        'SELECT ts, oi FROM oi_history WHERE exchange = ? AND symbol_token = ? AND interval = ? '
+        'AND ts BETWEEN ? AND ? ORDER BY ts',
+        (*key, start_ts, end_ts)
+    ).fetchall()
+    return rows, fetched
+
+def format_oi_rows(rows, fields=OI_FIELDS[:2]):
+    """(ts, oi) rows -> list of dicts restricted to `fields` (time, oi, oi_change)"""
+    result = []
+    previous = None
+    for ts, oi in rows:
+        row = {}
+        if 'time' in fields:
+            row['time'] = datetime.fromtimestamp(ts, IST).isoformat()
+        if 'oi' in fields:
+            row['oi'] = oi
+        if 'oi_change' in fields:
+            row['oi_change'] = oi - previous if previous is not None and oi is not None else None
+        previous = oi
+        result.append(row)
+    return result
+
+def get_cache_stats():
+    return dict(CACHE_STATS)
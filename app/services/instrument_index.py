@@ -0,0 +1,134 @@
+import logging
+import sqlite3
+import threading
+from bisect import bisect_left
+from app.services import scrip_master_service
+from app.utils.helpers import get_ist_now
+
+# Current published index; swapped as a whole so readers never see a partial build
+_INDEX = None
+_INDEX_LOCK = threading.Lock()
+_BUILD_THREAD = None
+
+class InstrumentIndex:
+    """Immutable multi-key view over the stored scrip master"""
+
+    def __init__(self, rows, built_for=None):
+        self.built_for = built_for
+        self.by_symbol = {}
+        self.by_token = {}
+        self.by_name = {}
+        self.by_contract = {}  # {(name, expiry_date, strike, option_type): row}
+        self.strikes = {}  # {(name, expiry_date, option_type): sorted [strikes]}
+        self.expiries = {}  # {name: sorted [expiry_date]}
+
+        for row in rows:
+            symbol = (row.get('symbol') or '').upper()
+            self.by_token[(row.get('exch_seg'), row.get('token'))] = row
+            if row.get('exch_seg') == 'NFO':
+                self.by_symbol[symbol] = row
+                self.by_name.setdefault((row.get('name') or '').upper(), row)
+            else:
+                self.by_symbol.setdefault(symbol, row)
+
+            option_type = row.get('option_type')
+            expiry_date = row.get('expiry_date')
+            if option_type and expiry_date and row.get('strike') is not None:
+                name = row.get('name')
+                self.by_contract[(name, expiry_date, row['strike'], option_type)] = row
+                self.strikes.setdefault((name, expiry_date, option_type), []).append(row['strike'])
+                self.expiries.setdefault(name, set()).add(expiry_date)
+
+        for key in self.strikes:
+            self.strikes[key] = sorted(set(self.strikes[key]))
+        self.expiries = {name: sorted(dates) for name, dates in self.expiries.items()}
+
+    def __len__(self):
+        return len(self.by_token)
+
+    def get_by_symbol(self, tradingsymbol):
+        return self.by_symbol.get(tradingsymbol.upper())
+
+    def get_by_token(self, token, exch_seg='NFO'):
+        return self.by_token.get((exch_seg, str(token)))
+
+    def get_contract(self, name, expiry_date, strike, option_type):
+        return self.by_contract.get((name, expiry_date, float(strike), option_type))
+
+    def get_expiries(self, name, from_date=None):
+        expiries = self.expiries.get(name, [])
+        if from_date:
+            return expiries[bisect_left(expiries, from_date):]
+        return expiries
+
+    def nearest_strike(self, name, expiry_date, spot, option_type='CE'):
+        """Strike closest to spot for the given expiry (ties go to the lower strike)"""
+        strikes = self.strikes.get((name, expiry_date, option_type))
+        if not strikes:
+            return None
+        i = bisect_left(strikes, spot)
+        if i == 0:
+            return strikes[0]
+        if i == len(strikes):
+            return strikes[-1]
+        before, after = strikes[i - 1], strikes[i]
+        return before if spot - before <= after - spot else after
+
+    def strikes_around_atm(self, name, expiry_date, spot, n=3, option_type='CE'):
+        """ATM strike plus n strikes on either side"""
+        strikes = self.strikes.get((name, expiry_date, option_type))
+        if not strikes:
+            return []
+        atm = self.nearest_strike(name, expiry_date, spot, option_type)
+        i = bisect_left(strikes, atm)
+        return strikes[max(0, i - n):i + n + 1]
+
+    def contracts_around_atm(self, name, expiry_date, spot, n=3, option_type='CE'):
+        return [
+            self.by_contract[(name, expiry_date, strike, option_type)]
+            for strike in self.strikes_around_atm(name, expiry_date, spot, n, option_type)
+        ]
+
+def build_instrument_index():
+    """Build a new index from the scrip master store and publish it"""
+    global _INDEX
+    built_for = get_ist_now().date().isoformat()
+    scrip_master_service.ensure_scrip_master()
+    conn = sqlite3.connect(scrip_master_service.SCRIP_DB_FILE, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        rows = [dict(row) for row in conn.execute('SELECT * FROM instruments')]
+    finally:
+        conn.close()
+
+    index = InstrumentIndex(rows, built_for)
+    with _INDEX_LOCK:
+        _INDEX = index
+    logging.info(f"[SCRIP] Instrument index built: {len(index)} instruments")
+    return index
+
+def get_instrument_index():
+    """Return the published index, building it synchronously on first use"""
+    index = _INDEX
+    if index is None:
+        return build_instrument_index()
+    if index.built_for != get_ist_now().date().isoformat():
+        # New trading day: keep serving yesterday's index while today's builds
+        start_background_index_build()
+    return index
+
+def start_background_index_build():
+    """Build the index in a daemon thread so startup isn't blocked"""
+    global _BUILD_THREAD
+    if _BUILD_THREAD and _BUILD_THREAD.is_alive():
+        return
+    def _build():
+        try:
+            build_instrument_index()
+        except Exception as e:
+            logging.error(f"[SCRIP] Background index build failed: {e}")
+    _BUILD_THREAD = threading.Thread(target=_build, name='instrument-index', daemon=True)
+    _BUILD_THREAD.start()
+
+# Publish a fresh index whenever a scrip master refresh changes the stored instruments
+scrip_master_service.add_refresh_listener(build_instrument_index)
@@ -0,0 +1,126 @@
+import logging
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from collections import deque
+from app.database import get_connection
+
+IV_UNDERLYINGS = ('NIFTY', 'BANKNIFTY')  # Underlyings whose near-ATM IV is snapshotted
+IV_SNAPSHOT_INTERVAL = 300  # Seconds between snapshots per underlying during market hours
+IV_NEAR_ATM_STRIKES = 2  # Strikes either side of ATM averaged into the snapshot IV
+IV_MIN_DAYS_TO_EXPIRY = 2  # Expiry-week IV is skewed by gamma, so snapshots use the next expiry inside this
+IV_WINDOWS = (30, 60, 252)  # Trading days per rolling distribution
+IV_MIN_HISTORY_DAYS = 10  # Fewer trading days than this and a percentile means little
+
+_DISTRIBUTIONS = {}  # {underlying: {days: RollingDistribution}}
+_LOCK = threading.Lock()
+
+class RollingDistribution:
+    """
+    Sorted samples from the last `days` trading days
+    Adding a sample is an insort and expiring one a list delete, both O(n) memmoves (cheap at
+    ~75 samples a day); a whole day expires at once when a new day begins, and percentile/rank
+    queries are binary searches over the sorted list
+    """
+
+    def __init__(self, days):
+        self.days = days
+        self.sorted = []
+        self.samples = deque()  # (day, value) in arrival order
+        self.day_list = deque()  # distinct days present, oldest first
+
+    def __len__(self):
+        return len(self.sorted)
+
+    def add(self, day, value):
+        if self.day_list and day < self.day_list[-1]:
+            return  # Out-of-order samples would break day expiry
+        if not self.day_list or day != self.day_list[-1]:
+            self.day_list.append(day)
+            while len(self.day_list) > self.days:
+                expired = self.day_list.popleft()
+                while self.samples and self.samples[0][0] == expired:
+                    _, old = self.samples.popleft()
+                    del self.sorted[bisect_left(self.sorted, old)]
+        self.samples.append((day, value))
+        insort(self.sorted, value)
+
+    def percentile(self, value):
+        """Share of samples below value (ties count half), 0-100"""
+        n = len(self.sorted)
+        if not n:
+            return None
+        below = bisect_left(self.sorted, value)
+        at_or_below = bisect_right(self.sorted, value)
+        return 100.0 * (below + at_or_below) / (2 * n)
+
+    def rank(self, value):
+        """Where value sits between the window low and high, 0-100"""
+        if not self.sorted:
+            return None
+        low, high = self.sorted[0], self.sorted[-1]
+        if high == low:
+            return 50.0
+        return min(max(100.0 * (value - low) / (high - low), 0.0), 100.0)
+
+def _day(ts):
+    return (int(ts) + 19800) // 86400  # IST date number
+
+def _load(underlying):
+    distributions = {days: RollingDistribution(days) for days in IV_WINDOWS}
+    # 252 trading days is about a year; a little extra covers holidays
+    since = int(time.time()) - (max(IV_WINDOWS) * 7 // 5 + 30) * 86400
+    rows = get_connection().execute(
+        'SELECT ts, iv FROM iv_history WHERE underlying = ? AND ts >= ? ORDER BY ts', (underlying, since)
+    ).fetchall()
+    for ts, iv in rows:
+        for distribution in distributions.values():
+            distribution.add(_day(ts), iv)
+    logging.info(f"[IV] Loaded {len(rows)} IV snapshots for {underlying}")
+    return distributions
+
+def _get_distributions(underlying):
+    distributions = _DISTRIBUTIONS.get(underlying)
+    if distributions is None:
+        with _LOCK:
+            distributions = _DISTRIBUTIONS.get(underlying)
+            if distributions is None:
+                distributions = _DISTRIBUTIONS[underlying] = _load(underlying)
+    return distributions
+
+def record_iv(underlying, iv, ts=None, expiry=None, atm_strike=None, spot=None):
+    """Store one near-ATM IV snapshot (decimal, e.g. 0.145) and add it to the rolling windows"""
+    ts = int(time.time() if ts is None else ts)
+    # Load history before inserting, or a first snapshot after restart is read back and counted twice
+    distributions = _get_distributions(underlying)
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            'INSERT OR REPLACE INTO iv_history (underlying, ts, expiry, atm_strike, spot, iv) VALUES (?, ?, ?, ?, ?, ?)',
+            (underlying, ts, expiry, atm_strike, spot, iv)
+        )
+    with _LOCK:
+        for distribution in distributions.values():
+            distribution.add(_day(ts), iv)
+
+def get_iv_percentile(underlying, iv, days=IV_WINDOWS[0]):
+    """
+    {'percentile', 'rank', 'low', 'high', 'days', 'samples'} for iv against the last `days`
+    trading days of snapshots, or None with fewer than IV_MIN_HISTORY_DAYS of history
+    """
+    distribution = _get_distributions(underlying)[days]
+    with _LOCK:
+        if len(distribution.day_list) < IV_MIN_HISTORY_DAYS:
+            return None
+        return {
+            'percentile': distribution.percentile(iv),
+            'rank': distribution.rank(iv),
+            'low': distribution.sorted[0],
+            'high': distribution.sorted[-1],
+            'days': len(distribution.day_list),
+            'samples': len(distribution),
+        }
+
+def get_history_days(underlying):
+    """Trading days of IV history available for the longest window"""
+    return len(_get_distributions(underlying)[max(IV_WINDOWS)].day_list)
@@ -1,17 +1,36 @@
 import logging
-import json
-import requests
 from datetime import datetime, timedelta
-from app.services.smartapi_service import _SMARTAPI_SESSIONS
+from app.services.smartapi_service import get_primary_session, get_session_for_client
+from app.services.broker_client import get_broker_client
+from app.services.rate_limiter import PRIORITY_ENTRY, PRIORITY_MONITOR
+from app.services.quote_batcher import get_quote_batcher
+from app.services.instrument_index import get_instrument_index
+from app.services import candle_resampler, historical_service, iv_history_service, trading_service, volume_profile
+from app.utils.helpers import get_ist_now
+from app.utils.indicators import as_ohlcv, ema
+from app.utils.time_window import TimeWindowBuffer
 
 # Global state for market data
 VIX_CACHE = {'value': None, 'timestamp': None}
-VIX_HISTORY = []  # List of (timestamp, vix_value) tuples
+VIX_HISTORY = TimeWindowBuffer(3600, capacity=512)  # Last 60 minutes of fetched VIX values
+VIX_MOMENTUM_WINDOW = 900  # Seconds of VIX history the momentum regression looks at
 SCRIP_MASTER_CACHE = {}
 
+# NSE spot index tokens
+INDEX_TOKENS = {
+    'NIFTY': '99926000',
+    'BANKNIFTY': '99926009',
+    'FINNIFTY': '99926037',
+    'MIDCPNIFTY': '99926074',
+}
+
+MTF_TIMEFRAMES = (5, 15, 60)  # Minutes compared by the multi-timeframe check
+MTF_SEED_DAYS = 10  # Calendar days of 1-minute history used to warm up the resampler (EMA21 on 60m bars)
+MTF_STALE_SECONDS = 120  # Bars older than this during the session are topped up from 1-minute history
+
 def get_current_vix_value():
     """Get current INDIA VIX value from SmartAPI with 5-minute caching"""
-    global VIX_CACHE, VIX_HISTORY
+    global VIX_CACHE
     
     try:
         # Check cache first (5 minute expiry)
@@ -20,13 +39,9 @@ def get_current_vix_value():
             if age < 300:  # 5 minutes
                 return VIX_CACHE['value']
         
-        # Fetch INDIA VIX from SmartAPI (token 99926017)
-        # Get any active client for API call
-        active_client = None
-        for clientcode in _SMARTAPI_SESSIONS:
-            if _SMARTAPI_SESSIONS[clientcode].get('active'):
-                active_client = _SMARTAPI_SESSIONS[clientcode]['api']
-                break
+        # Fetch INDIA VIX from SmartAPI (token 99926017) via the primary live session
+        primary = get_primary_session()
+        active_client = primary['api'] if primary else None
         
         if not active_client:
             logging.warning("No active SmartAPI session for VIX fetch")
@@ -43,11 +58,8 @@ def get_current_vix_value():
                 'timestamp': datetime.now()
             }
             
-            # Store in history for momentum calculation
-            VIX_HISTORY.append((datetime.now(), current_vix))
-            # Keep only last 60 minutes of data
-            VIX_HISTORY = [(ts, val) for ts, val in VIX_HISTORY 
-                          if (datetime.now() - ts).total_seconds() < 3600]
+            # Store in history for momentum calculation (samples older than 60 minutes expire)
+            VIX_HISTORY.append(current_vix)
             
             logging.info(f"[VIX] Fetched from SmartAPI: {current_vix:.2f}")
             return current_vix
@@ -58,25 +70,18 @@ def get_current_vix_value():
         logging.error(f"Error fetching VIX from SmartAPI: {e}")
         return None
 
-def get_vix_momentum():
+def get_vix_momentum(window_seconds=VIX_MOMENTUM_WINDOW):
     """
-    Calculate VIX momentum/slope from recent history
+    Calculate VIX momentum from the regression slope over recent history
     Returns: ('rising', 'falling', 'stable', 'unknown')
     """
-    global VIX_HISTORY
-    
-    if len(VIX_HISTORY) < 3:
-        return 'unknown'
-    
     try:
-        # Get last 3 VIX values
-        recent = VIX_HISTORY[-3:]
-        values = [v for _, v in recent]
+        momentum = VIX_HISTORY.momentum(window_seconds)
+        if momentum['points'] < 3 or momentum['slope_pct_per_min'] is None:
+            return 'unknown'
         
-        # Calculate simple slope
-        first_val = values[0]
-        last_val = values[-1]
-        change_pct = ((last_val - first_val) / first_val) * 100
+        # Change along the fitted line across the window, so one noisy print can't flip the call
+        change_pct = momentum['slope_pct_per_min'] * momentum['span_seconds'] / 60
         
         if change_pct > 2:
             return 'rising'
@@ -89,6 +94,10 @@ def get_vix_momentum():
         logging.error(f"VIX momentum calculation error: {e}")
         return 'unknown'
 
+def get_vix_momentum_stats(window_seconds=VIX_MOMENTUM_WINDOW):
+    """Slope, z-score and % change of VIX over the window"""
+    return VIX_HISTORY.momentum(window_seconds)
+
 def detect_market_regime(vix_value, trend_strength):
     """
     Detect current market regime
@@ -117,14 +126,11 @@ def check_trend_direction(candles_data):
         if not candles_data or len(candles_data) < 21:
             return 'neutral'
         
-        closes = [float(c[4]) for c in candles_data[-21:]]
+        closes = as_ohlcv(candles_data)['close']
         
-        # Calculate EMA9 and EMA21
-        ema9 = closes[-9:]
-        ema21 = closes
-        
-        ema9_val = sum(ema9) / len(ema9)
-        ema21_val = sum(ema21) / len(ema21)
+        # Calculate EMA9 and EMA21 over the whole series (seeded with their SMAs)
+        ema9_val = ema(closes, 9)[-1]
+        ema21_val = ema(closes, 21)[-1]
         
         if ema9_val > ema21_val * 1.002:
             return 'bullish'
@@ -157,9 +163,53 @@ def calculate_vix_based_profit_target(vix_value):
     """Calculate profit target - FIXED AT 10%"""
     return 10.0
 
-def check_volume_confirmation(symboltoken, clientcode):
-    """Volume Confirmation - Placeholder"""
-    return (True, "Volume check pending (needs historical data API)", 1.0)
+def _live_bar_volume(symboltoken, ts):
+    """Volume of the forming 5-minute bar if the candle resampler tracks this token"""
+    bars = candle_resampler.get_bars(symboltoken, volume_profile.VOLUME_BUCKET_MINUTES, 1, include_forming=True)
+    if bars and bars[-1][0] == candle_resampler.bucket_start(ts, volume_profile.VOLUME_BUCKET_MINUTES):
+        return bars[-1][5]
+    return None
+
+def check_volume_confirmation(symboltoken, clientcode, current_volume=None, exchange='NFO'):
+    """
+    Volume Confirmation against the same time-of-day bucket over the last 20 sessions
+    current_volume is the forming 5-minute bar's volume; without it the resampler's bar is used,
+    or else one quote's day volume is compared with the cumulative profile
+    Returns: (confirmed, message, ratio)
+    """
+    try:
+        profile = volume_profile.get_volume_profile(clientcode, exchange, symboltoken)
+        if profile is None:
+            return (True, "Volume check skipped (not enough candle history)", 1.0)
+        
+        ts = get_ist_now().timestamp()
+        if current_volume is None:
+            current_volume = _live_bar_volume(symboltoken, ts)
+        
+        if current_volume is not None:
+            ratio = profile.bar_ratio(current_volume, ts)
+            basis = "5m bar"
+        else:
+            quotes = get_market_quotes_batch(clientcode, {exchange: [str(symboltoken)]}, 'FULL', PRIORITY_ENTRY)
+            fetched = (quotes or {}).get('fetched') or []
+            if not fetched:
+                return (True, "Volume check skipped (no live volume)", 1.0)
+            ratio = profile.day_ratio(float(fetched[0].get('tradeVolume') or 0), ts)
+            basis = "day so far"
+        
+        if ratio is None:
+            return (True, "Volume check skipped (outside market hours or no baseline volume)", 1.0)
+        
+        if ratio < 0.5:
+            return (False, f"[STOP] Low volume: {ratio:.2f}x {profile.days}-day average ({basis})", ratio)
+        elif ratio >= 1.5:
+            return (True, f"[OK] Strong volume: {ratio:.2f}x {profile.days}-day average ({basis})", ratio)
+        else:
+            return (True, f"Normal volume: {ratio:.2f}x {profile.days}-day average ({basis})", ratio)
+            
+    except Exception as e:
+        logging.error(f"Volume confirmation error: {e}")
+        return (True, f"Volume check error: {str(e)}", 1.0)
 
 def check_breakout_confirmation(clientcode, symbol, current_price, breakout_level, direction='bullish'):
     """Breakout Confirmation"""
@@ -177,13 +227,103 @@ def check_breakout_confirmation(clientcode, symbol, current_price, breakout_leve
         logging.error(f"Breakout confirmation error: {e}")
         return (True, f"Breakout check error: {str(e)}")
 
-def check_multi_timeframe_confirmation(symbol='NIFTY'):
-    """Multi-Timeframe Confirmation - Placeholder"""
-    return (True, "Multi-TF check pending (needs multiple interval data)", {})
+def _ensure_resampler(token, clientcode):
+    """
+    Seed a token's resampler (and its streaming indicators) once from cached 1-minute history;
+    quotes keep both current, and any gap they leave (no recent quote traffic) is filled from
+    1-minute history before use
+    """
+    now = get_ist_now()
+    current = candle_resampler.bucket_start(now.timestamp(), 1)
+    tracked = candle_resampler.is_tracked(token)
+    if tracked:
+        last = candle_resampler.get_resampler(token).last_bar_start()
+        if current is None or (last is not None and current - last <= MTF_STALE_SECONDS):
+            return True
+
+    # Only today's session is missing from the candle store, so a full window costs no more than the gap
+    candles = historical_service.get_candles(clientcode, 'NSE', token, 'ONE_MINUTE',
+                                             now - timedelta(days=MTF_SEED_DAYS), now, as_array=True)
+    if not len(candles):
+        return tracked
+    if tracked:
+        added = candle_resampler.catch_up(token, candles)
+        logging.info(f"[RESAMPLER] Filled {added} missing 1-minute bars for {token}")
+    else:
+        candle_resampler.seed_from_candles(token, candles)
+    # The still-forming minute reaches the indicators when the resampler closes it
+    closed = candles[candles['ts'] < current] if current is not None else candles
+    trading_service.seed_indicators(token, closed)
+    return True
+
+def check_multi_timeframe_confirmation(symbol='NIFTY', clientcode=None, direction='BULLISH'):
+    """
+    Multi-Timeframe Confirmation
+    EMA9/EMA21 trend on 5m, 15m and 60m bars built in memory by the candle resampler
+    Returns: (confirmed, message, {'5m': trend, ...})
+    """
+    try:
+        token = INDEX_TOKENS.get(symbol.upper())
+        if not token:
+            return (True, f"Multi-TF check skipped (no index token for {symbol})", {})
+        if not _ensure_resampler(token, clientcode):
+            return (True, "Multi-TF check skipped (no candle history)", {})
+
+        trends = {}
+        for minutes in MTF_TIMEFRAMES:
+            trends[f'{minutes}m'] = check_trend_direction(candle_resampler.get_bars(token, minutes))
+
+        wanted = 'bullish' if direction.upper() in ('BULLISH', 'CE', 'BUY') else 'bearish'
+        known = {tf: trend for tf, trend in trends.items() if trend != 'neutral'}
+        against = [tf for tf, trend in known.items() if trend != wanted]
+        summary = ', '.join(f"{tf} {trend}" for tf, trend in trends.items())
+
+        if against:
+            return (False, f"Timeframes disagree: {summary}", trends)
+        if not known:
+            return (False, f"No clear trend on any timeframe: {summary}", trends)
+        return (True, f"[OK] {len(known)}/{len(trends)} timeframes {wanted}: {summary}", trends)
+
+    except Exception as e:
+        logging.error(f"Multi-timeframe check error: {e}")
+        return (True, f"Multi-TF check error: {str(e)}", {})
+
+def _underlying_of(symbol):
+    """'NIFTY24OCT25000CE' -> 'NIFTY' (longest matching index name)"""
+    symbol = (symbol or '').upper()
+    names = [name for name in INDEX_TOKENS if symbol.startswith(name)]
+    return max(names, key=len) if names else symbol
 
 def calculate_iv_percentile(symbol, strike, expiry, current_iv):
-    """IV Percentile Ranking - Placeholder"""
-    return (50, "IV ranking pending (needs 30-day IV history database)")
+    """
+    IV Percentile Ranking against the underlying's 30-day near-ATM IV history
+    current_iv may be a decimal (0.145) or a percentage (14.5)
+    Returns: (percentile 0-100, message)
+    """
+    try:
+        if current_iv is None or current_iv <= 0:
+            return (50, "IV ranking skipped (no current IV)")
+        iv = current_iv / 100 if current_iv > 3 else current_iv
+        underlying = _underlying_of(symbol)
+        
+        stats = iv_history_service.get_iv_percentile(underlying, iv)
+        if stats is None:
+            days = iv_history_service.get_history_days(underlying)
+            return (50, f"IV ranking pending ({days}/{iv_history_service.IV_MIN_HISTORY_DAYS} days of {underlying} IV history)")
+        
+        percentile = round(stats['percentile'])
+        detail = f"IV {iv * 100:.1f}% at {percentile}th percentile of {stats['days']}d (rank {stats['rank']:.0f})"
+        
+        if percentile >= 80:
+            return (percentile, f"[WARNING] {detail} - options expensive")
+        elif percentile <= 20:
+            return (percentile, f"[OK] {detail} - options cheap")
+        else:
+            return (percentile, f"{detail} - normal")
+            
+    except Exception as e:
+        logging.error(f"IV percentile error: {e}")
+        return (50, f"IV ranking error: {str(e)}")
 
 def calculate_support_resistance_levels(candles_data):
     """Support/Resistance Levels - Enhanced calculation"""
@@ -238,109 +378,87 @@ def calculate_support_resistance_levels(candles_data):
         logging.error(f"Support/Resistance calculation error: {e}")
         return {}
 
+def _to_symbol_result(item):
+    return {
+        'token': item.get('token'),
+        'symbol': item.get('symbol'),
+        'name': item.get('name'),
+        'expiry': item.get('expiry'),
+        'strike': item.get('strike'),
+        'lotsize': item.get('lotsize')
+    }
+
 def find_symbol_token(tradingsymbol, clientcode):
-    """Find symbol token from local scrip master for given trading symbol"""
+    """Find symbol token from the instrument index for given trading symbol"""
     global SCRIP_MASTER_CACHE
     try:
         if tradingsymbol in SCRIP_MASTER_CACHE:
             return SCRIP_MASTER_CACHE[tradingsymbol]
         
-        scrip_master_path = 'scrip_master.json'
-        
-        try:
-            with open(scrip_master_path, 'r', encoding='utf-8') as f:
-                scrip_data = json.load(f)
-            
-            logging.info(f"Loaded {len(scrip_data)} symbols from scrip master")
-            
-            tradingsymbol_upper = tradingsymbol.upper()
-            
-            # Exact match
-            for item in scrip_data:
-                if item.get('symbol', '').upper() == tradingsymbol_upper or item.get('name', '').upper() == tradingsymbol_upper:
-                    if item.get('exch_seg') == 'NFO':
-                        token = item.get('token')
-                        result = {
-                            'token': token,
-                            'symbol': item.get('symbol'),
-                            'name': item.get('name'),
-                            'expiry': item.get('expiry'),
-                            'strike': item.get('strike'),
-                            'lotsize': item.get('lotsize')
-                        }
-                        SCRIP_MASTER_CACHE[tradingsymbol] = result
-                        logging.info(f"Found token for {tradingsymbol}: {token}")
-                        return result
-            
-            # Partial match
-            for item in scrip_data:
-                symbol = item.get('symbol', '').upper()
-                if tradingsymbol_upper in symbol and item.get('exch_seg') == 'NFO':
-                    token = item.get('token')
-                    result = {
-                        'token': token,
-                        'symbol': item.get('symbol'),
-                        'name': item.get('name'),
-                        'expiry': item.get('expiry'),
-                        'strike': item.get('strike'),
-                        'lotsize': item.get('lotsize')
-                    }
-                    SCRIP_MASTER_CACHE[tradingsymbol] = result
-                    logging.info(f"Found token for {tradingsymbol}: {token} (partial match: {symbol})")
-                    return result
-            
-            logging.error(f"Could not find token for {tradingsymbol} in scrip master")
-            return None
-            
-        except FileNotFoundError:
-            logging.error(f"Scrip master file not found: {scrip_master_path}")
-            return None
+        index = get_instrument_index()
+        tradingsymbol_upper = tradingsymbol.upper()
+        
+        # Exact match
+        item = index.get_by_symbol(tradingsymbol_upper)
+        if not item or item.get('exch_seg') != 'NFO':
+            item = index.by_name.get(tradingsymbol_upper)
+        if item:
+            result = _to_symbol_result(item)
+            SCRIP_MASTER_CACHE[tradingsymbol] = result
+            logging.info(f"Found token for {tradingsymbol}: {result['token']}")
+            return result
+        
+        # Partial match (only reached for symbols the index doesn't know exactly)
+        for symbol, item in index.by_symbol.items():
+            if tradingsymbol_upper in symbol and item.get('exch_seg') == 'NFO':
+                result = _to_symbol_result(item)
+                SCRIP_MASTER_CACHE[tradingsymbol] = result
+                logging.info(f"Found token for {tradingsymbol}: {result['token']} (partial match: {symbol})")
+                return result
+        
+        logging.error(f"Could not find token for {tradingsymbol} in scrip master")
+        return None
         
     except Exception as e:
         logging.error(f"Error finding symbol token: {e}", exc_info=True)
         return None
 
-def get_market_quotes_batch(clientcode, exchange_tokens, mode='FULL'):
-    """Fetch market quotes for multiple symbols in ONE API call"""
+def find_atm_option(name, spot, option_type='CE', expiry_date=None):
+    """Resolve the ATM option contract for the nearest (or given) expiry"""
+    index = get_instrument_index()
+    if not expiry_date:
+        expiries = index.get_expiries(name, get_ist_now().date().isoformat())
+        if not expiries:
+            return None
+        expiry_date = expiries[0]
+    strike = index.nearest_strike(name, expiry_date, spot, option_type)
+    if strike is None:
+        return None
+    item = index.get_contract(name, expiry_date, strike, option_type)
+    return _to_symbol_result(item) if item else None
+
+def _fetch_quotes(clientcode, exchange_tokens, mode, priority):
+    """Single broker quote call (at most MAX_TOKENS_PER_CALL tokens); the quote batcher holds its rate-limit slot"""
     try:
-        session_id = None
-        for sid, sdata in _SMARTAPI_SESSIONS.items():
-            if sdata.get('clientcode') == clientcode:
-                session_id = sid
-                break
-        
-        if not session_id:
+        user_session = get_session_for_client(clientcode)
+        if not user_session:
             logging.error(f"No session found for {clientcode}")
             return None
         
-        smartapi = _SMARTAPI_SESSIONS[session_id]['api']
-        jwt_token = _SMARTAPI_SESSIONS[session_id]['tokens'].get('jwtToken', '')
-        if jwt_token.startswith('Bearer '):
-            jwt_token = jwt_token[7:]
-        
-        url = "https://apiconnect.angelone.in/rest/secure/angelbroking/market/v1/quote/"
-        
-        headers = {
-            'Authorization': f'Bearer {jwt_token}',
-            'Content-Type': 'application/json',
-            'Accept': 'application/json',
-            'X-UserType': 'USER',
-            'X-SourceID': 'WEB',
-            'X-ClientLocalIP': 'CLIENT_LOCAL_IP',
-            'X-ClientPublicIP': 'CLIENT_PUBLIC_IP',
-            'X-MACAddress': 'MAC_ADDRESS',
-            'X-PrivateKey': os.getenv('SMARTAPI_API_KEY')
-        }
-        
         payload = {
             "mode": mode,
             "exchangeTokens": exchange_tokens
         }
         
-        response = requests.post(url, headers=headers, json=payload, timeout=5)
-        data = response.json()
+        client = get_broker_client(user_session)
+        data = client.request('quote', payload, timeout=(3.05, 5), priority=priority, acquired=True)
         
         if data.get('status') and data.get('data'):
+            # Tracked tokens (e.g. spot indices) build their multi-timeframe bars from every quote
+            for item in data['data'].get('fetched') or []:
+                candle_resampler.on_quote(item)
+                if item.get('ltp') is not None:
+                    trading_service.on_price_tick(str(item.get('symbolToken')), item['ltp'])
             return data['data']
         else:
             logging.error(f"Batch quote fetch failed: {data.get('message')}")
@@ -350,6 +468,16 @@ def get_market_quotes_batch(clientcode, exchange_tokens, mode='FULL'):
         logging.error(f"Error fetching batch quotes: {e}")
         return None
 
+def get_market_quotes_batch(clientcode, exchange_tokens, mode='FULL', priority=PRIORITY_MONITOR):
+    """
+    Fetch market quotes for multiple symbols
+    Concurrent callers are merged by the quote batcher into shared 50-token API calls
+    """
+    batcher = get_quote_batcher(
+        clientcode, lambda tokens, batch_mode, batch_priority: _fetch_quotes(clientcode, tokens, batch_mode, batch_priority)
+    )
+    return batcher.get_quotes(exchange_tokens, mode, priority)
+
 def check_liquidity_filter(symboltoken, clientcode, min_oi=5000):
     """
     Check option liquidity via Historical OI Data API.
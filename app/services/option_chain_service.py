@@ -0,0 +1,429 @@
+import logging
+import threading
+import time
+import numpy as np
+from app.services import iv_history_service, scrip_master_service
+from app.services.instrument_index import get_instrument_index
+from app.services.market_service import INDEX_TOKENS, get_market_quotes_batch
+from app.services.quote_batcher import pack_exchange_tokens
+from app.services.rate_limiter import PRIORITY_UI, has_headroom
+from app.services.smartapi_service import get_primary_session, get_session_for_client
+from app.utils.helpers import get_ist_now
+from app.utils.options_pricing import chain_greeks, time_to_expiry
+
+# Spot index tokens used to place ATM for each underlying
+UNDERLYING_SPOT = {name: ('NSE', token) for name, token in INDEX_TOKENS.items()}
+
+CHAIN_REFRESH_INTERVAL = 5.0  # Max age of a snapshot served to readers
+CHAIN_BACKGROUND_INTERVAL = 15.0  # Seconds between background refresh passes
+CHAIN_HOT_STRIKES = 15  # Strikes either side of ATM refreshed on every cycle (at most)
+CHAIN_FULL_REFRESH_EVERY = 6  # Every Nth background pass re-quotes the whole chain
+CHAIN_FIRST_LOAD_WAIT = 10.0  # Max seconds a reader waits for another reader's first load of a chain
+CHAIN_IDLE_TIMEOUT = 120.0  # Chains nobody has read for this long stop refreshing
+
+CE, PE = 0, 1
+FIELDS = ('ltp', 'oi', 'volume', 'bid', 'ask', 'oi_change')
+GREEK_FIELDS = ('iv', 'delta', 'gamma', 'theta', 'vega')  # Solved from ltp on every refresh
+
+_CHAINS = {}  # {(name, expiry): _ChainState}
+_CHAINS_LOCK = threading.Lock()
+_REFRESH_THREAD = None
+_LAST_IV_SNAPSHOT = {}  # {name: monotonic time of the last IV snapshot}
+
+class OptionChainSnapshot:
+    """
+    Immutable chain snapshot in columnar form
+    Every field is a (2, n_strikes) float array: row CE=0 / PE=1, column = position in `strikes`
+    Missing contracts and unquoted values are NaN
+    """
+
+    def __init__(self, name, expiry, strikes, tokens, fields, spot, updated_at, refreshed):
+        self.name = name
+        self.expiry = expiry
+        self.strikes = strikes  # float64 (n,), ascending
+        self.tokens = tokens  # object (2, n), None where a strike has no CE/PE contract
+        self.fields = fields  # {field: float64 (2, n)}
+        self.spot = spot
+        self.updated_at = updated_at
+        self.refreshed = refreshed  # strikes quoted in the refresh that produced this snapshot
+        self.created = time.monotonic()
+
+    def __getitem__(self, field):
+        return self.fields[field]
+
+    def age(self):
+        return time.monotonic() - self.created
+
+    def atm_index(self, spot=None):
+        spot = self.spot if spot is None else spot
+        if spot is None or not len(self.strikes):
+            return None
+        return int(np.argmin(np.abs(self.strikes - spot)))
+
+    def atm_strike(self, spot=None):
+        i = self.atm_index(spot)
+        return None if i is None else float(self.strikes[i])
+
+    def window(self, n, spot=None):
+        """Slice of strike positions covering ATM +/- n"""
+        return _strike_window(self.strikes, self.spot if spot is None else spot, n)
+
+    def pcr(self, field='oi'):
+        """Put/call ratio over the whole chain (OI by default, or 'volume')"""
+        values = self.fields[field]
+        calls = np.nansum(values[CE])
+        return float(np.nansum(values[PE]) / calls) if calls else None
+
+    def max_pain(self):
+        """Expiry price at which option writers pay out the least"""
+        oi = np.nan_to_num(self.fields['oi'])
+        if not oi.any():
+            return None
+        # payout[i] = sum_j ce_oi[j] * max(0, K_i - K_j) + pe_oi[j] * max(0, K_j - K_i)
+        diff = self.strikes[:, None] - self.strikes[None, :]
+        payout = np.maximum(diff, 0) @ oi[CE] + np.maximum(-diff, 0) @ oi[PE]
+        return float(self.strikes[int(np.argmin(payout))])
+
+    def atm_iv(self, n=2):
+        """Mean IV of both sides over ATM +/- n strikes"""
+        values = self.fields['iv'][:, self.window(n)]
+        valid = values[~np.isnan(values)]
+        return float(valid.mean()) if len(valid) else None
+
+    def top_oi_change(self, k=5, side=CE):
+        """(strike, oi_change) for the k largest OI additions on one side"""
+        change = self.fields['oi_change'][side]
+        valid = np.flatnonzero(~np.isnan(change))
+        if not len(valid):
+            return []
+        order = valid[np.argsort(change[valid])[::-1][:k]]
+        return [(float(self.strikes[i]), float(change[i])) for i in order]
+
+    def contract(self, strike, option_type):
+        """All fields for one contract, e.g. {'ltp': .., 'iv': .., 'delta': ..}, or None"""
+        matches = np.flatnonzero(self.strikes == float(strike))
+        if not len(matches):
+            return None
+        side = CE if option_type.upper() == 'CE' else PE
+        i = int(matches[0])
+        values = {field: float(array[side, i]) for field, array in self.fields.items()}
+        return {field: (None if np.isnan(v) else v) for field, v in values.items()}
+
+    def to_dict(self, n=None):
+        window = self.window(n) if n is not None else slice(None)
+        strikes = self.strikes[window]
+
+        def column(field, side):
+            return [None if np.isnan(v) else float(v) for v in self.fields[field][side, window]]
+
+        return {
+            'name': self.name,
+            'expiry': self.expiry,
+            'spot': self.spot,
+            'atm_strike': self.atm_strike(),
+            'updated_at': self.updated_at.isoformat(),
+            'pcr': self.pcr(),
+            'max_pain': self.max_pain(),
+            'strikes': [float(s) for s in strikes],
+            'CE': {field: column(field, CE) for field in self.fields},
+            'PE': {field: column(field, PE) for field in self.fields},
+        }
+
+class _ChainState:
+    """Per-chain layout and refresh bookkeeping; the published snapshot is swapped whole"""
+
+    def __init__(self, name, expiry, strikes, tokens):
+        self.name = name
+        self.expiry = expiry
+        self.strikes = strikes
+        self.tokens = tokens
+        # token -> (side, position) so quote results scatter straight into the arrays
+        self.positions = {
+            token: (side, i)
+            for side in (CE, PE)
+            for i, token in enumerate(tokens[side])
+            if token is not None
+        }
+        self.baseline_oi = None  # First OI seen today, for oi_change
+        self.baseline_date = None
+        self.snapshot = None
+        self.refreshes = 0
+        self.background_passes = 0
+        self.refreshing = False  # One refresh in flight per chain; the others serve the last snapshot
+        self.loaded = threading.Event()  # Set once the first snapshot is published
+        self.hot_strikes = CHAIN_HOT_STRIKES  # Width readers asked for; hot-window refreshes quote only that
+        self.last_read = time.monotonic()
+        self.lock = threading.Lock()  # Guards bookkeeping only; never held across a quote call
+
+def _strike_window(strikes, spot, n):
+    if spot is None or not len(strikes):
+        return slice(0, 0)
+    i = int(np.argmin(np.abs(strikes - spot)))
+    return slice(max(0, i - n), i + n + 1)
+
+def _build_state(name, expiry):
+    index = get_instrument_index()
+    ce_strikes = index.strikes.get((name, expiry, 'CE'), [])
+    pe_strikes = index.strikes.get((name, expiry, 'PE'), [])
+    strikes = np.array(sorted(set(ce_strikes) | set(pe_strikes)), dtype=np.float64)
+    if not len(strikes):
+        return None
+    tokens = np.empty((2, len(strikes)), dtype=object)
+    for side, option_type in ((CE, 'CE'), (PE, 'PE')):
+        for i, strike in enumerate(strikes):
+            row = index.get_contract(name, expiry, strike, option_type)
+            tokens[side, i] = row.get('token') if row else None
+    return _ChainState(name, expiry, strikes, tokens)
+
+def _quote_clientcode(clientcode):
+    session = (get_session_for_client(clientcode) if clientcode else None) or get_primary_session()
+    return session['clientcode'] if session else None
+
+def _depth_price(item, side):
+    levels = ((item.get('depth') or {}).get(side)) or []
+    price = levels[0].get('price') if levels else None
+    return float(price) if price else np.nan
+
+def _quote(clientcode, exchange_tokens):
+    """
+    Fetched quote items, one broker call's worth at a time so a whole-chain requote never
+    waits out the batcher's timeout as a single job; None only if every call failed
+    """
+    fetched = []
+    payloads = pack_exchange_tokens(exchange_tokens)
+    failed = 0
+    for payload in payloads:
+        quotes = get_market_quotes_batch(clientcode, payload, 'FULL', PRIORITY_UI)
+        if quotes is None:
+            failed += 1
+            continue
+        fetched.extend(quotes.get('fetched') or [])
+    if payloads and failed == len(payloads):
+        return None
+    return fetched
+
+def _refresh(state, clientcode, full=False):
+    """
+    Quote the chain and publish a new snapshot: the hot window around ATM, or every strike with
+    full=True (background passes only). Returns None without waiting if a refresh is already
+    in flight; the quote calls run outside state.lock
+    """
+    with state.lock:
+        if state.refreshing:
+            return None
+        state.refreshing = True
+        previous = state.snapshot
+    try:
+        spot_exchange, spot_token = UNDERLYING_SPOT.get(state.name, (None, None))
+        spot = previous.spot if previous is not None else None
+        if not full and spot is None and spot_token:
+            # First load: place ATM before choosing which strikes to quote
+            for item in _quote(clientcode, {spot_exchange: [spot_token]}) or []:
+                spot = float(item.get('ltp'))
+        window = slice(None) if full or spot is None else _strike_window(state.strikes, spot, state.hot_strikes)
+
+        chain_tokens = [token for token in state.tokens[:, window].ravel() if token is not None]
+        exchange_tokens = {'NFO': chain_tokens}
+        if spot_token:
+            exchange_tokens.setdefault(spot_exchange, []).append(spot_token)
+        fetched = _quote(clientcode, exchange_tokens)
+        if fetched is None:
+            raise RuntimeError(f"quote fetch failed for {state.name} {state.expiry}")
+        with state.lock:
+            return _publish(state, previous, window, fetched, spot, spot_exchange, spot_token)
+    finally:
+        with state.lock:
+            state.refreshing = False
+
+def _publish(state, previous, window, fetched, spot, spot_exchange, spot_token):
+    n = len(state.strikes)
+    if previous is None:
+        fields = {field: np.full((2, n), np.nan) for field in FIELDS}
+    else:
+        # Strikes outside the refreshed window keep their last values
+        fields = {field: values.copy() for field, values in previous.fields.items()}
+
+    for item in fetched:
+        token = str(item.get('symbolToken'))
+        if item.get('exchange') == spot_exchange and token == spot_token:
+            spot = float(item.get('ltp'))
+            continue
+        position = state.positions.get(token)
+        if position is None:
+            continue
+        fields['ltp'][position] = float(item.get('ltp') or np.nan)
+        fields['oi'][position] = float(item.get('opnInterest') or 0)
+        fields['volume'][position] = float(item.get('tradeVolume') or 0)
+        fields['bid'][position] = _depth_price(item, 'buy')
+        fields['ask'][position] = _depth_price(item, 'sell')
+
+    now = get_ist_now()
+    if state.baseline_date != now.date():
+        state.baseline_oi = fields['oi'].copy()
+        state.baseline_date = now.date()
+    else:
+        # Contracts first quoted after the baseline was taken start their change from here
+        missing = np.isnan(state.baseline_oi) & ~np.isnan(fields['oi'])
+        state.baseline_oi[missing] = fields['oi'][missing]
+    fields['oi_change'] = fields['oi'] - state.baseline_oi
+
+    if spot:
+        fields.update(chain_greeks(spot, state.strikes, fields['ltp'], time_to_expiry(state.expiry, now)))
+    else:
+        fields.update({field: np.full((2, n), np.nan) for field in GREEK_FIELDS})
+
+    state.refreshes += 1
+    refreshed = len(range(*window.indices(len(state.strikes))))
+    state.snapshot = OptionChainSnapshot(state.name, state.expiry, state.strikes, state.tokens,
+                                         fields, spot, now, refreshed)
+    state.loaded.set()
+    return state.snapshot
+
+def _refresh_quietly(state, clientcode, full=False):
+    try:
+        return _refresh(state, clientcode, full)
+    except Exception as e:
+        logging.error(f"[CHAIN] Refresh failed for {state.name} {state.expiry}: {e}")
+        return None
+
+def _get_state(name, expiry, reader=True):
+    """
+    Shared state for a chain, built on first use; one built for internal use (reader=False)
+    starts out idle so the background loop doesn't keep refreshing a chain nobody displays
+    """
+    key = (name, expiry)
+    with _CHAINS_LOCK:
+        state = _CHAINS.get(key)
+    if state is None:
+        state = _build_state(name, expiry)
+        if state is None:
+            return None
+        if not reader:
+            state.last_read = time.monotonic() - CHAIN_IDLE_TIMEOUT - 1
+        with _CHAINS_LOCK:
+            state = _CHAINS.setdefault(key, state)
+    return state
+
+def get_chain_snapshot(name, expiry=None, clientcode=None, max_age=CHAIN_REFRESH_INTERVAL, strikes=None):
+    """
+    Current snapshot for an underlying/expiry (nearest expiry by default)
+    Readers share one snapshot and never wait on the network for a stale one: they get the last
+    snapshot while a refresh of the hot window runs behind them. Only a chain's first load blocks
+    `strikes` (ATM +/- n the reader displays) narrows what gets refreshed
+    """
+    name = name.upper()
+    if not expiry:
+        expiries = get_instrument_index().get_expiries(name, get_ist_now().date().isoformat())
+        if not expiries:
+            return None
+        expiry = expiries[0]
+
+    state = _get_state(name, expiry)
+    if state is None:
+        return None
+    state.last_read = time.monotonic()
+    state.hot_strikes = CHAIN_HOT_STRIKES if strikes is None else max(1, min(strikes, CHAIN_HOT_STRIKES))
+
+    snapshot = state.snapshot
+    if snapshot is not None and snapshot.age() < max_age:
+        return snapshot
+    quote_client = _quote_clientcode(clientcode)
+    if not quote_client:
+        logging.warning(f"[CHAIN] No live session to quote {name} {expiry}")
+        return snapshot
+    if snapshot is not None:
+        if not state.refreshing:
+            threading.Thread(target=_refresh_quietly, args=(state, quote_client),
+                             name=f'chain-{name}', daemon=True).start()
+        return snapshot
+    # First load: quote it here, or wait for the reader already doing so
+    snapshot = _refresh_quietly(state, quote_client)
+    if snapshot is None and state.loaded.wait(CHAIN_FIRST_LOAD_WAIT):
+        snapshot = state.snapshot
+    return snapshot
+
+def get_option_greeks(name, expiry, strike, option_type, clientcode=None):
+    """IV and Greeks for one contract from the shared chain snapshot (e.g. delta for position sizing)"""
+    snapshot = get_chain_snapshot(name, expiry, clientcode)
+    if snapshot is None:
+        return None
+    contract = snapshot.contract(strike, option_type)
+    if contract is None:
+        return None
+    return {field: contract[field] for field in GREEK_FIELDS}
+
+def _iv_expiry(name, now):
+    """Nearest expiry at least IV_MIN_DAYS_TO_EXPIRY away"""
+    for expiry in get_instrument_index().get_expiries(name, now.date().isoformat()):
+        if time_to_expiry(expiry, now) * 365 >= iv_history_service.IV_MIN_DAYS_TO_EXPIRY:
+            return expiry
+    return None
+
+def _record_iv(clientcode):
+    """Snapshot near-ATM IV of each tracked underlying into the IV history every IV_SNAPSHOT_INTERVAL"""
+    for name in iv_history_service.IV_UNDERLYINGS:
+        if time.monotonic() - _LAST_IV_SNAPSHOT.get(name, float('-inf')) < iv_history_service.IV_SNAPSHOT_INTERVAL:
+            continue
+        if not has_headroom(clientcode, 'quote'):
+            return  # Try again on the next pass
+        _LAST_IV_SNAPSHOT[name] = time.monotonic()
+        expiry = None
+        try:
+            now = get_ist_now()
+            expiry = _iv_expiry(name, now)
+            state = _get_state(name, expiry, reader=False) if expiry else None
+            if state is None:
+                continue
+            snapshot = state.snapshot
+            if snapshot is None or snapshot.age() >= CHAIN_REFRESH_INTERVAL:
+                snapshot = _refresh(state, clientcode) or state.snapshot
+            if snapshot is None:
+                continue
+            iv = snapshot.atm_iv(iv_history_service.IV_NEAR_ATM_STRIKES)
+            if iv is not None:
+                iv_history_service.record_iv(name, iv, expiry=expiry, atm_strike=snapshot.atm_strike(),
+                                             spot=snapshot.spot)
+        except Exception as e:
+            logging.error(f"[IV] Snapshot failed for {name} {expiry}: {e}")
+
+def _is_market_hours(now):
+    opens = now.replace(hour=9, minute=15, second=0, microsecond=0)
+    closes = now.replace(hour=15, minute=30, second=0, microsecond=0)
+    return now.weekday() < 5 and opens <= now <= closes
+
+def _refresh_loop():
+    while True:
+        time.sleep(CHAIN_BACKGROUND_INTERVAL)
+        if not _is_market_hours(get_ist_now()):
+            continue
+        clientcode = _quote_clientcode(None)
+        if not clientcode:
+            continue
+        _record_iv(clientcode)
+        with _CHAINS_LOCK:
+            states = list(_CHAINS.values())
+        for state in states:
+            if time.monotonic() - state.last_read > CHAIN_IDLE_TIMEOUT:
+                continue
+            if state.snapshot is not None and state.snapshot.age() < CHAIN_BACKGROUND_INTERVAL:
+                continue  # A reader refreshed it recently
+            # Background quotes only use spare capacity; order and monitor quotes come first
+            if state.refreshing or not has_headroom(clientcode, 'quote'):
+                continue
+            full = state.snapshot is None or state.background_passes % CHAIN_FULL_REFRESH_EVERY == 0
+            state.background_passes += 1
+            _refresh_quietly(state, clientcode, full)
+
+def start_chain_refresher():
+    global _REFRESH_THREAD
+    if _REFRESH_THREAD and _REFRESH_THREAD.is_alive():
+        return
+    _REFRESH_THREAD = threading.Thread(target=_refresh_loop, name='option-chain', daemon=True)
+    _REFRESH_THREAD.start()
+
+def reset_chains():
+    """Drop cached layouts (e.g. after the scrip master changes strikes)"""
+    with _CHAINS_LOCK:
+        _CHAINS.clear()
+
+scrip_master_service.add_refresh_listener(reset_chains)
@@ -0,0 +1,176 @@
+import logging
+import threading
+import time
+from app.services import rate_limiter
+from app.services.rate_limiter import PRIORITY_UI, RateLimitTimeout
+
+BATCH_WINDOW = 0.03  # seconds to collect concurrent requests before calling the broker
+MAX_TOKENS_PER_CALL = 50  # Angel One quote API limit per request
+WAIT_TIMEOUT = 15.0
+
+_BATCHERS = {}  # {clientcode: QuoteBatcher}
+_BATCHERS_LOCK = threading.Lock()
+
+class _PendingQuote:
+    __slots__ = ('exchange_tokens', 'mode', 'priority', 'event', 'result')
+
+    def __init__(self, exchange_tokens, mode, priority):
+        self.exchange_tokens = exchange_tokens
+        self.mode = mode
+        self.priority = priority
+        self.event = threading.Event()
+        self.result = None
+
+class _Job:
+    """Merged requests of one mode and priority, sent one payload at a time"""
+    __slots__ = ('mode', 'priority', 'group', 'payloads', 'fetched', 'unfetched', 'failed')
+
+    def __init__(self, mode, priority, group, payloads):
+        self.mode = mode
+        self.priority = priority
+        self.group = group
+        self.payloads = payloads
+        self.fetched = {}
+        self.unfetched = {}
+        self.failed = set()
+
+def _keys(pending):
+    return [(ex, str(token)) for ex, tokens in pending.exchange_tokens.items() for token in tokens]
+
+def pack_exchange_tokens(exchange_tokens, limit=MAX_TOKENS_PER_CALL):
+    """Split {exchange: [tokens]} into payloads of at most `limit` tokens each"""
+    batches = []
+    current = {}
+    count = 0
+    for exchange, tokens in exchange_tokens.items():
+        for token in tokens:
+            if count == limit:
+                batches.append(current)
+                current = {}
+                count = 0
+            current.setdefault(exchange, []).append(token)
+            count += 1
+    if current:
+        batches.append(current)
+    return batches
+
+class QuoteBatcher:
+    """
+    Merges quote requests arriving within BATCH_WINDOW into as few broker calls as possible
+    and fans the results back out to each waiting caller
+    """
+
+    def __init__(self, clientcode, fetch):
+        self.clientcode = clientcode
+        # fetch(exchange_tokens, mode, priority) -> {'fetched': [...], 'unfetched': [...]} or None,
+        # called holding a quote rate-limit slot the batcher has already acquired
+        self.fetch = fetch
+        self.pending = []
+        self.cond = threading.Condition()
+        self.requests = 0
+        self.calls = 0
+        self.worker = threading.Thread(target=self._run, name=f'quote-batcher-{clientcode}', daemon=True)
+        self.worker.start()
+
+    def get_quotes(self, exchange_tokens, mode='FULL', priority=PRIORITY_UI, timeout=WAIT_TIMEOUT):
+        pending = _PendingQuote(exchange_tokens, mode, priority)
+        with self.cond:
+            self.pending.append(pending)
+            self.requests += 1
+            self.cond.notify()
+        if not pending.event.wait(timeout):
+            logging.warning(f"[QUOTES] Timed out waiting for batched quotes for {self.clientcode}")
+            return None
+        return pending.result
+
+    def _run(self):
+        jobs = []
+        while True:
+            with self.cond:
+                while not self.pending and not jobs:
+                    self.cond.wait()
+            if not jobs:
+                # Let concurrent callers pile in before draining
+                time.sleep(BATCH_WINDOW)
+            jobs.extend(self._plan(self._drain()))
+
+            # One broker call per pass. The rate-limit slot is taken first and the job picked once it
+            # is granted, so an exit/entry quote that arrives while a large monitor or UI batch is
+            # waiting on the limiter goes out on that very slot
+            try:
+                rate_limiter.acquire(self.clientcode, 'quote', min(job.priority for job in jobs))
+                acquired = True
+            except RateLimitTimeout:
+                acquired = False
+            jobs.extend(self._plan(self._drain()))
+            job = min(jobs, key=lambda job: job.priority)
+            try:
+                if acquired:
+                    self._send_next(job)
+                else:
+                    payload = job.payloads.pop(0)
+                    job.failed.update((ex, token) for ex, tokens in payload.items() for token in tokens)
+            except Exception as e:
+                logging.error(f"[QUOTES] Batch flush failed for {self.clientcode}: {e}")
+                job.payloads = []
+                job.failed.update(key for pending in job.group for key in _keys(pending))
+            if not job.payloads:
+                jobs.remove(job)
+                self._finish(job)
+
+    def _drain(self):
+        with self.cond:
+            batch, self.pending = self.pending, []
+        return batch
+
+    def _plan(self, batch):
+        """Merge requests sharing a mode and priority into one job of <= 50-token payloads"""
+        groups = {}
+        for pending in batch:
+            groups.setdefault((pending.mode, pending.priority), []).append(pending)
+
+        jobs = []
+        for (mode, priority), group in groups.items():
+            merged = {}
+            for pending in group:
+                for exchange, tokens in pending.exchange_tokens.items():
+                    seen = merged.setdefault(exchange, {})
+                    for token in tokens:
+                        seen[str(token)] = None
+            payloads = pack_exchange_tokens({ex: list(tokens) for ex, tokens in merged.items()})
+            jobs.append(_Job(mode, priority, group, payloads))
+        return jobs
+
+    def _send_next(self, job):
+        payload = job.payloads.pop(0)
+        self.calls += 1
+        data = self.fetch(payload, job.mode, job.priority)
+        if not data:
+            job.failed.update((ex, token) for ex, tokens in payload.items() for token in tokens)
+            return
+        for item in data.get('fetched') or []:
+            job.fetched[(item.get('exchange'), str(item.get('symbolToken')))] = item
+        for item in data.get('unfetched') or []:
+            job.unfetched[(item.get('exchange'), str(item.get('symbolToken')))] = item
+
+    def _finish(self, job):
+        for pending in job.group:
+            keys = _keys(pending)
+            if any(key in job.failed for key in keys):
+                pending.result = None
+            else:
+                pending.result = {
+                    'fetched': [job.fetched[key] for key in keys if key in job.fetched],
+                    'unfetched': [job.unfetched[key] for key in keys if key in job.unfetched],
+                }
+            pending.event.set()
+
+    def stats(self):
+        return {'requests': self.requests, 'broker_calls': self.calls}
+
+def get_quote_batcher(clientcode, fetch):
+    with _BATCHERS_LOCK:
+        batcher = _BATCHERS.get(clientcode)
+        if batcher is None:
+            batcher = _BATCHERS[clientcode] = QuoteBatcher(clientcode, fetch)
+        return batcher
@@ -0,0 +1,179 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+# Priority lanes: lower value is served first when callers queue for the same bucket
+PRIORITY_EXIT = 0
+PRIORITY_ENTRY = 1
+PRIORITY_MONITOR = 2
+PRIORITY_UI = 3
+
+# endpoint class -> (requests per second, burst capacity)
+RATE_LIMITS = {
+    'quote': (1.0, 1),
+    'historical': (3.0, 3),
+    'user': (2.0, 2),
+    'orders': (1.0, 1),
+    'default': (1.0, 1),
+}
+
+ENDPOINT_CLASSES = {
+    'quote': 'quote',
+    'candle_data': 'historical',
+    'oi_data': 'historical',
+    'profile': 'user',
+    'rms': 'user',
+    'order_book': 'orders',
+    'trade_book': 'orders',
+}
+
+ACQUIRE_TIMEOUT = 10.0  # seconds a caller may queue before giving up
+
+_LIMITERS = {}  # {(clientcode, endpoint_class): PriorityTokenBucket}
+_LIMITERS_LOCK = threading.Lock()
+
+class RateLimitTimeout(Exception):
+    pass
+
+class PriorityTokenBucket:
+    """Token bucket where queued callers are released strictly by priority, then arrival order"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.cond = threading.Condition()
+        self.waiters = []  # heap of (priority, seq)
+        self.seq = itertools.count()
+        self.granted = 0
+        self.waited = 0
+        self.wait_ms = 0.0
+        self.timeouts = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, priority=PRIORITY_UI, timeout=ACQUIRE_TIMEOUT):
+        """Block until a token is available for this caller; returns False on timeout"""
+        start = time.monotonic()
+        deadline = start + timeout if timeout is not None else None
+        with self.cond:
+            ticket = (priority, next(self.seq))
+            heapq.heappush(self.waiters, ticket)
+            try:
+                while True:
+                    self._refill()
+                    at_head = self.waiters[0] == ticket
+                    if at_head and self.tokens >= 1:
+                        self.tokens -= 1
+                        heapq.heappop(self.waiters)
+                        self.granted += 1
+                        waited_ms = (time.monotonic() - start) * 1000
+                        if waited_ms > 1:
+                            self.waited += 1
+                            self.wait_ms += waited_ms
+                        return True
+
+                    # The head sleeps until its token accrues; everyone else until notified
+                    wait = (1 - self.tokens) / self.rate if at_head else None
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.waiters.remove(ticket)
+                            heapq.heapify(self.waiters)
+                            self.timeouts += 1
+                            return False
+                        wait = remaining if wait is None else min(wait, remaining)
+                    self.cond.wait(wait)
+            finally:
+                self.cond.notify_all()
+
+    def has_headroom(self):
+        """True when nobody is queued and a token is free right now"""
+        with self.cond:
+            self._refill()
+            return not self.waiters and self.tokens >= 1
+
+    def stats(self):
+        with self.cond:
+            return {
+                'granted': self.granted,
+                'queued': len(self.waiters),
+                'waited': self.waited,
+                'avg_wait_ms': self.wait_ms / self.waited if self.waited else 0.0,
+                'timeouts': self.timeouts,
+            }
+
+def get_limiter(clientcode, endpoint):
+    endpoint_class = ENDPOINT_CLASSES.get(endpoint, 'default')
+    key = (clientcode, endpoint_class)
+    with _LIMITERS_LOCK:
+        limiter = _LIMITERS.get(key)
+        if limiter is None:
+            rate, capacity = RATE_LIMITS.get(endpoint_class, RATE_LIMITS['default'])
+            limiter = _LIMITERS[key] = PriorityTokenBucket(rate, capacity)
+        return limiter
+
+def acquire(clientcode, endpoint, priority=PRIORITY_UI, timeout=ACQUIRE_TIMEOUT):
+    """Wait for a rate-limit slot for (clientcode, endpoint class) or raise RateLimitTimeout"""
+    if not get_limiter(clientcode, endpoint).acquire(priority, timeout):
+        logging.warning(f"[RATE] {clientcode} {endpoint}: no slot within {timeout}s (priority {priority})")
+        raise RateLimitTimeout(f"Rate limit wait exceeded for {endpoint}")
+
+def has_headroom(clientcode, endpoint):
+    """Whether a background caller could use this endpoint now without delaying anyone"""
+    return get_limiter(clientcode, endpoint).has_headroom()
+
+def get_rate_limit_stats():
+    with _LIMITERS_LOCK:
+        limiters = dict(_LIMITERS)
+    return {f"{clientcode}:{endpoint_class}": limiter.stats() for (clientcode, endpoint_class), limiter in limiters.items()}
+
+class _Call:
+    __slots__ = ('event', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+class SingleFlight:
+    """Coalesce identical concurrent calls so they share one execution and its result"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
@@ -0,0 +1,225 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from app import database
+from app.utils.helpers import get_ist_now
+
+RAW_RETENTION_DAYS = 7  # Raw api_data rows younger than this are never touched
+
+# data_type -> what happens to raw rows past retention; unlisted types (orders, trades) are kept
+RETENTION_POLICY = {
+    'marketdata': 'rollup',  # Folded into per-minute OHLC rows in marketdata_ohlc
+    'profile': 'dedupe',  # Only rows where the content changed are kept
+    'rms': 'dedupe',
+    'optionchain': 'purge',
+}
+
+BATCH_ROWS = 500  # Rows per transaction, so the live writer never waits long for the lock
+BATCH_PAUSE = 0.05  # Seconds between transactions
+VACUUM_PAGES = 2000  # Pages released per incremental_vacuum step
+
+# Run outside market hours, at most once per IST day
+MARKET_QUIET_BEFORE = (9, 0)
+MARKET_QUIET_AFTER = (15, 45)
+CHECK_INTERVAL = 600
+
+_JOB_THREAD = None
+_LAST_RUN = {'date': None, 'summary': None}
+
+def _cutoff(days=RAW_RETENTION_DAYS):
+    return (datetime.now(timezone.utc) - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+
+def _batches(conn, work):
+    """Run work(conn) in its own short transaction until it reports nothing left; returns total rows"""
+    total = 0
+    while True:
+        with conn:
+            done = work(conn)
+        total += done
+        if done < BATCH_ROWS:
+            return total
+        time.sleep(BATCH_PAUSE)
+
+def _quote_points(response):
+    fetched = ((response or {}).get('data') or {}).get('fetched') or []
+    for item in fetched:
+        ltp = item.get('ltp')
+        if ltp is None:
+            continue
+        yield item.get('exchange'), str(item.get('symbolToken')), float(ltp), item.get('tradeVolume') or 0
+
+def _rollup_batch(conn, data_type, cutoff):
+    rows = conn.execute(
+        'SELECT a.id, a.timestamp, a.response, b.codec, b.data FROM api_data a '
+        'LEFT JOIN api_blobs b ON b.hash = a.blob_hash '
+        'WHERE a.data_type = ? AND a.timestamp < ? ORDER BY a.timestamp, a.id LIMIT ?',
+        (data_type, cutoff, BATCH_ROWS)
+    ).fetchall()
+    bars = {}  # (exchange, token, minute) -> [open, high, low, close, volume, samples]
+    for _, timestamp, response, codec, data in rows:
+        try:
+            decoded = database._row_response(response, codec, data)
+        except Exception as e:
+            logging.warning(f"[RETENTION] Skipping unreadable {data_type} row at {timestamp}: {e}")
+            continue
+        minute = timestamp[:16] + ':00'
+        for exchange, token, ltp, volume in _quote_points(decoded):
+            bar = bars.get((exchange, token, minute))
+            if bar is None:
+                bars[(exchange, token, minute)] = [ltp, ltp, ltp, ltp, volume, 1]
+            else:
+                bar[1] = max(bar[1], ltp)
+                bar[2] = min(bar[2], ltp)
+                bar[3] = ltp
+                bar[4] = max(bar[4], volume)
+                bar[5] += 1
+    # A minute split across batches is merged: rows are processed in time order, so the later batch closes it
+    conn.executemany(
+        '''INSERT INTO marketdata_ohlc (exchange, symbol_token, minute, open, high, low, close, volume, samples)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+           ON CONFLICT (exchange, symbol_token, minute) DO UPDATE SET
+               high = MAX(high, excluded.high),
+               low = MIN(low, excluded.low),
+               close = excluded.close,
+               volume = MAX(volume, excluded.volume),
+               samples = samples + excluded.samples''',
+        [(ex, token, minute, *bar) for (ex, token, minute), bar in bars.items()]
+    )
+    conn.executemany('DELETE FROM api_data WHERE id = ?', [(row[0],) for row in rows])
+    return len(rows)
+
+def _dedupe(conn, data_type, cutoff):
+    """
+    Keep the first row of every run of identical content per (client, endpoint)
+    The window runs once over the old rows (deleting a repeat never changes what its neighbours
+    repeat), then the ids go in BATCH_ROWS-sized transactions
+    """
+    duplicates = [row[0] for row in conn.execute(
+        '''SELECT id FROM (
+               SELECT id, blob_hash, LAG(blob_hash) OVER (
+                   PARTITION BY clientcode, endpoint ORDER BY timestamp, id
+               ) AS previous
+               FROM api_data WHERE data_type = ? AND timestamp < ?
+           ) WHERE blob_hash IS NOT NULL AND blob_hash = previous''',
+        (data_type, cutoff)
+    )]
+    chunks = (duplicates[i:i + BATCH_ROWS] for i in range(0, len(duplicates), BATCH_ROWS))
+
+    def work(c):
+        chunk = next(chunks, [])
+        c.executemany('DELETE FROM api_data WHERE id = ?', [(row_id,) for row_id in chunk])
+        return len(chunk)
+
+    return _batches(conn, work)
+
+def _purge_batch(conn, data_type, cutoff):
+    cursor = conn.execute(
+        'DELETE FROM api_data WHERE id IN (SELECT id FROM api_data WHERE data_type = ? AND timestamp < ? LIMIT ?)',
+        (data_type, cutoff, BATCH_ROWS)
+    )
+    return cursor.rowcount
+
+def _convert_legacy_batch(conn):
+    """Move rows written before blob storage (inline JSON) into api_blobs so they dedupe and compress"""
+    rows = conn.execute(
+        'SELECT id, response FROM api_data WHERE blob_hash IS NULL AND response IS NOT NULL LIMIT ?',
+        (BATCH_ROWS,)
+    ).fetchall()
+    blobs = {}
+    updates = []
+    for row_id, response in rows:
+        raw, digest = database.canonical_response(json.loads(response))
+        if digest not in blobs:
+            codec, data = database.encode_response(raw)
+            blobs[digest] = (digest, codec, data, len(raw))
+        updates.append((digest, row_id))
+    conn.executemany('INSERT OR IGNORE INTO api_blobs (hash, codec, data, size) VALUES (?, ?, ?, ?)', blobs.values())
+    conn.executemany('UPDATE api_data SET blob_hash = ?, response = NULL WHERE id = ?', updates)
+    return len(rows)
+
+def _gc_blobs_batch(conn):
+    cursor = conn.execute(
+        '''DELETE FROM api_blobs WHERE hash IN (
+               SELECT hash FROM api_blobs b
+               WHERE NOT EXISTS (SELECT 1 FROM api_data a WHERE a.blob_hash = b.hash)
+               LIMIT ?
+           )''',
+        (BATCH_ROWS,)
+    )
+    return cursor.rowcount
+
+def _compact(conn):
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        # Files created before incremental auto-vacuum keep their old mode until rebuilt; this
+        # one-off VACUUM (outside market hours, like the rest of the job) switches them over
+        logging.info("[RETENTION] Converting database to incremental auto-vacuum (one-off VACUUM)")
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        try:
+            conn.execute('VACUUM')
+        except sqlite3.OperationalError as e:
+            logging.warning(f"[RETENTION] Auto-vacuum conversion deferred: {e}")
+    else:
+        while conn.execute('PRAGMA freelist_count').fetchone()[0] > 0:
+            # executescript steps the pragma to completion; execute() frees only one page per call
+            conn.executescript(f'PRAGMA incremental_vacuum({VACUUM_PAGES});')
+            time.sleep(BATCH_PAUSE)
+    conn.execute('PRAGMA optimize')
+    conn.execute('PRAGMA wal_checkpoint(PASSIVE)')
+
+def run_retention_job(raw_days=RAW_RETENTION_DAYS):
+    """One incremental pass of rollup, dedupe, purge, blob GC and compaction; returns row counts"""
+    start = time.perf_counter()
+    cutoff = _cutoff(raw_days)
+    summary = {}
+    conn = database._connect()
+    try:
+        # Legacy rows first, so they take part in dedupe below
+        summary['legacy_converted'] = _batches(conn, _convert_legacy_batch)
+        for data_type, action in RETENTION_POLICY.items():
+            if action == 'dedupe':
+                summary[f'{data_type}_{action}'] = _dedupe(conn, data_type, cutoff)
+                continue
+            if action == 'rollup':
+                work = lambda c, t=data_type: _rollup_batch(c, t, cutoff)
+            elif action == 'purge':
+                work = lambda c, t=data_type: _purge_batch(c, t, cutoff)
+            else:
+                logging.warning(f"[RETENTION] Unknown action {action} for {data_type}")
+                continue
+            summary[f'{data_type}_{action}'] = _batches(conn, work)
+        summary['blobs_freed'] = _batches(conn, _gc_blobs_batch)
+        _compact(conn)
+    finally:
+        conn.close()
+    summary['elapsed_s'] = round(time.perf_counter() - start, 2)
+    logging.info(f"[RETENTION] Completed: {summary}")
+    return summary
+
+def _is_quiet_time(now):
+    quiet_before = now.replace(hour=MARKET_QUIET_BEFORE[0], minute=MARKET_QUIET_BEFORE[1], second=0, microsecond=0)
+    quiet_after = now.replace(hour=MARKET_QUIET_AFTER[0], minute=MARKET_QUIET_AFTER[1], second=0, microsecond=0)
+    return now.weekday() >= 5 or now < quiet_before or now >= quiet_after
+
+def _job_loop():
+    while True:
+        now = get_ist_now()
+        if _LAST_RUN['date'] != now.date() and _is_quiet_time(now):
+            try:
+                _LAST_RUN['summary'] = run_retention_job()
+            except Exception as e:
+                logging.error(f"[RETENTION] Job failed: {e}")
+            _LAST_RUN['date'] = now.date()
+        time.sleep(CHECK_INTERVAL)
+
+def start_retention_job():
+    global _JOB_THREAD
+    if _JOB_THREAD and _JOB_THREAD.is_alive():
+        return
+    _JOB_THREAD = threading.Thread(target=_job_loop, name='db-retention', daemon=True)
+    _JOB_THREAD.start()
+
+def get_retention_status():
+    return dict(_LAST_RUN)
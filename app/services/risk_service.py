@@ -1,14 +1,16 @@
 import logging
-import os
-import requests
-from datetime import datetime, timedelta
-from app.services.smartapi_service import _SMARTAPI_SESSIONS
+from datetime import datetime
+from app.services.smartapi_service import get_session_for_client
+from app.services.broker_client import get_broker_client
+from app.services.rate_limiter import PRIORITY_ENTRY
+from app.utils.time_window import TimeWindowBuffer
 
 # Global state for risk management
 DAILY_STATS = {}  # {clientcode: {date: {pnl, trades_count, wins, losses, commissions, slippage}}}
 KELLY_MULTIPLIER = {}  # {clientcode: multiplier}
 INITIAL_CAPITAL = {}  # {clientcode: starting_capital}
-FLASH_CRASH_CACHE = {}  # {clientcode: [price_snapshots]}
+FLASH_CRASH_CACHE = {}  # {clientcode: TimeWindowBuffer of the last 5 minutes of prices}
+FLASH_CRASH_WINDOW = 300  # Seconds
 OPENING_PRICE_CACHE = {}  # {clientcode: opening_price}
 CONSECUTIVE_LOSSES = {}  # {clientcode: count}
 PEAK_DAILY_PROFIT = {}  # {clientcode: peak_profit}
@@ -17,35 +19,12 @@ def get_available_capital_from_profile(clientcode):
     """Fetch available capital from Angel One RMS API"""
     try:
         # Find session for this client
-        session_id = None
-        for sid, sdata in _SMARTAPI_SESSIONS.items():
-            if sdata.get('clientcode') == clientcode:
-                session_id = sid
-                break
-        
-        if not session_id:
+        user_session = get_session_for_client(clientcode)
+        if not user_session:
             logging.warning(f"No session found for {clientcode}, using default capital")
             return 15000
         
-        jwt_token = _SMARTAPI_SESSIONS[session_id]['tokens'].get('jwtToken', '')
-        if jwt_token.startswith('Bearer '):
-            jwt_token = jwt_token[7:]
-        
-        url = "https://apiconnect.angelone.in/rest/secure/angelbroking/user/v1/getRMS"
-        headers = {
-            'Authorization': f'Bearer {jwt_token}',
-            'Content-Type': 'application/json',
-            'Accept': 'application/json',
-            'X-UserType': 'USER',
-            'X-SourceID': 'WEB',
-            'X-ClientLocalIP': 'CLIENT_LOCAL_IP',
-            'X-ClientPublicIP': 'CLIENT_PUBLIC_IP',
-            'X-MACAddress': 'MAC_ADDRESS',
-            'X-PrivateKey': os.getenv('SMARTAPI_API_KEY')
-        }
-        
-        r = requests.get(url, headers=headers, timeout=10)
-        data = r.json()
+        data = get_broker_client(user_session).request('rms', priority=PRIORITY_ENTRY)
         
         if data.get('status') and data.get('data'):
             rms_data = data['data']
@@ -165,19 +144,16 @@ def check_flash_crash_protection(clientcode, current_price):
     global FLASH_CRASH_CACHE
     
     if clientcode not in FLASH_CRASH_CACHE:
-        FLASH_CRASH_CACHE[clientcode] = []
-    
-    now = datetime.now()
-    FLASH_CRASH_CACHE[clientcode].append((now, current_price))
+        FLASH_CRASH_CACHE[clientcode] = TimeWindowBuffer(FLASH_CRASH_WINDOW, capacity=4096)
     
-    cutoff = now - timedelta(minutes=5)
-    FLASH_CRASH_CACHE[clientcode] = [(ts, p) for ts, p in FLASH_CRASH_CACHE[clientcode] if ts > cutoff]
+    prices = FLASH_CRASH_CACHE[clientcode]
+    prices.append(current_price)
     
-    if len(FLASH_CRASH_CACHE[clientcode]) < 2:
+    change_pct = prices.change_pct()
+    if change_pct is None:
         return (True, "Insufficient data", 0.0)
     
-    oldest_price = FLASH_CRASH_CACHE[clientcode][0][1]
-    move_pct = abs((current_price - oldest_price) / oldest_price) * 100
+    move_pct = abs(change_pct)
     
     if move_pct > 2.0:
         return (False, f"[ALERT] FLASH MOVE: NIFTY moved {move_pct:.1f}% in 5 min (pausing)", move_pct)
@@ -0,0 +1,445 @@
+import codecs
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import requests
+from datetime import datetime
+from app.utils.helpers import get_ist_now
+
+SCRIP_MASTER_URL = os.getenv(
+    'SCRIP_MASTER_URL',
+    'https://margincalculator.angelbroking.com/OpenAPI_File/files/OpenAPIScripMaster.json'
+)
+SCRIP_DB_FILE = 'scrip_master.db'
+
+# Only the segments we trade are kept; everything else is dropped while streaming
+TRADED_SEGMENTS = {
+    ('NFO', 'OPTIDX'),
+    ('NFO', 'FUTIDX'),
+    ('NSE', 'AMXIDX'),
+}
+STREAM_CHUNK_SIZE = 64 * 1024
+INSERT_BATCH_SIZE = 5000
+MAX_RECORD_SIZE = 1024 * 1024
+SCRIP_RETRY_SECONDS = 300  # After a failed refresh the stored copy is served this long before trying again
+
+# Serialises refreshes so concurrent callers don't download the file twice
+_REFRESH_LOCK = threading.Lock()
+_REFRESH_LISTENERS = []
+# In-memory refresh state so lookups skip the lock and meta reads once today's copy is confirmed
+# checked: IST date the stored copy was last confirmed current; retry_at: monotonic time before
+# which a failed refresh isn't retried; stored: a copy exists to serve meanwhile
+_SCRIP_STATE = {'db_ready': False, 'checked': None, 'retry_at': 0.0, 'stored': False}
+
+INSTRUMENT_COLUMNS = (
+    'token', 'symbol', 'name', 'expiry', 'expiry_date', 'strike',
+    'option_type', 'lotsize', 'instrumenttype', 'exch_seg', 'tick_size'
+)
+
+def _connect():
+    conn = sqlite3.connect(SCRIP_DB_FILE, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def _create_instruments_table(c, table, temp=False):
+    c.execute(f'''
+        CREATE {'TEMP ' if temp else ''}TABLE IF NOT EXISTS {table} (
+            token TEXT,
+            symbol TEXT,
+            name TEXT,
+            expiry TEXT,
+            expiry_date DATE,
+            strike REAL,
+            option_type TEXT,
+            lotsize INTEGER,
+            instrumenttype TEXT,
+            exch_seg TEXT,
+            tick_size REAL,
+            PRIMARY KEY (exch_seg, token)
+        )
+    ''')
+
+def init_scrip_db():
+    conn = _connect()
+    c = conn.cursor()
+    _create_instruments_table(c, 'instruments')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_instruments_lookup
+        ON instruments (name, instrumenttype, option_type, expiry_date, strike)
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_instruments_symbol ON instruments (symbol)')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS scrip_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+    conn.commit()
+    conn.close()
+
+def _get_meta(conn, key):
+    row = conn.execute('SELECT value FROM scrip_meta WHERE key = ?', (key,)).fetchone()
+    return row['value'] if row else None
+
+def _set_meta(conn, key, value):
+    conn.execute('INSERT OR REPLACE INTO scrip_meta (key, value) VALUES (?, ?)', (key, value))
+
+def parse_strike(item):
+    """Strike price for an option row (symbol-encoded strike, falling back to the paise field)"""
+    symbol_str = item.get('symbol', '')
+    name = item.get('name', '')
+    expiry_str = item.get('expiry', '')
+    try:
+        date_part = datetime.strptime(expiry_str, '%d%b%Y').strftime('%d%b%y').upper()
+        remaining = symbol_str.replace(name, '', 1)
+        if remaining.endswith('CE') or remaining.endswith('PE'):
+            remaining = remaining[:-2]
+        if remaining.startswith(date_part):
+            strike_str = remaining[len(date_part):]
+            if strike_str.isdigit():
+                return float(strike_str)
+    except ValueError:
+        pass
+    try:
+        return float(item.get('strike') or 0) / 100
+    except ValueError:
+        return 0.0
+
+def to_instrument_row(item):
+    """Convert a raw scrip master record into an instruments table row"""
+    symbol_str = item.get('symbol', '')
+    expiry_str = item.get('expiry', '')
+    try:
+        expiry_date = datetime.strptime(expiry_str, '%d%b%Y').date().isoformat()
+    except ValueError:
+        expiry_date = None
+
+    option_type = symbol_str[-2:] if symbol_str[-2:] in ('CE', 'PE') else None
+    strike = parse_strike(item) if option_type else None
+
+    try:
+        lotsize = int(item.get('lotsize') or 0)
+    except ValueError:
+        lotsize = 0
+    try:
+        tick_size = float(item.get('tick_size') or 0)
+    except ValueError:
+        tick_size = 0.0
+
+    return (
+        item.get('token'), symbol_str, item.get('name'), expiry_str, expiry_date,
+        strike, option_type, lotsize, item.get('instrumenttype'), item.get('exch_seg'), tick_size
+    )
+
+def iter_json_array(chunks):
+    """
+    Incrementally decode a top-level JSON array of objects from an iterable of byte chunks
+    Only the current chunk and the object being decoded are held in memory
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buffer = ''
+    pos = 0
+    started = False
+    eof = False
+
+    while True:
+        # Skip separators between elements
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+            pos += 1
+        if not started and pos < len(buffer):
+            if buffer[pos] != '[':
+                raise ValueError("Scrip master is not a JSON array")
+            started = True
+            pos += 1
+            continue
+        if started and pos < len(buffer) and buffer[pos] == ']':
+            return
+
+        if pos < len(buffer):
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                item = None
+            if item is not None:
+                pos = end
+                yield item
+                continue
+
+        if eof:
+            if started:
+                raise ValueError("Scrip master JSON ended before the closing bracket")
+            return
+
+        # Need more data: drop consumed text and append the next chunk
+        buffer = buffer[pos:]
+        pos = 0
+        if len(buffer) > MAX_RECORD_SIZE:
+            raise ValueError("Scrip master record exceeds maximum size (malformed JSON?)")
+        chunk = next(chunks, None)
+        if chunk is None:
+            buffer += utf8.decode(b'', final=True)
+            eof = True
+        else:
+            buffer += utf8.decode(chunk)
+
+def iter_traded_scrips(records):
+    """Filter raw scrip master records down to the segments we trade"""
+    for item in records:
+        if (item.get('exch_seg'), item.get('instrumenttype')) in TRADED_SEGMENTS and item.get('token'):
+            yield item
+
+def stream_scrip_master(response, digest=None):
+    """Stream traded scrip master records from an HTTP response without loading the whole file"""
+    def chunks():
+        for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+            if digest is not None:
+                digest.update(chunk)
+            yield chunk
+    yield from iter_traded_scrips(iter_json_array(chunks()))
+
+def _insert_batches(conn, table, records):
+    sql = (
+        f'INSERT OR REPLACE INTO {table} ({", ".join(INSTRUMENT_COLUMNS)}) '
+        f'VALUES ({", ".join("?" for _ in INSTRUMENT_COLUMNS)})'
+    )
+    count = 0
+    batch = []
+    for item in records:
+        batch.append(to_instrument_row(item))
+        if len(batch) >= INSERT_BATCH_SIZE:
+            conn.executemany(sql, batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        conn.executemany(sql, batch)
+        count += len(batch)
+    return count
+
+def _bump_version(conn):
+    _set_meta(conn, 'version', str(int(_get_meta(conn, 'version') or 0) + 1))
+
+def apply_instruments(records, meta=None, previous_hash=None, digest=None):
+    """
+    Stream records into a staging table, diff them against the stored copy and apply only
+    added/changed and removed/expired contracts in one transaction, so readers see either
+    the previous version or the new one
+    Returns: (added_or_changed, removed)
+    """
+    today = get_ist_now().date().isoformat()
+    conn = _connect()
+    try:
+        with conn:
+            c = conn.cursor()
+            c.execute('DROP TABLE IF EXISTS temp.staging')
+            _create_instruments_table(c, 'staging', temp=True)
+            received = _insert_batches(conn, 'temp.staging', records)
+
+            if previous_hash and digest is not None and digest.hexdigest() == previous_hash:
+                # Same bytes as last time: nothing to diff, only expiries can have changed
+                c.execute(
+                    'DELETE FROM instruments WHERE expiry_date IS NOT NULL AND expiry_date < ?', (today,)
+                )
+                removed = c.rowcount
+                added = 0
+            else:
+                c.execute('''
+                    DELETE FROM instruments
+                    WHERE (expiry_date IS NOT NULL AND expiry_date < ?)
+                       OR (exch_seg, token) NOT IN (SELECT exch_seg, token FROM temp.staging)
+                ''', (today,))
+                removed = c.rowcount
+
+                c.execute('''
+                    INSERT OR REPLACE INTO instruments
+                    SELECT * FROM temp.staging WHERE expiry_date IS NULL OR expiry_date >= ?
+                    EXCEPT
+                    SELECT * FROM instruments
+                ''', (today,))
+                added = c.rowcount
+
+            if added or removed:
+                _bump_version(conn)
+            for key, value in (meta or {}).items():
+                _set_meta(conn, key, value)
+            if digest is not None:
+                _set_meta(conn, 'content_hash', digest.hexdigest())
+            _set_meta(conn, 'loaded_date', today)
+            _set_meta(conn, 'row_count', str(received))
+            c.execute('DROP TABLE temp.staging')
+    finally:
+        conn.close()
+    logging.info(f"[SCRIP] Applied scrip master delta: {added} added/changed, {removed} removed")
+    return added, removed
+
+def purge_expired_instruments():
+    """Drop contracts that expired before today"""
+    today = get_ist_now().date().isoformat()
+    conn = _connect()
+    try:
+        with conn:
+            removed = conn.execute(
+                'DELETE FROM instruments WHERE expiry_date IS NOT NULL AND expiry_date < ?', (today,)
+            ).rowcount
+            if removed:
+                _bump_version(conn)
+            _set_meta(conn, 'loaded_date', today)
+    finally:
+        conn.close()
+    return removed
+
+def get_scrip_master_version():
+    conn = _connect()
+    try:
+        return int(_get_meta(conn, 'version') or 0)
+    finally:
+        conn.close()
+
+def add_refresh_listener(callback):
+    """Register a callback run after the stored instruments change"""
+    if callback not in _REFRESH_LISTENERS:
+        _REFRESH_LISTENERS.append(callback)
+
+def _notify_refresh():
+    for callback in _REFRESH_LISTENERS:
+        try:
+            callback()
+        except Exception as e:
+            logging.error(f"[SCRIP] Refresh listener failed: {e}")
+
+def refresh_scrip_master(force=False, url=None):
+    """
+    Refresh the stored scrip master at most once per trading day
+    Sends ETag/Last-Modified validators, falls back to a content hash when the server
+    gives none, and applies only the delta
+    Returns: True if the stored instruments changed
+    """
+    with _REFRESH_LOCK:
+        if not _SCRIP_STATE['db_ready']:
+            init_scrip_db()
+            _SCRIP_STATE['db_ready'] = True
+        today = get_ist_now().date().isoformat()
+        conn = _connect()
+        try:
+            loaded_date = _get_meta(conn, 'loaded_date')
+            etag = _get_meta(conn, 'etag')
+            last_modified = _get_meta(conn, 'last_modified')
+            content_hash = _get_meta(conn, 'content_hash')
+        finally:
+            conn.close()
+
+        if loaded_date == today and not force:
+            _SCRIP_STATE.update(checked=today, stored=True)
+            return False
+
+        headers = {}
+        if loaded_date:
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        logging.info(f"[SCRIP] Refreshing scrip master (conditional={bool(headers)})")
+        response = requests.get(url or SCRIP_MASTER_URL, headers=headers, timeout=30, stream=True)
+        try:
+            if response.status_code == 304:
+                removed = purge_expired_instruments()
+                logging.info(f"[SCRIP] Scrip master not modified ({removed} expired contracts purged)")
+                changed = removed > 0
+            else:
+                response.raise_for_status()
+                digest = hashlib.sha256()
+                meta = {
+                    'etag': response.headers.get('ETag', ''),
+                    'last_modified': response.headers.get('Last-Modified', ''),
+                }
+                added, removed = apply_instruments(
+                    stream_scrip_master(response, digest), meta, content_hash if loaded_date else None, digest
+                )
+                changed = bool(added or removed)
+        finally:
+            response.close()
+        _SCRIP_STATE.update(checked=today, stored=True)
+
+    if changed:
+        _notify_refresh()
+    return changed
+
+def ensure_scrip_master():
+    """
+    Make sure today's scrip master is available, refreshing at most once per day
+    Once today's copy is confirmed this returns without touching the lock or the database; while
+    a refresh is running or backing off after a failure, a stored copy is served as is
+    """
+    if _SCRIP_STATE['checked'] == get_ist_now().date().isoformat():
+        return
+    if _SCRIP_STATE['stored'] and (time.monotonic() < _SCRIP_STATE['retry_at'] or _REFRESH_LOCK.locked()):
+        return
+    try:
+        refresh_scrip_master()
+    except Exception as e:
+        # A stale copy is still usable for lookups; only fail if there is none
+        logging.error(f"[SCRIP] Scrip master refresh failed: {e}; retrying in {SCRIP_RETRY_SECONDS}s")
+        _SCRIP_STATE['retry_at'] = time.monotonic() + SCRIP_RETRY_SECONDS
+        conn = _connect()
+        try:
+            _SCRIP_STATE['stored'] = bool(_get_meta(conn, 'loaded_date'))
+        finally:
+            conn.close()
+        if not _SCRIP_STATE['stored']:
+            raise
+
+def search_instruments(name, instrumenttype='OPTIDX', option_type=None, expiry=None,
+                       strike=None, exch_seg='NFO', active_only=True, limit=None):
+    """
+    Look up instruments by name/instrumenttype/option type/expiry/strike
+    Returns: list of dicts ordered by expiry date then strike
+    """
+    ensure_scrip_master()
+
+    clauses = ['name = ?', 'instrumenttype = ?', 'exch_seg = ?']
+    params = [name, instrumenttype, exch_seg]
+    if option_type:
+        clauses.append('option_type = ?')
+        params.append(option_type)
+    if expiry:
+        clauses.append('expiry = ?')
+        params.append(expiry)
+    if strike is not None:
+        clauses.append('strike = ?')
+        params.append(float(strike))
+    if active_only:
+        clauses.append('expiry_date >= ?')
+        params.append(get_ist_now().date().isoformat())
+
+    sql = f'SELECT * FROM instruments WHERE {" AND ".join(clauses)} ORDER BY expiry_date, strike'
+    if limit:
+        sql += f' LIMIT {int(limit)}'
+
+    conn = _connect()
+    try:
+        return [dict(row) for row in conn.execute(sql, params)]
+    finally:
+        conn.close()
+
+def get_instrument_by_symbol(symbol, exch_seg=None):
+    """Exact lookup by trading symbol"""
+    ensure_scrip_master()
+    conn = _connect()
+    try:
+        if exch_seg:
+            row = conn.execute(
+                'SELECT * FROM instruments WHERE symbol = ? AND exch_seg = ?', (symbol, exch_seg)
+            ).fetchone()
+        else:
+            row = conn.execute('SELECT * FROM instruments WHERE symbol = ?', (symbol,)).fetchone()
+        return dict(row) if row else None
+    finally:
+        conn.close()
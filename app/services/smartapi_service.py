@@ -1,40 +1,178 @@
 import os
-import pickle
+import json
 import logging
+import sqlite3
+import threading
 import uuid
 from datetime import datetime, timedelta
 from SmartApi import SmartConnect
+from app.utils.helpers import IST, get_ist_now
 
 # Global session manager for SmartApi
 _SMARTAPI_SESSIONS = {}
-SESSION_FILE = 'sessions.pkl'
+SESSION_DB_NAME = 'sessions.db'  # Holds live JWT/refresh tokens; lives under DATA_DIR, never the working tree
+LEGACY_SESSION_DB_FILE = 'sessions.db'  # Where older builds wrote it (the process's working directory)
+SESSION_TTL = timedelta(days=1)  # Matches app.permanent_session_lifetime
 
-def load_sessions():
-    global _SMARTAPI_SESSIONS
+# Secondary indexes over _SMARTAPI_SESSIONS; always mutated under _SESSIONS_LOCK
+_SESSIONS_BY_CLIENT = {}  # {clientcode: session_id} most recent login per client
+_PRIMARY_SESSION_ID = None  # Live session used for shared market data (VIX, index quotes)
+_SESSIONS_LOCK = threading.RLock()
+
+def _session_db_file():
+    return os.path.join(os.getenv('DATA_DIR', 'data'), SESSION_DB_NAME)
+
+def _connect():
+    return sqlite3.connect(_session_db_file(), timeout=10)
+
+def init_session_store():
+    path = _session_db_file()
+    os.makedirs(os.path.dirname(path) or '.', mode=0o700, exist_ok=True)
+    if not os.path.exists(path) and os.path.exists(LEGACY_SESSION_DB_FILE):
+        os.replace(LEGACY_SESSION_DB_FILE, path)
+        logging.info(f"Moved session store to {path}")
+    conn = _connect()
+    c = conn.cursor()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_id TEXT PRIMARY KEY,
+            clientcode TEXT,
+            tokens TEXT,
+            login_time TEXT,
+            expires_at TEXT
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires_at)')
+    conn.commit()
+    conn.close()
+    os.chmod(path, 0o600)
+
+def _persist_session(session_id, sdata):
+    """Single-row upsert of a session's tokens and metadata (never the SmartConnect client)"""
     try:
-        if os.path.exists(SESSION_FILE):
-            with open(SESSION_FILE, 'rb') as f:
-                _SMARTAPI_SESSIONS = pickle.load(f)
-            logging.info(f"Loaded {len(_SMARTAPI_SESSIONS)} persisted sessions")
+        conn = _connect()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO sessions (session_id, clientcode, tokens, login_time, expires_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (
+                    session_id,
+                    sdata['clientcode'],
+                    json.dumps(sdata['tokens']),
+                    sdata['login_time'].isoformat(),
+                    sdata['expires_at'].isoformat(),
+                )
+            )
+        conn.close()
     except Exception as e:
-        logging.error(f"Failed to load sessions: {e}")
-        _SMARTAPI_SESSIONS = {}
+        logging.error(f"Failed to persist session {session_id}: {e}")
 
-def save_sessions():
+def _delete_persisted_session(session_id):
     try:
-        with open(SESSION_FILE, 'wb') as f:
-            pickle.dump(_SMARTAPI_SESSIONS, f)
-        logging.info(f"Saved {len(_SMARTAPI_SESSIONS)} sessions")
+        conn = _connect()
+        with conn:
+            conn.execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
+        conn.close()
     except Exception as e:
-        logging.error(f"Failed to save sessions: {e}")
+        logging.error(f"Failed to delete session {session_id}: {e}")
+
+_EARLIEST = IST.localize(datetime(2000, 1, 1))
+
+def _as_ist(value):
+    """Stored ISO time -> IST-aware datetime; naive values (older builds) were the server's local time"""
+    moment = datetime.fromisoformat(value)
+    return moment.astimezone(IST)
+
+def _latest_session_id(clientcode=None):
+    candidates = [
+        (sdata.get('login_time') or _EARLIEST, sid)
+        for sid, sdata in _SMARTAPI_SESSIONS.items()
+        if clientcode is None or sdata.get('clientcode') == clientcode
+    ]
+    return max(candidates)[1] if candidates else None
 
-# Initialize sessions on module load
-load_sessions()
+def _rebuild_indexes():
+    global _PRIMARY_SESSION_ID
+    _SESSIONS_BY_CLIENT.clear()
+    for clientcode in {sdata.get('clientcode') for sdata in _SMARTAPI_SESSIONS.values()}:
+        _SESSIONS_BY_CLIENT[clientcode] = _latest_session_id(clientcode)
+    _PRIMARY_SESSION_ID = _latest_session_id()
+
+def load_sessions():
+    """Load unexpired sessions (tokens and metadata only); clients are rebuilt on first use"""
+    with _SESSIONS_LOCK:
+        try:
+            init_session_store()
+            now = get_ist_now()
+            conn = _connect()
+            rows = conn.execute(
+                'SELECT session_id, clientcode, tokens, login_time, expires_at FROM sessions'
+            ).fetchall()
+            expired = []
+            for session_id, clientcode, tokens, login_time, expires_at in rows:
+                # Compared as aware datetimes: stored strings may carry different offsets
+                expires_at = _as_ist(expires_at)
+                if expires_at <= now:
+                    expired.append((session_id,))
+                    continue
+                _SMARTAPI_SESSIONS[session_id] = {
+                    'clientcode': clientcode,
+                    'tokens': json.loads(tokens),
+                    'login_time': _as_ist(login_time),
+                    'expires_at': expires_at,
+                }
+            with conn:
+                conn.executemany('DELETE FROM sessions WHERE session_id = ?', expired)
+            conn.close()
+            logging.info(f"Loaded {len(rows) - len(expired)} persisted sessions")
+        except Exception as e:
+            logging.error(f"Failed to load sessions: {e}")
+        _rebuild_indexes()
+
+def _build_api(sdata):
+    """Recreate the SmartConnect client for a session restored from the store"""
+    smartApi = SmartConnect(os.getenv('SMARTAPI_API_KEY'))
+    tokens = sdata['tokens']
+    if tokens.get('jwtToken'):
+        smartApi.setAccessToken(tokens['jwtToken'])
+    if tokens.get('refreshToken'):
+        smartApi.setRefreshToken(tokens['refreshToken'])
+    if tokens.get('feedToken'):
+        smartApi.setFeedToken(tokens['feedToken'])
+    return smartApi
+
+def _live_session(session_id):
+    """Session dict with its client attached, or None if missing/expired"""
+    sdata = _SMARTAPI_SESSIONS.get(session_id) if session_id else None
+    if sdata is None:
+        return None
+    if sdata['expires_at'] <= get_ist_now():
+        logging.info(f"Session {session_id} for {sdata.get('clientcode')} expired")
+        remove_session(session_id)
+        return None
+    if 'api' not in sdata:
+        with _SESSIONS_LOCK:
+            if 'api' not in sdata:
+                sdata['api'] = _build_api(sdata)
+                logging.info(f"Rebuilt SmartAPI client for session {session_id}")
+    return sdata
 
 def get_session(session_id):
-    return _SMARTAPI_SESSIONS.get(session_id)
+    return _live_session(session_id)
+
+def get_session_id_for_client(clientcode):
+    return _SESSIONS_BY_CLIENT.get(clientcode)
+
+def get_session_for_client(clientcode):
+    """O(1) lookup of the most recent session for a client code"""
+    return _live_session(_SESSIONS_BY_CLIENT.get(clientcode))
+
+def get_primary_session():
+    """Session used for market data that isn't tied to a particular client (VIX, index quotes)"""
+    return _live_session(_PRIMARY_SESSION_ID)
 
 def create_session(clientcode, password, totp, api_key):
+    global _PRIMARY_SESSION_ID
     logging.info(f"Attempting login for clientcode={clientcode}")
     smartApi = SmartConnect(api_key)
     
@@ -63,17 +201,54 @@ def create_session(clientcode, password, totp, api_key):
         smartApi.setFeedToken(feed_token)
     
     session_id = uuid.uuid4().hex
-    _SMARTAPI_SESSIONS[session_id] = {
+    login_time = get_ist_now()  # Aware, so expiry checks agree whatever the server's timezone
+    sdata = {
         'api': smartApi,
         'clientcode': clientcode,
         'tokens': tokens,
-        'login_time': datetime.now()
+        'login_time': login_time,
+        'expires_at': login_time + SESSION_TTL
     }
-    save_sessions()
+    with _SESSIONS_LOCK:
+        _SMARTAPI_SESSIONS[session_id] = sdata
+        _SESSIONS_BY_CLIENT[clientcode] = session_id
+        _PRIMARY_SESSION_ID = session_id
+    _persist_session(session_id, sdata)
     logging.info(f"Login successful for clientcode={clientcode}, session_id={session_id}, tokens extracted")
     return session_id, None
 
+def update_session_tokens(session_id, tokens):
+    """Swap in renewed tokens; the dict is replaced whole so readers never see a half-updated set"""
+    with _SESSIONS_LOCK:
+        sdata = _SMARTAPI_SESSIONS.get(session_id)
+        if sdata is None:
+            return False
+        sdata['tokens'] = tokens
+        api = sdata.get('api')
+        if api is not None:
+            api.setAccessToken(tokens['jwtToken'])
+            if tokens.get('refreshToken'):
+                api.setRefreshToken(tokens['refreshToken'])
+            if tokens.get('feedToken'):
+                api.setFeedToken(tokens['feedToken'])
+    _persist_session(session_id, sdata)
+    return True
+
 def remove_session(session_id):
-    if session_id and session_id in _SMARTAPI_SESSIONS:
-        del _SMARTAPI_SESSIONS[session_id]
-        save_sessions()
+    global _PRIMARY_SESSION_ID
+    if not session_id:
+        return
+    with _SESSIONS_LOCK:
+        sdata = _SMARTAPI_SESSIONS.pop(session_id, None)
+        if sdata is None:
+            return
+        clientcode = sdata.get('clientcode')
+        if _SESSIONS_BY_CLIENT.get(clientcode) == session_id:
+            replacement = _latest_session_id(clientcode)
+            if replacement:
+                _SESSIONS_BY_CLIENT[clientcode] = replacement
+            else:
+                del _SESSIONS_BY_CLIENT[clientcode]
+        if _PRIMARY_SESSION_ID == session_id:
+            _PRIMARY_SESSION_ID = _latest_session_id()
+    _delete_persisted_session(session_id)
@@ -0,0 +1,104 @@
+import base64
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from app.services import smartapi_service
+from app.services.broker_client import get_broker_client
+from app.utils.helpers import IST, get_ist_now
+
+REFRESH_AHEAD = timedelta(minutes=30)  # Renew this long before the JWT expires
+CHECK_INTERVAL = 60  # Seconds between expiry checks
+RETRY_BACKOFF = 120  # Seconds before retrying a failed refresh
+
+# Before the open, make sure tokens last the whole session so 09:15 never pays a re-login
+PREOPEN_START = (8, 45)
+SESSION_END = (15, 30)
+
+_REFRESH_THREAD = None
+_LAST_FAILURE = {}  # {session_id: monotonic time of last failed refresh}
+
+def get_token_expiry(jwt_token):
+    """Expiry (IST datetime) from the JWT 'exp' claim, or None if it can't be read"""
+    try:
+        token = (jwt_token or '').replace('Bearer ', '', 1)
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+        return datetime.fromtimestamp(int(claims['exp']), IST)
+    except Exception:
+        return None
+
+def needs_refresh(sdata, now=None):
+    now = now or get_ist_now()
+    expiry = get_token_expiry(sdata['tokens'].get('jwtToken'))
+    if expiry is None:
+        expiry = sdata['expires_at']  # IST-aware, like now
+    if expiry - now <= REFRESH_AHEAD:
+        return True
+    preopen = now.replace(hour=PREOPEN_START[0], minute=PREOPEN_START[1], second=0, microsecond=0)
+    market_open = now.replace(hour=9, minute=15, second=0, microsecond=0)
+    session_end = now.replace(hour=SESSION_END[0], minute=SESSION_END[1], second=0, microsecond=0)
+    return preopen <= now < market_open and expiry < session_end
+
+def refresh_session_tokens(session_id):
+    """Renew a session's JWT/feed token with its refresh token and swap them in everywhere"""
+    sdata = smartapi_service.get_session(session_id)
+    if not sdata:
+        return False
+    refresh_token = sdata['tokens'].get('refreshToken')
+    if not refresh_token:
+        logging.warning(f"[TOKEN] No refresh token for session {session_id}")
+        return False
+
+    response = sdata['api'].generateToken(refresh_token)
+    data = response.get('data') if isinstance(response, dict) else None
+    if not data or not data.get('jwtToken'):
+        message = response.get('message') if isinstance(response, dict) else 'Empty response'
+        logging.error(f"[TOKEN] Refresh rejected for {sdata['clientcode']}: {message}")
+        return False
+
+    tokens = dict(sdata['tokens'])
+    tokens.update({key: data[key] for key in ('jwtToken', 'refreshToken', 'feedToken') if data.get(key)})
+    smartapi_service.update_session_tokens(session_id, tokens)
+    get_broker_client(sdata).set_token(tokens['jwtToken'])
+
+    expiry = get_token_expiry(tokens['jwtToken'])
+    logging.info(f"[TOKEN] Refreshed tokens for {sdata['clientcode']} (expires {expiry:%Y-%m-%d %H:%M} IST)"
+                 if expiry else f"[TOKEN] Refreshed tokens for {sdata['clientcode']}")
+    return True
+
+def check_and_refresh_tokens():
+    """Refresh every live session whose token is close to expiry"""
+    now = get_ist_now()
+    for session_id in list(smartapi_service._SMARTAPI_SESSIONS):
+        sdata = smartapi_service._SMARTAPI_SESSIONS.get(session_id)
+        if not sdata or not needs_refresh(sdata, now):
+            continue
+        last_failure = _LAST_FAILURE.get(session_id)
+        if last_failure and time.monotonic() - last_failure < RETRY_BACKOFF:
+            continue
+        try:
+            if refresh_session_tokens(session_id):
+                _LAST_FAILURE.pop(session_id, None)
+                continue
+        except Exception as e:
+            logging.error(f"[TOKEN] Refresh failed for session {session_id}: {e}")
+        _LAST_FAILURE[session_id] = time.monotonic()
+
+def _refresh_loop():
+    while True:
+        try:
+            check_and_refresh_tokens()
+        except Exception as e:
+            logging.error(f"[TOKEN] Token refresh loop error: {e}")
+        time.sleep(CHECK_INTERVAL)
+
+def start_token_refresher():
+    global _REFRESH_THREAD
+    if _REFRESH_THREAD and _REFRESH_THREAD.is_alive():
+        return
+    _REFRESH_THREAD = threading.Thread(target=_refresh_loop, name='token-refresher', daemon=True)
+    _REFRESH_THREAD.start()
+    logging.info("[TOKEN] Background token refresher started")
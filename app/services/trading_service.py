@@ -1,6 +1,9 @@
 import logging
 from datetime import datetime
 from queue import Queue
+from app.services import candle_resampler
+from app.utils.indicators import session_day
+from app.utils.streaming_indicators import IndicatorSet
 
 # Global state for trading
 ACTIVE_TRADES = {}  # {clientcode: {trade_id: {entry_price, stop_loss, target, quantity, status}}}
@@ -17,6 +20,7 @@ CLOSED_TRADE_EXTREMES = {}  # {clientcode: {symbol: {'high': price, 'low': price
 TRAILING_STOPS = {}  # {clientcode: {trade_id: {'initial_sl': X, 'trailing_sl': Y, 'peak_profit_pct': Z}}}
 POSITION_ENTRY_TIME = {}  # {clientcode: {trade_id: entry_timestamp}}
 TRADE_PATTERN_STATS = {}  # {clientcode: {pattern_type: {wins, losses, pnl}}}
+INDICATOR_STATE = {}  # {symboltoken: IndicatorSet} updated per closed candle, previewed per tick
 
 def get_time_of_day_adjustment():
     """
@@ -224,3 +228,45 @@ def get_best_performing_patterns(clientcode, min_trades=5):
     
     patterns.sort(key=lambda x: x['win_rate'], reverse=True)
     return patterns
+
+def seed_indicators(symboltoken, candles):
+    """Warm up a token's streaming indicators from historical candles"""
+    INDICATOR_STATE[symboltoken] = IndicatorSet().seed(candles)
+    logging.info(f"[INDICATORS] Seeded {symboltoken} from {len(candles)} candles")
+    return INDICATOR_STATE[symboltoken].values()
+
+def on_candle_close(symboltoken, candle, session=None):
+    """
+    Commit a closed [ts, o, h, l, c, v] candle; O(1) regardless of history length
+    The VWAP session defaults to the candle's IST day, labelled the same way as when seeding
+    """
+    state = INDICATOR_STATE.get(symboltoken)
+    if state is None:
+        state = INDICATOR_STATE[symboltoken] = IndicatorSet()
+    ts, _, high, low, close, volume = candle
+    if session is None:
+        session = session_day(ts)
+    return state.update_candle(float(close), float(high), float(low), float(volume or 0), session)
+
+def on_price_tick(symboltoken, ltp):
+    """
+    Record a live price and return indicator values as if the forming candle closed at it,
+    so entry conditions can be checked on every tick rather than every MONITORING_INTERVAL
+    """
+    LIVE_PRICE_CACHE[symboltoken] = {'ltp': ltp, 'timestamp': datetime.now()}
+    state = INDICATOR_STATE.get(symboltoken)
+    return state.preview(ltp) if state else None
+
+def _on_resampled_close(symboltoken, minutes, bar):
+    """1-minute bars closed by the candle resampler advance seeded indicator state"""
+    if minutes == 1 and symboltoken in INDICATOR_STATE:
+        on_candle_close(symboltoken, bar)
+
+def snapshot_indicator_state():
+    return {token: state.snapshot() for token, state in INDICATOR_STATE.items()}
+
+def restore_indicator_state(snapshots):
+    for token, snapshot in snapshots.items():
+        INDICATOR_STATE[token] = IndicatorSet.restore(snapshot)
+
+candle_resampler.add_close_listener(_on_resampled_close)
@@ -0,0 +1,136 @@
+import logging
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from app.services import candle_store, historical_service
+from app.services.rate_limiter import SingleFlight
+from app.utils.helpers import IST, get_ist_now
+
+VOLUME_BUCKET_MINUTES = 5
+VOLUME_BUCKETS = 75  # 09:15-15:30 in 5-minute buckets
+VOLUME_LOOKBACK_DAYS = 20  # Trading days averaged into each bucket's baseline
+VOLUME_MIN_DAYS = 3  # Fewer days than this and there is no usable baseline
+MIN_BUCKET_FRACTION = 0.2  # A bar this young is compared as if this much of it had elapsed
+VOLUME_RETRY_SECONDS = 120  # Rebuild delay after a fetch left lookback days missing (no session, rate limit)
+
+SESSION_OPEN_SECONDS = 9 * 3600 + 15 * 60
+BUCKET_SECONDS = VOLUME_BUCKET_MINUTES * 60
+
+_PROFILES = {}  # {(exchange, token): VolumeProfile}, rebuilt once per trading day
+_NO_PROFILE = {}  # {(exchange, token): (date, retry_at)}; retry_at None = history is complete, wait for tomorrow
+_BUILDS = SingleFlight()  # Concurrent first checks of one token share a single build
+
+class VolumeProfile:
+    """Average volume per time-of-day bucket over the last VOLUME_LOOKBACK_DAYS sessions"""
+
+    def __init__(self, exchange, token, built_for, days, baseline, retry_at=None):
+        self.exchange = exchange
+        self.token = token
+        self.built_for = built_for  # Trading date this profile serves (history ends the day before)
+        self.days = days
+        self.baseline = baseline  # float64 (VOLUME_BUCKETS,)
+        self.cumulative = np.cumsum(baseline)
+        self.retry_at = retry_at  # Monotonic time to rebuild from fuller history, None once complete
+
+    @staticmethod
+    def position(ts):
+        """(bucket index, fraction of the bucket elapsed) for an epoch time, or (None, None) off-session"""
+        offset = (int(ts) + candle_store.IST_OFFSET_SECONDS) % 86400 - SESSION_OPEN_SECONDS
+        if offset < 0 or offset >= VOLUME_BUCKETS * BUCKET_SECONDS:
+            return None, None
+        return offset // BUCKET_SECONDS, (offset % BUCKET_SECONDS) / BUCKET_SECONDS
+
+    def bar_ratio(self, bar_volume, ts):
+        """Volume of the forming 5-minute bar against that bucket's baseline, pro-rated to elapsed time"""
+        bucket, fraction = self.position(ts)
+        if bucket is None:
+            return None
+        expected = self.baseline[bucket] * max(fraction, MIN_BUCKET_FRACTION)
+        return float(bar_volume / expected) if expected > 0 else None
+
+    def day_ratio(self, day_volume, ts):
+        """Cumulative day volume against the baseline cumulative volume up to the same time"""
+        bucket, fraction = self.position(ts)
+        if bucket is None:
+            return None
+        expected = (self.cumulative[bucket - 1] if bucket else 0.0) + self.baseline[bucket] * fraction
+        return float(day_volume / expected) if expected > 0 else None
+
+def _history_complete(exchange, token, start, today):
+    """Whether every weekday of the lookback span is stored as final (holidays included)"""
+    day = start
+    while day < today:
+        if day.weekday() < 5 and candle_store.day_status(exchange, token, 'FIVE_MINUTE', day) != 'complete':
+            return False
+        day += timedelta(days=1)
+    return True
+
+def _build(clientcode, exchange, token, today):
+    """(profile or None, history complete)"""
+    # Calendar span covering VOLUME_LOOKBACK_DAYS sessions plus holidays; only past, finished days
+    start = today - timedelta(days=VOLUME_LOOKBACK_DAYS * 7 // 5 + 7)
+    end = IST.localize(datetime(today.year, today.month, today.day)) - timedelta(seconds=1)
+    candles = historical_service.get_candles(clientcode, exchange, token, 'FIVE_MINUTE', start, end, as_array=True)
+    complete = _history_complete(exchange, token, start, today)
+    retry_at = None if complete else time.monotonic() + VOLUME_RETRY_SECONDS
+
+    local = candles['ts'] + candle_store.IST_OFFSET_SECONDS
+    buckets = (local % 86400 - SESSION_OPEN_SECONDS) // BUCKET_SECONDS
+    in_session = (buckets >= 0) & (buckets < VOLUME_BUCKETS)
+    day_numbers = local // 86400
+    days = np.unique(day_numbers[in_session])[-VOLUME_LOOKBACK_DAYS:]
+    if len(days) < VOLUME_MIN_DAYS:
+        return None, complete
+
+    # Buckets with no candle on a traded day had no trades, so they count as zero volume
+    keep = in_session & np.isin(day_numbers, days)
+    matrix = np.zeros((len(days), VOLUME_BUCKETS))
+    np.add.at(matrix, (np.searchsorted(days, day_numbers[keep]), buckets[keep]),
+              candles['volume'][keep].astype(np.float64))
+    return VolumeProfile(exchange, token, today, len(days), matrix.mean(axis=0), retry_at), complete
+
+def get_volume_profile(clientcode, exchange, token):
+    """
+    Today's profile for a token, built on first use each day from the candle store
+    (history the store lacks is fetched once through historical_service and kept)
+    """
+    key = (exchange, str(token))
+    today = get_ist_now().date()
+    profile = _PROFILES.get(key)
+    if profile is not None and profile.built_for != today:
+        profile = None
+    if profile is not None and (profile.retry_at is None or time.monotonic() < profile.retry_at):
+        return profile
+    missing = _NO_PROFILE.get(key)
+    if profile is None and missing and missing[0] == today and (missing[1] is None or time.monotonic() < missing[1]):
+        return None
+
+    def build():
+        built, complete = _build(clientcode, exchange, key[1], today)
+        if built is None:
+            if profile is not None:
+                # Keep serving the partial profile; try again later
+                profile.retry_at = time.monotonic() + VOLUME_RETRY_SECONDS
+                return profile
+            _PROFILES.pop(key, None)
+            _NO_PROFILE[key] = (today, None if complete else time.monotonic() + VOLUME_RETRY_SECONDS)
+            return None
+        _NO_PROFILE.pop(key, None)
+        _PROFILES[key] = built
+        note = '' if complete else ' (history incomplete, will retry)'
+        logging.info(f"[VOLUME] Built {exchange}:{token} profile from {built.days} sessions{note}")
+        return built
+
+    try:
+        return _BUILDS.do((key, today), build)
+    except Exception as e:
+        logging.error(f"[VOLUME] Profile build failed for {exchange}:{token}: {e}")
+        if profile is not None:
+            profile.retry_at = time.monotonic() + VOLUME_RETRY_SECONDS
+        else:
+            _NO_PROFILE[key] = (today, time.monotonic() + VOLUME_RETRY_SECONDS)
+        return profile
+
+def warm_profiles(clientcode, exchange, tokens):
+    """Build profiles ahead of time (e.g. for the day's watchlist before the open)"""
+    return {token: get_volume_profile(clientcode, exchange, token) is not None for token in tokens}
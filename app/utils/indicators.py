@@ -0,0 +1,285 @@
+from datetime import date, datetime
+import numpy as np
+
+IST_OFFSET_SECONDS = 19800  # IST has no DST, so a trading day is a fixed offset from UTC
+_EPOCH = date(1970, 1, 1)
+
+# Technical indicators over whole NumPy series
+# Every function takes float arrays whose last axis is time (1-D for one symbol, 2-D for a batch
+# of equal-length series) and returns arrays of the same shape, NaN until the indicator is seeded
+
+# Largest growth factor allowed inside one closed-form EMA chunk before the running sum is rescaled
+_EMA_CHUNK_GROWTH = 1e100
+
+def as_ohlcv(candles):
+    """
+    Candle input -> dict of float arrays (ts, open, high, low, close, volume)
+    Accepts candle_store arrays or broker-style [[ts, o, h, l, c, v], ...] lists
+    """
+    if isinstance(candles, np.ndarray) and candles.dtype.names:
+        return {name: np.asarray(candles[name], dtype=np.float64) for name in candles.dtype.names}
+    rows = list(candles)
+    columns = list(zip(*rows)) if rows else [()] * 6
+    result = {'ts': np.asarray(columns[0], dtype=object)}
+    for name, column in zip(('open', 'high', 'low', 'close', 'volume'), columns[1:]):
+        result[name] = np.asarray(column, dtype=np.float64)
+    return result
+
+def _ewm(values, alpha, seed):
+    """
+    y[t] = alpha * x[t] + (1 - alpha) * y[t-1], with y[-1] = seed, along the last axis
+    Chunks use the closed form y[t] = w^(t+1) * (seed + alpha * sum_k x[k] * w^-(k+1)), w = 1 - alpha,
+    so the recursion runs as cumsums instead of a Python loop
+    """
+    values = np.asarray(values, dtype=np.float64)
+    out = np.empty_like(values)
+    n = values.shape[-1]
+    if n == 0:
+        return out
+    w = 1.0 - alpha
+    if w <= 0:
+        out[...] = values
+        return out
+    chunk = max(1, int(np.log(_EMA_CHUNK_GROWTH) / -np.log(w))) if w < 1 else n
+    previous = np.asarray(seed, dtype=np.float64)
+    for start in range(0, n, chunk):
+        block = values[..., start:start + chunk]
+        m = block.shape[-1]
+        growth = w ** -np.arange(1, m + 1)
+        decay = w ** np.arange(1, m + 1)
+        running = np.cumsum(block * growth, axis=-1)
+        result = decay * (previous[..., None] + alpha * running)
+        out[..., start:start + chunk] = result
+        previous = result[..., -1]
+    return out
+
+def sma(values, period):
+    values = np.asarray(values, dtype=np.float64)
+    out = np.full_like(values, np.nan)
+    n = values.shape[-1]
+    if n < period:
+        return out
+    # Shift by the first value so the cumsum stays small relative to prices
+    base = values[..., :1]
+    csum = np.cumsum(values - base, axis=-1)
+    csum = np.concatenate([np.zeros_like(base), csum], axis=-1)
+    out[..., period - 1:] = (csum[..., period:] - csum[..., :-period]) / period + base
+    return out
+
+def ema(values, period, alpha=None):
+    """EMA seeded with the SMA of the first `period` values (NaN before that)"""
+    values = np.asarray(values, dtype=np.float64)
+    alpha = 2.0 / (period + 1) if alpha is None else alpha
+    out = np.full_like(values, np.nan)
+    n = values.shape[-1]
+    if n < period:
+        return out
+    seed = values[..., :period].mean(axis=-1)
+    out[..., period - 1] = seed
+    out[..., period:] = _ewm(values[..., period:], alpha, seed)
+    return out
+
+def wilder(values, period):
+    """Wilder's smoothing (alpha = 1/period), seeded with the SMA of the first `period` values"""
+    return ema(values, period, alpha=1.0 / period)
+
+def rsi(close, period=14):
+    close = np.asarray(close, dtype=np.float64)
+    out = np.full_like(close, np.nan)
+    if close.shape[-1] <= period:
+        return out
+    change = np.diff(close, axis=-1)
+    avg_gain = wilder(np.maximum(change, 0.0), period)
+    avg_loss = wilder(np.maximum(-change, 0.0), period)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rs = avg_gain / avg_loss
+        value = 100.0 - 100.0 / (1.0 + rs)
+    # No losses in the window means RSI 100 (or 50 when price didn't move at all)
+    value = np.where(avg_loss == 0, np.where(avg_gain == 0, 50.0, 100.0), value)
+    value = np.where(np.isnan(avg_gain), np.nan, value)
+    out[..., 1:] = value
+    return out
+
+def macd(close, fast=12, slow=26, signal=9):
+    """(macd line, signal line, histogram)"""
+    close = np.asarray(close, dtype=np.float64)
+    line = ema(close, fast) - ema(close, slow)
+    signal_line = np.full_like(line, np.nan)
+    start = slow - 1
+    if close.shape[-1] > start:
+        signal_line[..., start:] = ema(line[..., start:], signal)
+    return line, signal_line, line - signal_line
+
+def rolling_std(values, period):
+    """Population standard deviation over a trailing window"""
+    values = np.asarray(values, dtype=np.float64)
+    out = np.full_like(values, np.nan)
+    if values.shape[-1] < period:
+        return out
+    windows = np.lib.stride_tricks.sliding_window_view(values, period, axis=-1)
+    out[..., period - 1:] = windows.std(axis=-1)
+    return out
+
+def bollinger(close, period=20, num_std=2.0):
+    """(middle, upper, lower)"""
+    middle = sma(close, period)
+    width = num_std * rolling_std(close, period)
+    return middle, middle + width, middle - width
+
+def true_range(high, low, close):
+    high = np.asarray(high, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+    close = np.asarray(close, dtype=np.float64)
+    previous = np.concatenate([close[..., :1], close[..., :-1]], axis=-1)
+    return np.maximum(high - low, np.maximum(np.abs(high - previous), np.abs(low - previous)))
+
+def atr(high, low, close, period=14):
+    return wilder(true_range(high, low, close), period)
+
+def vwap(high, low, close, volume, sessions=None):
+    """
+    Cumulative VWAP of the typical price, restarting whenever `sessions` (e.g. the IST date of
+    each candle) changes; one running VWAP over the whole series when sessions is None
+    """
+    typical = (np.asarray(high, dtype=np.float64) + np.asarray(low, dtype=np.float64)
+               + np.asarray(close, dtype=np.float64)) / 3.0
+    volume = np.asarray(volume, dtype=np.float64)
+    pv = np.cumsum(typical * volume, axis=-1)
+    vol = np.cumsum(volume, axis=-1)
+    if sessions is not None:
+        sessions = np.asarray(sessions)
+        starts = np.flatnonzero(np.concatenate([[True], sessions[1:] != sessions[:-1]]))
+        lengths = np.diff(np.append(starts, len(sessions)))
+
+        def carried(cumulative):
+            # Running total at the end of the previous session, repeated across each session
+            before = np.zeros(cumulative.shape[:-1] + (1,))
+            totals = np.concatenate([before, cumulative[..., starts[1:] - 1]], axis=-1)
+            return np.repeat(totals, lengths, axis=-1)
+
+        pv = pv - carried(pv)
+        vol = vol - carried(vol)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(vol > 0, pv / vol, np.nan)
+
+def supertrend(high, low, close, period=10, multiplier=3.0, atr_values=None):
+    """
+    (supertrend line, direction) for one series; direction is +1 in an uptrend, -1 in a downtrend
+    The band carry-over depends on the previous output, so this one runs as a single scalar loop
+    """
+    high = np.asarray(high, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+    close = np.asarray(close, dtype=np.float64)
+    n = len(close)
+    line = np.full(n, np.nan)
+    direction = np.zeros(n)
+    if atr_values is None:
+        atr_values = atr(high, low, close, period)
+    mid = (high + low) / 2.0
+    basic_upper = (mid + multiplier * atr_values).tolist()
+    basic_lower = (mid - multiplier * atr_values).tolist()
+    closes = close.tolist()
+
+    first = period - 1
+    if n <= first:
+        return line, direction
+    upper, lower = basic_upper[first], basic_lower[first]
+    trend = 1 if closes[first] >= lower else -1
+    line[first] = lower if trend == 1 else upper
+    direction[first] = trend
+    for i in range(first + 1, n):
+        previous_close = closes[i - 1]
+        upper = basic_upper[i] if basic_upper[i] < upper or previous_close > upper else upper
+        lower = basic_lower[i] if basic_lower[i] > lower or previous_close < lower else lower
+        if trend == 1 and closes[i] < lower:
+            trend = -1
+        elif trend == -1 and closes[i] > upper:
+            trend = 1
+        line[i] = lower if trend == 1 else upper
+        direction[i] = trend
+    return line, direction
+
+INDICATORS = ('ema9', 'ema21', 'sma20', 'rsi14', 'macd', 'bollinger', 'atr14', 'vwap', 'supertrend')
+
+def session_day(ts):
+    """IST day number of one epoch-second, ISO-string or datetime timestamp"""
+    if isinstance(ts, str):
+        ts = datetime.fromisoformat(ts)
+    if isinstance(ts, datetime):
+        if ts.tzinfo is None:
+            return (ts.date() - _EPOCH).days  # Naive broker times are IST wall clock
+        ts = ts.timestamp()
+    return (int(ts) + IST_OFFSET_SECONDS) // 86400
+
+def session_days(ts):
+    """
+    Trading-day label per candle (IST day number) for epoch-second or ISO-string timestamps
+    Same labels as session_day, so batch-seeded and live-streamed VWAP agree on sessions
+    """
+    ts = np.asarray(ts)
+    if ts.dtype.kind in 'iuf':
+        return (ts.astype(np.int64) + IST_OFFSET_SECONDS) // 86400
+    return np.array([session_day(value) for value in ts], dtype=np.int64)
+
+def compute_indicators(candles, which=INDICATORS, sessions=None):
+    """
+    All requested indicators for one candle series in a single pass over its arrays
+    VWAP restarts each trading day unless explicit `sessions` labels are given
+    """
+    data = as_ohlcv(candles)
+    if sessions is None and 'vwap' in which and len(data['ts']):
+        sessions = session_days(data['ts'])
+    return _compute(data, which, sessions)
+
+def _compute(data, which, sessions):
+    close = data['close']
+    result = {}
+    if 'ema9' in which:
+        result['ema9'] = ema(close, 9)
+    if 'ema21' in which:
+        result['ema21'] = ema(close, 21)
+    if 'sma20' in which:
+        result['sma20'] = sma(close, 20)
+    if 'rsi14' in which:
+        result['rsi14'] = rsi(close, 14)
+    if 'macd' in which:
+        result['macd'], result['macd_signal'], result['macd_hist'] = macd(close)
+    if 'bollinger' in which:
+        result['bb_middle'], result['bb_upper'], result['bb_lower'] = bollinger(close)
+    if 'atr14' in which:
+        result['atr14'] = atr(data['high'], data['low'], close, 14)
+    if 'vwap' in which:
+        result['vwap'] = vwap(data['high'], data['low'], close, data['volume'], sessions)
+    if 'supertrend' in which:
+        if close.ndim == 1:
+            result['supertrend'], result['supertrend_dir'] = supertrend(data['high'], data['low'], close)
+        else:
+            # ATR for the whole batch is vectorized; only the band carry-over loops per series
+            atr10 = atr(data['high'], data['low'], close, 10)
+            pairs = [supertrend(h, l, c, atr_values=a) for h, l, c, a in zip(data['high'], data['low'], close, atr10)]
+            result['supertrend'] = np.array([line for line, _ in pairs])
+            result['supertrend_dir'] = np.array([direction for _, direction in pairs])
+    return result
+
+def compute_batch(series, which=INDICATORS):
+    """
+    Indicators for many symbols at once: {key: candles} -> {key: {indicator: array}}
+    Series of equal length are stacked into 2-D arrays so each indicator runs once per group
+    (VWAP here is a running VWAP; pass single series to compute_indicators for session resets)
+    """
+    by_length = {}
+    for key, candles in series.items():
+        data = as_ohlcv(candles)
+        by_length.setdefault(len(data['close']), []).append((key, data))
+
+    results = {}
+    for group in by_length.values():
+        keys = [key for key, _ in group]
+        stacked = {
+            name: np.vstack([data[name] for _, data in group])
+            for name in ('open', 'high', 'low', 'close', 'volume')
+        }
+        computed = _compute(stacked, which, None)
+        for row, key in enumerate(keys):
+            results[key] = {name: values[row] for name, values in computed.items()}
+    return results
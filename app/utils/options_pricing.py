@@ -0,0 +1,160 @@
+from datetime import datetime, date
+import numpy as np
+from app.utils.helpers import IST, get_ist_now
+
+# Black-Scholes pricing, implied volatility and Greeks over NumPy arrays
+# Inputs broadcast against each other, so one call covers every contract of a chain
+
+RISK_FREE_RATE = 0.065  # Annualised, continuously compounded
+EXPIRY_CLOSE = (15, 30)  # NSE options expire at the close, IST
+YEAR_SECONDS = 365.0 * 86400
+MIN_TIME_TO_EXPIRY = 60.0 / YEAR_SECONDS  # Floor of one minute so expiry-day maths stays finite
+
+IV_LOW = 1e-4
+IV_HIGH = 5.0
+IV_TOLERANCE = 1e-6  # Price error (in premium units) accepted as converged
+IV_MAX_ITERATIONS = 50
+
+_SQRT_2PI = np.sqrt(2.0 * np.pi)
+
+def norm_pdf(x):
+    return np.exp(-0.5 * np.square(x)) / _SQRT_2PI
+
+def norm_cdf(x):
+    """
+    Standard normal CDF to double precision (Hart's rational approximation as given by West, 2005)
+    without needing scipy; the tail form takes over past |x| = 7.07
+    """
+    x = np.asarray(x, dtype=np.float64)
+    z = np.abs(x)
+    exponential = np.exp(-0.5 * z * z)
+
+    numerator = 3.52624965998911e-02 * z + 0.700383064443688
+    for c in (6.37396220353165, 33.912866078383, 112.079291497871, 221.213596169931, 220.206867912376):
+        numerator = numerator * z + c
+    denominator = 8.83883476483184e-02 * z + 1.75566716318264
+    for c in (16.064177579207, 86.7807322029461, 296.564248779674, 637.333633378831,
+              793.826512519948, 440.413735824752):
+        denominator = denominator * z + c
+    central = exponential * numerator / denominator
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction = z + 0.65
+        for c in (4.0, 3.0, 2.0, 1.0):
+            fraction = z + c / fraction
+        tail = exponential / fraction / 2.506628274631
+
+    lower = np.where(z < 7.07106781186547, central, tail)
+    lower = np.where(z > 37.0, 0.0, lower)
+    return np.where(x > 0, 1.0 - lower, lower)
+
+def time_to_expiry(expiry, now=None):
+    """Years from now until 15:30 IST on the expiry date (ISO string, date or datetime)"""
+    now = now or get_ist_now()
+    if isinstance(expiry, str):
+        expiry = date.fromisoformat(expiry[:10])
+    if not isinstance(expiry, datetime):
+        expiry = IST.localize(datetime(expiry.year, expiry.month, expiry.day, *EXPIRY_CLOSE))
+    elif expiry.tzinfo is None:
+        expiry = IST.localize(expiry)
+    return max((expiry - now).total_seconds() / YEAR_SECONDS, MIN_TIME_TO_EXPIRY)
+
+def _d1_d2(spot, strike, t, vol, rate):
+    sqrt_t = np.sqrt(t)
+    vol_sqrt_t = vol * sqrt_t
+    d1 = (np.log(spot / strike) + (rate + 0.5 * vol * vol) * t) / vol_sqrt_t
+    return d1, d1 - vol_sqrt_t, sqrt_t
+
+def bs_price(spot, strike, t, vol, is_call, rate=RISK_FREE_RATE):
+    spot, strike, t, vol = (np.asarray(a, dtype=np.float64) for a in (spot, strike, t, vol))
+    d1, d2, _ = _d1_d2(spot, strike, t, vol, rate)
+    discount = strike * np.exp(-rate * t)
+    call = spot * norm_cdf(d1) - discount * norm_cdf(d2)
+    put = discount * norm_cdf(-d2) - spot * norm_cdf(-d1)
+    return np.where(is_call, call, put)
+
+def greeks(spot, strike, t, vol, is_call, rate=RISK_FREE_RATE):
+    """
+    {'delta', 'gamma', 'theta', 'vega'}; theta is premium lost per calendar day and vega is the
+    premium change for one volatility point (0.01)
+    """
+    spot, strike, t, vol = (np.asarray(a, dtype=np.float64) for a in (spot, strike, t, vol))
+    d1, d2, sqrt_t = _d1_d2(spot, strike, t, vol, rate)
+    pdf = norm_pdf(d1)
+    discount = strike * np.exp(-rate * t)
+    call_delta = norm_cdf(d1)
+    decay = -spot * pdf * vol / (2.0 * sqrt_t)
+    call_theta = decay - rate * discount * norm_cdf(d2)
+    put_theta = decay + rate * discount * norm_cdf(-d2)
+    return {
+        'delta': np.where(is_call, call_delta, call_delta - 1.0),
+        'gamma': pdf / (spot * vol * sqrt_t),
+        'theta': np.where(is_call, call_theta, put_theta) / 365.0,
+        'vega': spot * pdf * sqrt_t / 100.0,
+    }
+
+def implied_volatility(price, spot, strike, t, is_call, rate=RISK_FREE_RATE,
+                       tol=IV_TOLERANCE, max_iterations=IV_MAX_ITERATIONS):
+    """
+    Implied volatility for every element at once: Newton steps, falling back to bisection of the
+    [IV_LOW, IV_HIGH] bracket whenever a step leaves it or vega is too small to trust
+    NaN where the premium is outside the no-arbitrage bounds or missing
+    """
+    price, spot, strike, t = np.broadcast_arrays(*(np.asarray(a, dtype=np.float64) for a in (price, spot, strike, t)))
+    is_call = np.broadcast_to(is_call, price.shape)
+    discount = strike * np.exp(-rate * t)
+    intrinsic = np.where(is_call, np.maximum(spot - discount, 0.0), np.maximum(discount - spot, 0.0))
+    upper = np.where(is_call, spot, discount)
+    valid = np.isfinite(price) & (price > intrinsic) & (price < upper) & (spot > 0) & (strike > 0)
+
+    low = np.full(price.shape, IV_LOW)
+    high = np.full(price.shape, IV_HIGH)
+    # Start at the inflection point of price in vol (Manaster-Koehler): Newton converges
+    # monotonically from there, on either side of it
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vol = np.clip(np.sqrt(2.0 * np.abs(np.log(spot / strike) + rate * t) / t), 0.05, IV_HIGH / 2)
+    vol = np.where(valid, vol, np.nan)
+    active = valid.copy()
+
+    for _ in range(max_iterations):
+        if not active.any():
+            break
+        idx = np.flatnonzero(active)
+        s, k, tt, call, v = spot.flat[idx], strike.flat[idx], t.flat[idx], is_call.flat[idx], vol.flat[idx]
+        d1, d2, sqrt_t = _d1_d2(s, k, tt, v, rate)
+        discount_k = k * np.exp(-rate * tt)
+        sign = np.where(call, 1.0, -1.0)
+        model = sign * (s * norm_cdf(sign * d1) - discount_k * norm_cdf(sign * d2))
+        diff = model - price.flat[idx]
+        done = np.abs(diff) < tol
+
+        # Price rises with volatility, so the sign of the error tightens the bracket
+        lo = np.where(diff < 0, v, low.flat[idx])
+        hi = np.where(diff > 0, v, high.flat[idx])
+        vega = s * norm_pdf(d1) * sqrt_t
+        with np.errstate(divide='ignore', invalid='ignore'):
+            step = v - diff / vega
+        bisect = ~np.isfinite(step) | (step <= lo) | (step >= hi) | (vega < 1e-8)
+        new = np.where(bisect, 0.5 * (lo + hi), step)
+
+        low.flat[idx] = lo
+        high.flat[idx] = hi
+        vol.flat[idx] = np.where(done, v, new)
+        active.flat[idx] = ~done & (hi - lo > 1e-10)
+
+    return vol
+
+def chain_greeks(spot, strikes, premiums, t, rate=RISK_FREE_RATE):
+    """
+    IV and Greeks for a whole chain laid out as (2, n) arrays (row 0 calls, row 1 puts)
+    Returns {'iv', 'delta', 'gamma', 'theta', 'vega'}, each (2, n), NaN where IV can't be solved
+    """
+    premiums = np.asarray(premiums, dtype=np.float64)
+    strikes = np.broadcast_to(np.asarray(strikes, dtype=np.float64), premiums.shape)
+    is_call = np.zeros(premiums.shape, dtype=bool)
+    is_call[0] = True
+    iv = implied_volatility(premiums, spot, strikes, t, is_call, rate)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = greeks(spot, strikes, t, iv, is_call, rate)
+    result['iv'] = iv
+    return result
@@ -0,0 +1,337 @@
+import math
+from app.utils import indicators
+
+# Incremental counterparts of app.utils.indicators: constant time per update, matching the batch
+# values exactly once seeded. update() commits a closed candle/tick; peek() evaluates a tentative
+# value (e.g. the forming candle's last price) without changing state
+
+class _Streaming:
+    __slots__ = ()
+
+    def snapshot(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def restore(cls, state):
+        obj = cls.__new__(cls)
+        for name in cls.__slots__:
+            setattr(obj, name, state[name])
+        return obj
+
+class StreamingEMA(_Streaming):
+    """EMA seeded with the SMA of the first `period` values, like indicators.ema"""
+    __slots__ = ('period', 'alpha', 'count', 'total', 'value')
+
+    def __init__(self, period, alpha=None):
+        self.period = period
+        self.alpha = 2.0 / (period + 1) if alpha is None else alpha
+        self.count = 0
+        self.total = 0.0
+        self.value = None
+
+    def seed(self, values):
+        values = [float(v) for v in values]
+        self.count = len(values)
+        if self.count >= self.period:
+            self.value = float(indicators.ema(values, self.period, self.alpha)[-1])
+        else:
+            self.total = sum(values)
+        return self
+
+    def peek(self, x):
+        if self.value is not None:
+            return self.value + self.alpha * (x - self.value)
+        if self.count + 1 == self.period:
+            return (self.total + x) / self.period
+        return None
+
+    def update(self, x):
+        self.value = self.peek(x)
+        self.count += 1
+        if self.value is None:
+            self.total += x
+        return self.value
+
+class StreamingRSI(_Streaming):
+    """Wilder RSI; the first value appears after `period` price changes"""
+    __slots__ = ('period', 'previous', 'avg_gain', 'avg_loss', 'changes', 'gain_total', 'loss_total', 'value')
+
+    def __init__(self, period=14):
+        self.period = period
+        self.previous = None
+        self.avg_gain = None
+        self.avg_loss = None
+        self.changes = 0
+        self.gain_total = 0.0
+        self.loss_total = 0.0
+        self.value = None
+
+    def seed(self, closes):
+        for close in closes:
+            self.update(float(close))
+        return self
+
+    @staticmethod
+    def _rsi(avg_gain, avg_loss):
+        if avg_loss == 0:
+            return 50.0 if avg_gain == 0 else 100.0
+        return 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+
+    def _step(self, close):
+        if self.previous is None:
+            return None, None, None
+        change = close - self.previous
+        gain, loss = max(change, 0.0), max(-change, 0.0)
+        if self.avg_gain is not None:
+            avg_gain = self.avg_gain + (gain - self.avg_gain) / self.period
+            avg_loss = self.avg_loss + (loss - self.avg_loss) / self.period
+        elif self.changes + 1 == self.period:
+            avg_gain = (self.gain_total + gain) / self.period
+            avg_loss = (self.loss_total + loss) / self.period
+        else:
+            return gain, loss, None
+        return avg_gain, avg_loss, self._rsi(avg_gain, avg_loss)
+
+    def peek(self, close):
+        return self._step(close)[2]
+
+    def update(self, close):
+        first, second, value = self._step(close)
+        if self.previous is not None:
+            if value is None:
+                self.gain_total += first
+                self.loss_total += second
+            else:
+                self.avg_gain, self.avg_loss = first, second
+            self.changes += 1
+        self.previous = close
+        self.value = value
+        return value
+
+class StreamingMACD(_Streaming):
+    """(macd, signal, histogram); the signal EMA starts once the slow EMA is seeded"""
+    __slots__ = ('fast', 'slow', 'signal')
+
+    def __init__(self, fast=12, slow=26, signal=9):
+        self.fast = StreamingEMA(fast)
+        self.slow = StreamingEMA(slow)
+        self.signal = StreamingEMA(signal)
+
+    def seed(self, closes):
+        for close in closes:
+            self.update(float(close))
+        return self
+
+    def peek(self, close):
+        fast, slow = self.fast.peek(close), self.slow.peek(close)
+        if fast is None or slow is None:
+            return None, None, None
+        line = fast - slow
+        signal = self.signal.peek(line)
+        return line, signal, (line - signal) if signal is not None else None
+
+    def update(self, close):
+        fast, slow = self.fast.update(close), self.slow.update(close)
+        if fast is None or slow is None:
+            return None, None, None
+        line = fast - slow
+        signal = self.signal.update(line)
+        return line, signal, (line - signal) if signal is not None else None
+
+    def snapshot(self):
+        return {name: getattr(self, name).snapshot() for name in self.__slots__}
+
+    @classmethod
+    def restore(cls, state):
+        obj = cls.__new__(cls)
+        for name in cls.__slots__:
+            setattr(obj, name, StreamingEMA.restore(state[name]))
+        return obj
+
+class RollingStd(_Streaming):
+    """Population std over the last `period` values from running sums in a fixed ring buffer"""
+    __slots__ = ('period', 'buffer', 'index', 'count', 'anchor', 'total', 'total_sq', 'updates')
+
+    RESYNC_EVERY = 10000  # Recompute the sums from the buffer now and then to shed float drift
+
+    def __init__(self, period=20):
+        self.period = period
+        self.buffer = [0.0] * period
+        self.index = 0
+        self.count = 0
+        self.anchor = None  # Values are stored relative to the first one to limit cancellation
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.updates = 0
+
+    def seed(self, values):
+        for value in list(values)[-self.period:]:
+            self.update(float(value))
+        return self
+
+    def update(self, x):
+        if self.anchor is None:
+            self.anchor = x
+        x -= self.anchor
+        if self.count == self.period:
+            old = self.buffer[self.index]
+            self.total -= old
+            self.total_sq -= old * old
+        else:
+            self.count += 1
+        self.buffer[self.index] = x
+        self.index = (self.index + 1) % self.period
+        self.total += x
+        self.total_sq += x * x
+        self.updates += 1
+        if self.updates % self.RESYNC_EVERY == 0:
+            window = self.buffer[:self.count]
+            self.total = math.fsum(window)
+            self.total_sq = math.fsum(v * v for v in window)
+        return self.value
+
+    @property
+    def mean(self):
+        return self.total / self.count + self.anchor if self.count else None
+
+    @property
+    def value(self):
+        if self.count < self.period:
+            return None
+        mean = self.total / self.count
+        return math.sqrt(max(self.total_sq / self.count - mean * mean, 0.0))
+
+    def snapshot(self):
+        state = super().snapshot()
+        state['buffer'] = list(self.buffer)
+        return state
+
+    @classmethod
+    def restore(cls, state):
+        obj = super().restore(state)
+        obj.buffer = list(obj.buffer)
+        return obj
+
+class StreamingVWAP(_Streaming):
+    """Session VWAP; resets when the session label (e.g. IST date) changes"""
+    __slots__ = ('session', 'pv', 'volume', 'last_cumulative')
+
+    def __init__(self):
+        self.session = None
+        self.pv = 0.0
+        self.volume = 0.0
+        self.last_cumulative = None
+
+    def _roll(self, session):
+        if session is not None and session != self.session:
+            self.session = session
+            self.pv = 0.0
+            self.volume = 0.0
+            self.last_cumulative = None
+
+    def update(self, price, volume, session=None):
+        self._roll(session)
+        if volume > 0:
+            self.pv += price * volume
+            self.volume += volume
+        return self.value
+
+    def update_cumulative(self, price, cumulative_volume, session=None):
+        """Tick feeds report day volume so far; only the increase since the last tick is traded here"""
+        self._roll(session)
+        if self.last_cumulative is not None and cumulative_volume > self.last_cumulative:
+            self.update(price, cumulative_volume - self.last_cumulative)
+        self.last_cumulative = cumulative_volume
+        return self.value
+
+    @property
+    def value(self):
+        return self.pv / self.volume if self.volume else None
+
+class IndicatorSet(_Streaming):
+    """Per-token bundle: committed on closed candles, previewed on every tick"""
+    __slots__ = ('ema9', 'ema21', 'rsi14', 'macd', 'std20', 'vwap', 'last_close')
+
+    def __init__(self):
+        self.ema9 = StreamingEMA(9)
+        self.ema21 = StreamingEMA(21)
+        self.rsi14 = StreamingRSI(14)
+        self.macd = StreamingMACD()
+        self.std20 = RollingStd(20)
+        self.vwap = StreamingVWAP()
+        self.last_close = None
+
+    def seed(self, candles):
+        """Warm up from historical candles (candle_store array or broker lists)"""
+        data = indicators.as_ohlcv(candles)
+        closes = data['close'].tolist()
+        self.ema9.seed(closes)
+        self.ema21.seed(closes)
+        self.rsi14.seed(closes)
+        self.macd.seed(closes)
+        self.std20.seed(closes)
+        if closes:
+            sessions = indicators.session_days(data['ts']).tolist()
+            typical = ((data['high'] + data['low'] + data['close']) / 3.0).tolist()
+            for price, volume, session in zip(typical, data['volume'].tolist(), sessions):
+                self.vwap.update(price, volume, session)
+            self.last_close = closes[-1]
+        return self
+
+    def update_candle(self, close, high=None, low=None, volume=0.0, session=None):
+        typical = (high + low + close) / 3.0 if high is not None and low is not None else close
+        self.ema9.update(close)
+        self.ema21.update(close)
+        self.rsi14.update(close)
+        self.macd.update(close)
+        self.std20.update(close)
+        self.vwap.update(typical, volume, session)
+        self.last_close = close
+        return self.values()
+
+    def values(self):
+        fast, slow, signal = self.macd.fast.value, self.macd.slow.value, self.macd.signal.value
+        line = fast - slow if fast is not None and slow is not None else None
+        hist = line - signal if line is not None and signal is not None else None
+        return {
+            'close': self.last_close,
+            'ema9': self.ema9.value,
+            'ema21': self.ema21.value,
+            'rsi14': self.rsi14.value,
+            'macd': line,
+            'macd_signal': signal,
+            'macd_hist': hist,
+            'std20': self.std20.value,
+            'vwap': self.vwap.value,
+        }
+
+    def preview(self, price):
+        """Indicator values if the forming candle closed at `price` now"""
+        line, signal, hist = self.macd.peek(price)
+        return {
+            'close': price,
+            'ema9': self.ema9.peek(price),
+            'ema21': self.ema21.peek(price),
+            'rsi14': self.rsi14.peek(price),
+            'macd': line,
+            'macd_signal': signal,
+            'macd_hist': hist,
+            'vwap': self.vwap.value,
+        }
+
+    def snapshot(self):
+        state = {name: getattr(self, name).snapshot() for name in self.__slots__ if name != 'last_close'}
+        state['last_close'] = self.last_close
+        return state
+
+    @classmethod
+    def restore(cls, state):
+        obj = cls.__new__(cls)
+        obj.ema9 = StreamingEMA.restore(state['ema9'])
+        obj.ema21 = StreamingEMA.restore(state['ema21'])
+        obj.rsi14 = StreamingRSI.restore(state['rsi14'])
+        obj.macd = StreamingMACD.restore(state['macd'])
+        obj.std20 = RollingStd.restore(state['std20'])
+        obj.vwap = StreamingVWAP.restore(state['vwap'])
+        obj.last_close = state['last_close']
+        return obj
@@ -0,0 +1,104 @@
+import time
+import numpy as np
+
+class TimeWindowBuffer:
+    """
+    Fixed-capacity ring buffer of (timestamp, value) samples that only keeps the last `window` seconds
+    Storage is preallocated; every sample is written twice (at i and i + capacity) so the live
+    window is always one contiguous slice and the statistics below run on views, never copies
+    Timestamps default to time.monotonic() and never go backwards
+    """
+
+    def __init__(self, window, capacity=1024):
+        self.window = float(window)
+        self.capacity = capacity
+        self._ts = np.zeros(2 * capacity)
+        self._values = np.zeros(2 * capacity)
+        self._start = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, value, ts=None):
+        ts = time.monotonic() if ts is None else float(ts)
+        if self._count:
+            ts = max(ts, self._ts[self._start + self._count - 1])
+        if self._count == self.capacity:
+            # Full: the oldest sample makes room even if it is still inside the window
+            self._start = (self._start + 1) % self.capacity
+            self._count -= 1
+        i = (self._start + self._count) % self.capacity
+        self._ts[i] = self._ts[i + self.capacity] = ts
+        self._values[i] = self._values[i + self.capacity] = value
+        self._count += 1
+        self.expire(ts)
+
+    def expire(self, now=None):
+        """Drop samples older than the window; amortised O(1) per appended sample"""
+        now = time.monotonic() if now is None else float(now)
+        cutoff = now - self.window
+        while self._count and self._ts[self._start] <= cutoff:
+            self._start = (self._start + 1) % self.capacity
+            self._count -= 1
+
+    def clear(self):
+        self._start = 0
+        self._count = 0
+
+    def arrays(self, seconds=None):
+        """(timestamps, values) views for the whole window or its trailing `seconds`"""
+        end = self._start + self._count
+        ts = self._ts[self._start:end]
+        values = self._values[self._start:end]
+        if seconds is not None and self._count:
+            first = int(np.searchsorted(ts, ts[-1] - seconds, side='left'))
+            ts, values = ts[first:], values[first:]
+        return ts, values
+
+    @property
+    def last(self):
+        return float(self._values[self._start + self._count - 1]) if self._count else None
+
+    @property
+    def first(self):
+        return float(self._values[self._start]) if self._count else None
+
+    def change_pct(self, seconds=None):
+        """Percent change from the oldest to the newest sample"""
+        _, values = self.arrays(seconds)
+        if len(values) < 2 or values[0] == 0:
+            return None
+        return float((values[-1] - values[0]) / values[0] * 100.0)
+
+    def slope(self, seconds=None):
+        """Least-squares slope in value units per second"""
+        ts, values = self.arrays(seconds)
+        if len(values) < 2:
+            return None
+        t = ts - ts.mean()
+        spread = np.dot(t, t)
+        if spread == 0:
+            return None
+        return float(np.dot(t, values - values.mean()) / spread)
+
+    def zscore(self, seconds=None):
+        """How far the newest sample sits from the window mean, in standard deviations"""
+        _, values = self.arrays(seconds)
+        if len(values) < 2:
+            return None
+        std = values.std()
+        return float((values[-1] - values.mean()) / std) if std > 0 else 0.0
+
+    def momentum(self, seconds=None):
+        """Slope (as % of the mean per minute), z-score and % change over the window"""
+        ts, values = self.arrays(seconds)
+        slope = self.slope(seconds)
+        mean = float(values.mean()) if len(values) else None
+        return {
+            'points': len(values),
+            'span_seconds': float(ts[-1] - ts[0]) if len(ts) else 0.0,
+            'slope_pct_per_min': slope * 60.0 / mean * 100.0 if slope is not None and mean else None,
+            'zscore': self.zscore(seconds),
+            'change_pct': self.change_pct(seconds),
+        }
@@ -0,0 +1,99 @@
+"""Benchmark the NumPy indicator module against list-based Python loops"""
+import time
+import numpy as np
+from app.utils import indicators
+
+SYMBOLS = 200
+CANDLES = 375  # One trading day of 1-minute candles
+LONG_SERIES = 100_000
+
+def list_trend_direction(closes):
+    # The old check_trend_direction math: "EMAs" as plain averages of the last 9/21 closes
+    closes = closes[-21:]
+    ema9_val = sum(closes[-9:]) / 9
+    ema21_val = sum(closes) / 21
+    return ema9_val > ema21_val * 1.002
+
+def list_ema(values, period):
+    alpha = 2 / (period + 1)
+    out = [None] * len(values)
+    value = sum(values[:period]) / period
+    out[period - 1] = value
+    for i in range(period, len(values)):
+        value = alpha * values[i] + (1 - alpha) * value
+        out[i] = value
+    return out
+
+def list_rsi(closes, period=14):
+    gains = [max(b - a, 0) for a, b in zip(closes, closes[1:])]
+    losses = [max(a - b, 0) for a, b in zip(closes, closes[1:])]
+    avg_gain = sum(gains[:period]) / period
+    avg_loss = sum(losses[:period]) / period
+    out = [None] * len(closes)
+    for i in range(period, len(gains)):
+        avg_gain = (avg_gain * (period - 1) + gains[i]) / period
+        avg_loss = (avg_loss * (period - 1) + losses[i]) / period
+        out[i + 1] = 100 - 100 / (1 + avg_gain / avg_loss) if avg_loss else 100.0
+    return out
+
+def list_bollinger(closes, period=20):
+    out = []
+    for i in range(period - 1, len(closes)):
+        window = closes[i - period + 1:i + 1]
+        mean = sum(window) / period
+        std = (sum((x - mean) ** 2 for x in window) / period) ** 0.5
+        out.append((mean, mean + 2 * std, mean - 2 * std))
+    return out
+
+def timed(label, fn, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    print(f"{label:<48} {best * 1000:10.2f} ms")
+    return best
+
+def make_candles(rng, n):
+    close = 20000 + np.cumsum(rng.normal(0, 5, n))
+    high = close + rng.random(n) * 10
+    low = close - rng.random(n) * 10
+    volume = rng.integers(100, 10000, n).astype(np.float64)
+    return np.column_stack([np.arange(n), close, high, low, close, volume])
+
+def main():
+    rng = np.random.default_rng(7)
+    universe = {f'SYM{i}': make_candles(rng, CANDLES) for i in range(SYMBOLS)}
+    universe_lists = {key: candles.tolist() for key, candles in universe.items()}
+    long_candles = make_candles(rng, LONG_SERIES)
+    long_close = long_candles[:, 4]
+    long_close_list = long_close.tolist()
+
+    print(f"{SYMBOLS} symbols x {CANDLES} candles")
+    timed("list: old trend check (plain averages)",
+          lambda: [list_trend_direction([c[4] for c in rows]) for rows in universe_lists.values()])
+    timed("list: EMA9/EMA21/RSI14/Bollinger loops",
+          lambda: [(list_ema(closes, 9), list_ema(closes, 21), list_rsi(closes), list_bollinger(closes))
+                   for closes in ([c[4] for c in rows] for rows in universe_lists.values())])
+    timed("numpy: per-symbol compute_indicators (all)",
+          lambda: [indicators.compute_indicators(rows) for rows in universe_lists.values()])
+    timed("numpy: compute_batch (all, stacked 2-D)",
+          lambda: indicators.compute_batch(universe_lists))
+    timed("numpy: compute_batch (no supertrend)",
+          lambda: indicators.compute_batch(universe_lists, tuple(i for i in indicators.INDICATORS if i != 'supertrend')))
+
+    print(f"\nsingle series x {LONG_SERIES} candles")
+    timed("list: EMA21", lambda: list_ema(long_close_list, 21))
+    timed("numpy: EMA21", lambda: indicators.ema(long_close, 21))
+    timed("list: RSI14", lambda: list_rsi(long_close_list))
+    timed("numpy: RSI14", lambda: indicators.rsi(long_close))
+    timed("list: Bollinger(20)", lambda: list_bollinger(long_close_list), repeat=1)
+    timed("numpy: Bollinger(20)", lambda: indicators.bollinger(long_close))
+    timed("numpy: SuperTrend(10, 3)", lambda: indicators.supertrend(long_candles[:, 2], long_candles[:, 3], long_close))
+
+    # Sanity check: both implementations agree
+    drift = np.nanmax(np.abs(indicators.ema(long_close, 21)[20:] - np.array(list_ema(long_close_list, 21)[20:])))
+    print(f"\nmax |EMA21 numpy - list| = {drift:.2e}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+import sqlite3
+import time
+import pytest
+from app import database
+from app.services import iv_history_service
+
+@pytest.fixture
+def iv_db(monkeypatch):
+    conn = sqlite3.connect(':memory:')
+    for version, _, statements in database.MIGRATIONS:
+        if version == 5:
+            for statement in statements:
+                conn.execute(statement)
+    monkeypatch.setattr(iv_history_service, 'get_connection', lambda: conn)
+    monkeypatch.setattr(iv_history_service, '_DISTRIBUTIONS', {})
+    return conn
+
+def test_first_snapshot_after_restart_is_counted_once(iv_db):
+    now = int(time.time())
+    iv_db.executemany('INSERT INTO iv_history (underlying, ts, iv) VALUES (?, ?, ?)',
+                      [('NIFTY', now - 86400 * day, 0.10 + day / 100) for day in range(1, 4)])
+
+    iv_history_service.record_iv('NIFTY', 0.20, ts=now)
+
+    for distribution in iv_history_service._DISTRIBUTIONS['NIFTY'].values():
+        assert distribution.sorted.count(0.20) == 1
+        assert len(distribution) == 4
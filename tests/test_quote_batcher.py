@@ -0,0 +1,35 @@
+import threading
+import time
+from app.services import rate_limiter
+from app.services.quote_batcher import QuoteBatcher
+from app.services.rate_limiter import PRIORITY_EXIT, PRIORITY_UI
+
+def _tokens(prefix, count):
+    return {'NFO': [f'{prefix}{i}' for i in range(count)]}
+
+def test_late_exit_quote_goes_out_before_queued_ui_payloads(monkeypatch):
+    # Five slots a second keeps the test short; the batcher waits on the limiter between calls
+    monkeypatch.setitem(rate_limiter.RATE_LIMITS, 'quote', (5.0, 1))
+    sent = []
+    first_sent = threading.Event()
+
+    def fetch(exchange_tokens, mode, priority):
+        sent.append(priority)
+        first_sent.set()
+        tokens = [(ex, token) for ex, group in exchange_tokens.items() for token in group]
+        return {'fetched': [{'exchange': ex, 'symbolToken': token} for ex, token in tokens], 'unfetched': []}
+
+    batcher = QuoteBatcher('test-preempt', fetch)
+    results = {}
+    ui = threading.Thread(target=lambda: results.setdefault('ui', batcher.get_quotes(_tokens('u', 200), priority=PRIORITY_UI)))
+    ui.start()
+    assert first_sent.wait(5)
+    # Arrives while the rest of the UI batch is queued behind the limiter
+    time.sleep(0.05)
+    exit_result = batcher.get_quotes(_tokens('x', 1), priority=PRIORITY_EXIT)
+    ui.join(10)
+
+    assert sent[:2] == [PRIORITY_UI, PRIORITY_EXIT]
+    assert sent.count(PRIORITY_UI) == 4
+    assert [item['symbolToken'] for item in exit_result['fetched']] == ['x0']
+    assert len(results['ui']['fetched']) == 200
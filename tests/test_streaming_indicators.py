@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta
+import numpy as np
+from app.services import trading_service
+from app.utils import indicators
+from app.utils.helpers import IST
+
+SESSION_OPEN = IST.localize(datetime(2026, 10, 16, 9, 15))
+
+def _bars(start, count, base=100.0):
+    """1-minute [ts, o, h, l, c, v] bars with epoch-second timestamps"""
+    bars = []
+    for i in range(count):
+        ts = int((start + timedelta(minutes=i)).timestamp())
+        close = base + (i % 7) - 3
+        bars.append([ts, close, close + 1.0, close - 1.0, close, 100 + 10 * i])
+    return bars
+
+def _broker(bars):
+    """Same bars as the broker returns them, with ISO timestamps"""
+    return [[datetime.fromtimestamp(bar[0], IST).isoformat(), *bar[1:]] for bar in bars]
+
+def _vwap(bars):
+    return indicators.compute_indicators(bars, which=('vwap',))['vwap'][-1]
+
+def test_session_labels_match_for_iso_and_epoch_times():
+    bars = _bars(SESSION_OPEN, 3)
+    iso = [bar[0] for bar in _broker(bars)]
+    epoch = [bar[0] for bar in bars]
+    assert indicators.session_days(iso).tolist() == indicators.session_days(epoch).tolist()
+    assert indicators.session_day(iso[0]) == indicators.session_day(epoch[0])
+
+def test_vwap_carries_over_from_seed_to_live_bars():
+    token = 'test-vwap'
+    bars = _bars(SESSION_OPEN, 60)
+    trading_service.seed_indicators(token, _broker(bars[:40]))
+    try:
+        for bar in bars[40:]:
+            trading_service._on_resampled_close(token, 1, bar)
+        assert np.isclose(trading_service.INDICATOR_STATE[token].vwap.value, _vwap(bars))
+    finally:
+        trading_service.INDICATOR_STATE.pop(token, None)
+
+def test_vwap_resets_on_the_next_session():
+    token = 'test-vwap-next-day'
+    today = _bars(SESSION_OPEN, 30)
+    tomorrow = _bars(SESSION_OPEN + timedelta(days=1), 5, base=120.0)
+    trading_service.seed_indicators(token, _broker(today))
+    try:
+        for bar in tomorrow:
+            trading_service._on_resampled_close(token, 1, bar)
+        assert np.isclose(trading_service.INDICATOR_STATE[token].vwap.value, _vwap(tomorrow))
+    finally:
+        trading_service.INDICATOR_STATE.pop(token, None)